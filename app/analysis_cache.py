@@ -0,0 +1,37 @@
+import os
+import json
+import hashlib
+from app.cache import TieredCache
+from app.static_analyzer_tools import ANALYZER_CONFIG, extract_source
+
+# Reports kept in this process, and bytes/lifetime of the shared Redis tier
+ANALYSIS_CACHE_LOCAL_ENTRIES = int(os.getenv("ANALYSIS_CACHE_LOCAL_ENTRIES", "2048"))
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+
+analysis_cache = TieredCache(
+    "analysis", ANALYSIS_CACHE_LOCAL_ENTRIES, ANALYSIS_CACHE_MAX_BYTES, ttl=ANALYSIS_CACHE_TTL
+)
+
+_CONFIG_FINGERPRINT = json.dumps(ANALYZER_CONFIG, sort_keys=True)
+
+
+def normalize_source(code_hunk: str) -> str:
+    """
+    Reduces a hunk to what the analyzer actually sees: formatting and line endings removed,
+    trailing whitespace and blank lines dropped. Line positions are preserved.
+    """
+    source = extract_source(code_hunk).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in source.split("\n")).rstrip("\n")
+
+
+def analysis_cache_key(code_hunk: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(_CONFIG_FINGERPRINT.encode())
+    digest.update(b"\0")
+    digest.update(normalize_source(code_hunk).encode("utf-8", errors="replace"))
+    return digest.hexdigest()
+
+
+def get_analysis_cache_stats():
+    return analysis_cache.stats()
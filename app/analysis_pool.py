@@ -0,0 +1,146 @@
+import os
+import sys
+import uuid
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.static_analyzer_tools import run_static_analyzer
+from app.analysis_cache import analysis_cache, analysis_cache_key
+from app.file_classifier import detect_language, has_static_analyzer
+from app.fetch_pr_github import get_formatted_filename
+from app.metrics import stage
+from app.logging_wrapper import logger
+
+# Processes running static analysis, one pool per worker process (i.e. per host with the threads
+# pool, which runs all tasks in that one process); defaults to one per core
+ANALYSIS_POOL_WORKERS = int(os.getenv("ANALYSIS_POOL_WORKERS", str(os.cpu_count() or 1)))
+
+# Seconds a worker holds the fleet-wide claim on analyzing some content; other workers wait for
+# its report meanwhile, and take over if it hasn't arrived by then
+ANALYSIS_CLAIM_SECONDS = int(os.getenv("ANALYSIS_CLAIM_SECONDS", "60"))
+# Seconds between two looks for the report of content another worker is analyzing
+ANALYSIS_CLAIM_POLL_SECONDS = float(os.getenv("ANALYSIS_CLAIM_POLL_SECONDS", "0.1"))
+
+_pool = None
+# Analyses currently running in this process, by cache key
+_in_flight = {}
+
+
+def _warm_up():
+    """Runs in each pool process: imports the analyzer so the first real job doesn't pay for it."""
+    import app.static_analyzer_tools  # noqa: F401
+
+
+def _noop():
+    return None
+
+
+def _build_pool():
+    if multiprocessing.current_process().daemon:
+        # Celery prefork children are daemonic and may not start processes; run the worker with
+        # --pool threads (as docker-compose does) to get the process pool
+        logger.warning("Daemonic worker process can't start the analysis pool, running static analysis in threads")
+        return ThreadPoolExecutor(max_workers=ANALYSIS_POOL_WORKERS, thread_name_prefix="analysis")
+    # Spawned processes import app.* through our sys.path, which lacks the project root when the
+    # celery command started the worker (it only adds the working directory while loading -A)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.append(root)
+    try:
+        pool = ProcessPoolExecutor(
+            max_workers=ANALYSIS_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_up,
+        )
+        # Start every process now instead of on the first PR
+        for future in [pool.submit(_noop) for _ in range(ANALYSIS_POOL_WORKERS)]:
+            future.result()
+        return pool
+    except (AssertionError, OSError, BrokenProcessPool) as e:
+        logger.warning(f"Process pool unavailable ({e}), running static analysis in threads")
+        return ThreadPoolExecutor(max_workers=ANALYSIS_POOL_WORKERS, thread_name_prefix="analysis")
+
+
+def start_analysis_pool():
+    """Creates and warms the shared analysis pool; safe to call more than once."""
+    global _pool
+    if _pool is None:
+        _pool = _build_pool()
+    return _pool
+
+
+def shutdown_analysis_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def _run_in_pool(code_hunk: str) -> str:
+    """
+    Runs run_static_analyzer in the shared pool so CPU-bound analysis never blocks the event loop.
+    A broken pool (e.g. a killed process) is rebuilt once before giving up.
+    """
+    loop = asyncio.get_running_loop()
+    async with stage("static_analysis"):
+        try:
+            return await loop.run_in_executor(start_analysis_pool(), run_static_analyzer, code_hunk)
+        except BrokenProcessPool:
+            logger.warning("Analysis pool broke, rebuilding it")
+            shutdown_analysis_pool()
+            return await loop.run_in_executor(start_analysis_pool(), run_static_analyzer, code_hunk)
+
+
+async def _analyze_once(key, code_hunk):
+    """
+    Analyzes content no other worker is analyzing and stores the report; if one is, waits for
+    its report in the shared cache instead (or takes over once its claim has expired).
+    """
+    owner = uuid.uuid4().hex
+    while not await analysis_cache.claim(key, owner, ANALYSIS_CLAIM_SECONDS):
+        await asyncio.sleep(ANALYSIS_CLAIM_POLL_SECONDS)
+        cached = await analysis_cache.get_remote(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+    try:
+        # The previous holder may have stored its report just before releasing the claim
+        cached = await analysis_cache.get_remote(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+        report = await _run_in_pool(code_hunk)
+        await analysis_cache.set(key, report)
+        return report
+    finally:
+        await analysis_cache.release(key, owner)
+
+
+def _analysis_done(key, future):
+    _in_flight.pop(key, None)
+    if not future.cancelled():
+        future.exception()  # retrieved here in case every caller was cancelled meanwhile
+
+
+async def analyze_code(code_hunk: str) -> str:
+    """
+    Returns the static analysis report for a hunk, memoized by a hash of its normalized content
+    and the analyzer config. Concurrent requests for the same content share one analysis, in this
+    process and across workers. The analysis and its caching outlive a cancelled caller.
+    Only languages with an analyzer are analyzed (by the file name in the hunk's header; a hunk
+    without one is taken as Python); others get a one-line report without using the pool.
+    """
+    filename = get_formatted_filename(code_hunk)
+    language = detect_language(filename) if filename else "python"
+    if not has_static_analyzer(language):
+        return f"No static analyzer for {language} files; review the code directly."
+
+    key = analysis_cache_key(code_hunk)
+    cached = await analysis_cache.get(key)
+    if cached is not None:
+        return cached.decode("utf-8")
+
+    future = _in_flight.get(key)
+    if future is None:
+        future = _in_flight[key] = asyncio.ensure_future(_analyze_once(key, code_hunk))
+        future.add_done_callback(lambda done: _analysis_done(key, done))
+    return await asyncio.shield(future)
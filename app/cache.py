@@ -0,0 +1,262 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from app.redis_store import r
+from app.logging_wrapper import logger
+
+# Seconds to stop talking to Redis after a connection error
+CACHE_BACKOFF_SECONDS = 30
+
+# Entries whose TTL ran out checked per write, oldest first, so their bytes leave the budget
+CACHE_RECONCILE_BATCH = 16
+
+# Stores an entry, then drops the oldest entries Redis has already expired and evicts least
+# recently used ones while over budget, in one atomic step.
+# KEYS: sizes, lru, bytes, stats. ARGV: key, value, ttl, now, max_bytes, entry key prefix, batch
+SET_SCRIPT = """
+local prefix = ARGV[6]
+local old = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if tonumber(ARGV[3]) > 0 then
+    redis.call('SET', prefix .. ARGV[1], ARGV[2], 'EX', ARGV[3])
+else
+    redis.call('SET', prefix .. ARGV[1], ARGV[2])
+end
+redis.call('HSET', KEYS[1], ARGV[1], #ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+local total = redis.call('INCRBY', KEYS[3], #ARGV[2] - old)
+
+local function drop(key, counter)
+    local size = tonumber(redis.call('HGET', KEYS[1], key) or '0')
+    redis.call('ZREM', KEYS[2], key)
+    redis.call('HDEL', KEYS[1], key)
+    redis.call('HINCRBY', KEYS[4], counter, 1)
+    return redis.call('INCRBY', KEYS[3], -size)
+end
+
+for _, key in ipairs(redis.call('ZRANGE', KEYS[2], 0, tonumber(ARGV[7]) - 1)) do
+    if redis.call('EXISTS', prefix .. key) == 0 then
+        total = drop(key, 'expirations')
+    end
+end
+while total > tonumber(ARGV[5]) do
+    local oldest = redis.call('ZRANGE', KEYS[2], 0, 0)
+    if #oldest == 0 then
+        break
+    end
+    local counter = redis.call('DEL', prefix .. oldest[1]) == 1 and 'evictions' or 'expirations'
+    total = drop(oldest[1], counter)
+end
+return total
+"""
+
+# Drops a fill claim only if `owner` still holds it (it may have expired and been taken over)
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLRUCache:
+    """
+    Size-bounded cache stored in Redis under `cache:{namespace}:*`.
+    Entries expire after `ttl` seconds; once the stored bytes exceed `max_bytes`
+    the least recently used entries are evicted. Writes and their accounting are atomic, and
+    expired entries are taken out of the accounting by later writes. Hits and misses are counted in Redis,
+    so the counters cover every worker sharing the cache.
+    Redis errors never propagate: the cache just behaves as a miss for a while.
+    """
+
+    def __init__(self, namespace, max_bytes, ttl=None, client=None):
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.client = client or r
+        self._disabled_until = 0.0
+        self._scripts = {}
+
+    def _key(self, *parts):
+        return ":".join(("cache", self.namespace) + parts)
+
+    def _available(self):
+        return time.monotonic() >= self._disabled_until
+
+    def _script(self, source):
+        if source not in self._scripts:
+            self._scripts[source] = self.client.register_script(source)
+        return self._scripts[source]
+
+    def _fail(self, e):
+        logger.warning(f"Cache '{self.namespace}' unavailable, bypassing for {CACHE_BACKOFF_SECONDS}s: {e}")
+        self._disabled_until = time.monotonic() + CACHE_BACKOFF_SECONDS
+
+    def incr(self, counter, amount=1):
+        if not self._available():
+            return
+        try:
+            self.client.hincrby(self._key("stats"), counter, amount)
+        except Exception as e:
+            self._fail(e)
+
+    def get(self, key, count=True):
+        """Returns the cached bytes for `key`, or None. Refreshes the entry's LRU position."""
+        if not self._available():
+            return None
+        try:
+            value = self.client.get(self._key("entry", key))
+            pipe = self.client.pipeline(transaction=False)
+            if value is not None:
+                pipe.zadd(self._key("lru"), {key: time.time()})
+            if count:
+                pipe.hincrby(self._key("stats"), "hits" if value is not None else "misses", 1)
+            pipe.execute()
+            return value
+        except Exception as e:
+            self._fail(e)
+            return None
+
+    def get_many(self, keys):
+        """Returns {key: bytes} for the cached keys among `keys`, in one round-trip."""
+        if not keys or not self._available():
+            return {}
+        try:
+            values = self.client.mget([self._key("entry", key) for key in keys])
+            found = {key: value for key, value in zip(keys, values) if value is not None}
+            now = time.time()
+            pipe = self.client.pipeline(transaction=False)
+            if found:
+                pipe.zadd(self._key("lru"), {key: now for key in found})
+                pipe.hincrby(self._key("stats"), "hits", len(found))
+            if len(found) < len(keys):
+                pipe.hincrby(self._key("stats"), "misses", len(keys) - len(found))
+            pipe.execute()
+            return found
+        except Exception as e:
+            self._fail(e)
+            return {}
+
+    def set(self, key, value, ttl=None):
+        """Stores `value` (bytes or str) under `key` and evicts old entries if over budget."""
+        if not self._available():
+            return
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        if len(value) > self.max_bytes:
+            return
+        ttl = ttl or self.ttl
+        try:
+            self._script(SET_SCRIPT)(
+                keys=[self._key("sizes"), self._key("lru"), self._key("bytes"), self._key("stats")],
+                args=[key, value, int(ttl or 0), time.time(), self.max_bytes, self._key("entry", ""),
+                      CACHE_RECONCILE_BATCH],
+            )
+        except Exception as e:
+            self._fail(e)
+
+    def claim(self, key, owner, ttl):
+        """
+        Claims the right to compute the value of `key` for `ttl` seconds, so only one worker of
+        the fleet does. True if claimed, or if Redis is unavailable (every worker computes then).
+        """
+        if not self._available():
+            return True
+        try:
+            return bool(self.client.set(self._key("claim", key), owner, nx=True, ex=max(int(ttl), 1)))
+        except Exception as e:
+            self._fail(e)
+            return True
+
+    def release(self, key, owner):
+        if not self._available():
+            return
+        try:
+            self._script(RELEASE_SCRIPT)(keys=[self._key("claim", key)], args=[owner])
+        except Exception as e:
+            self._fail(e)
+
+    def stats(self):
+        """Returns the shared counters plus the current size of the cache."""
+        try:
+            raw = self.client.hgetall(self._key("stats"))
+            stats = {k.decode(): int(v) for k, v in raw.items()}
+            stats["bytes"] = int(self.client.get(self._key("bytes")) or 0)
+            stats["entries"] = self.client.zcard(self._key("lru"))
+            return stats
+        except Exception as e:
+            self._fail(e)
+            return {}
+
+
+class TieredCache:
+    """
+    In-process LRU of at most `max_entries` values in front of a shared RedisLRUCache.
+    Remote hits are copied into the local tier. Values are bytes (str is encoded).
+    """
+
+    def __init__(self, namespace, max_entries, max_bytes, ttl=None, client=None):
+        self.max_entries = max_entries
+        self.remote = RedisLRUCache(namespace, max_bytes, ttl=ttl, client=client)
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+
+    def _get_local(self, key):
+        with self._lock:
+            value = self._local.get(key)
+            if value is not None:
+                self._local.move_to_end(key)
+            return value
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._local[key] = value
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    async def get(self, key):
+        value = self._get_local(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+        value = await asyncio.to_thread(self.remote.get, key)
+        if value is not None:
+            self.remote_hits += 1
+            self._set_local(key, value)
+            return value
+        self.misses += 1
+        return None
+
+    async def get_remote(self, key):
+        """Looks for a value another worker may have stored since, without counting a lookup."""
+        value = await asyncio.to_thread(self.remote.get, key, False)
+        if value is not None:
+            self._set_local(key, value)
+        return value
+
+    async def claim(self, key, owner, ttl):
+        return await asyncio.to_thread(self.remote.claim, key, owner, ttl)
+
+    async def release(self, key, owner):
+        await asyncio.to_thread(self.remote.release, key, owner)
+
+    async def set(self, key, value):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        self._set_local(key, value)
+        await asyncio.to_thread(self.remote.set, key, value)
+
+    def stats(self):
+        lookups = self.local_hits + self.remote_hits + self.misses
+        return {
+            "local_hits": self.local_hits,
+            "remote_hits": self.remote_hits,
+            "misses": self.misses,
+            "hit_rate": (self.local_hits + self.remote_hits) / lookups if lookups else 0.0,
+            "local_entries": len(self._local),
+            "remote": self.remote.stats(),
+        }
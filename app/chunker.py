@@ -0,0 +1,161 @@
+import os
+import ast
+from app.static_analyzer_tools import FORMATTED_HEADER_REGEX, FORMATTED_LINE_REGEX, extract_source
+from app.review_batcher import estimate_tokens
+
+# Formatted files estimated above this many tokens are split into chunks reviewed separately
+LLM_CHUNK_TOKEN_BUDGET = int(os.getenv("LLM_CHUNK_TOKEN_BUDGET", "6000"))
+# Cap on the shared outline (imports and signatures) sent along with every chunk
+LLM_CHUNK_OUTLINE_TOKENS = int(os.getenv("LLM_CHUNK_OUTLINE_TOKENS", "800"))
+
+
+def _numbered_lines(pr_file):
+    """Splits formatted text into its header and {line number: formatted line}."""
+    lines = pr_file.splitlines()
+    header = lines[0] if lines and FORMATTED_HEADER_REGEX.match(lines[0]) else None
+    numbered = {}
+    for line in lines[1:] if header else []:
+        m = FORMATTED_LINE_REGEX.match(line)
+        if m:
+            numbered[int(m.group(1))] = line
+    return header, numbered
+
+
+def _units(body, start, end):
+    """
+    Splits lines start..end into (first, last) units at the boundaries of the given statements.
+    Comments and blank lines before a statement belong to it.
+    """
+    units = []
+    for node in body:
+        node_end = min(node.end_lineno, end)
+        if node_end < start:
+            continue
+        units.append([start, node_end, node])
+        start = node_end + 1
+    if start <= end:
+        if units:
+            units[-1][1] = end
+        else:
+            units.append([start, end, None])
+    return units
+
+
+def _split(first, last, node, cost, budget):
+    """Yields (first, last) pieces of one unit, going into class bodies and then by lines."""
+    if cost(first, last) <= budget:
+        yield first, last
+        return
+    if isinstance(node, ast.ClassDef) and len(node.body) > 1:
+        # Keep the class line (and docstring/attributes up to the first method) with the first member
+        members = _units(node.body, first, last)
+        for member_first, member_last, member in members:
+            yield from _split(member_first, member_last, member, cost, budget)
+        return
+    piece = first
+    for line in range(first, last + 1):
+        if line > piece and cost(piece, line) > budget:
+            yield piece, line - 1
+            piece = line
+    yield piece, last
+
+
+def _outline(tree, numbered):
+    """Import lines and def/class signature lines of the module, as formatted lines."""
+    wanted = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            wanted.extend(range(node.lineno, node.end_lineno + 1))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            wanted.append(node.lineno)
+            if isinstance(node, ast.ClassDef):
+                wanted.extend(
+                    child.lineno for child in node.body
+                    if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))
+                )
+    outline, used = [], 0
+    for line in wanted:
+        if line not in numbered:
+            continue
+        used += estimate_tokens(numbered[line])
+        if used > LLM_CHUNK_OUTLINE_TOKENS:
+            outline.append("...")
+            break
+        outline.append(numbered[line])
+    return "\n".join(outline)
+
+
+def chunk_file(pr_file, budget=None):
+    """
+    Splits formatted file text into chunks of at most `budget` estimated tokens, cutting at
+    top-level function/class boundaries (and between methods of a class too big on its own).
+    Code that doesn't parse is cut by lines. Chunks keep the file header and absolute line numbers.
+    Returns (outline, [(first_line, last_line, chunk_text)]); a file within budget is one chunk.
+    """
+    budget = budget or LLM_CHUNK_TOKEN_BUDGET
+    header, numbered = _numbered_lines(pr_file)
+    if not numbered or estimate_tokens(pr_file) <= budget:
+        return "", [(min(numbered, default=1), max(numbered, default=1), pr_file)]
+
+    first, last = min(numbered), max(numbered)
+    sizes = {line: estimate_tokens(text) for line, text in numbered.items()}
+
+    def cost(start, end):
+        return sum(sizes.get(line, 0) for line in range(start, end + 1))
+
+    try:
+        tree = ast.parse(extract_source(pr_file))
+    except (SyntaxError, ValueError):
+        tree = None
+    units = _units(tree.body, first, last) if tree is not None else [[first, last, None]]
+    outline = _outline(tree, numbered) if tree is not None else ""
+    budget = max(budget - estimate_tokens(outline) - estimate_tokens(header), budget // 4)
+
+    # Pack consecutive pieces greedily so each chunk is as full as the budget allows. The tail
+    # of a split class is indented, so it never shares a chunk with the top-level code after it.
+    ranges = []
+    closed = False
+    for unit_first, unit_last, node in units:
+        pieces = list(_split(unit_first, unit_last, node, cost, budget))
+        for piece_first, piece_last in pieces:
+            if ranges and not closed and cost(ranges[-1][0], piece_last) <= budget:
+                ranges[-1][1] = piece_last
+            else:
+                ranges.append([piece_first, piece_last])
+            closed = False
+        closed = len(pieces) > 1
+
+    chunks = []
+    for start, end in ranges:
+        body = [numbered[line] for line in range(start, end + 1) if line in numbered]
+        if body:
+            chunks.append((start, end, "\n".join([header] + body)))
+    return outline, chunks
+
+
+def merge_chunk_reviews(file_name, chunk_ranges, reviews):
+    """
+    Merges per-chunk reviews into one review of the whole file. Issue lines are absolute; a line
+    that only makes sense relative to its chunk is shifted by the chunk's first line.
+    Numeric summary values are added up, anything else is collected per chunk.
+    """
+    issues, seen, summary = [], set(), {}
+    for (first, last), review in zip(chunk_ranges, reviews):
+        for issue in review.get("issues") or []:
+            line = issue.get("line")
+            if isinstance(line, int) and not first <= line <= last and 1 <= line <= last - first + 1:
+                issue = dict(issue, line=line + first - 1)
+            key = (issue.get("line"), issue.get("type"), issue.get("description"))
+            if key not in seen:
+                seen.add(key)
+                issues.append(issue)
+        for key, value in (review.get("summary") or {}).items():
+            if isinstance(value, (int, float)) and isinstance(summary.get(key, 0), (int, float)):
+                summary[key] = summary.get(key, 0) + value
+            else:
+                summary.setdefault(key, [])
+                if not isinstance(summary[key], list):
+                    summary[key] = [summary[key]]
+                summary[key].append(value)
+    issues.sort(key=lambda issue: issue.get("line") if isinstance(issue.get("line"), int) else 0)
+    return {"file_name": file_name, "issues": issues, "summary": summary}
@@ -0,0 +1,69 @@
+import os
+from app.redis_store import r, get_task_status
+from app.fetch_pr_github import parse_repo_url, get_pr_head_sha, GITHUB_TOKEN, REVIEW_MODE
+from app.logging_wrapper import logger
+
+# Seconds a submission answers identical ones with its task (and its result once finished)
+DEDUP_WINDOW_SECONDS = int(os.getenv("DEDUP_WINDOW_SECONDS", "900"))
+
+
+def submission_key(req, head_sha=None):
+    """
+    Identifies a review by repository, PR, head SHA and review mode. The head SHA is always
+    looked up on GitHub with the caller's token (`head_sha` is one already looked up that way),
+    never taken from the request: joining a task hands out its results, so the caller must be
+    able to read the PR. Raises if the lookup fails.
+    """
+    owner, repo = parse_repo_url(req.repo_url)
+    if head_sha is None:
+        head_sha = get_pr_head_sha(owner, repo, req.pr_number, req.github_token or GITHUB_TOKEN)
+    if not head_sha:
+        raise ValueError(f"GitHub returned no head SHA for {owner}/{repo}#{req.pr_number}")
+    mode = req.review_mode or REVIEW_MODE
+    return f"submission:{owner.lower()}/{repo.lower()}:{req.pr_number}:{head_sha}:{mode}"
+
+
+def claim_submission(req, task_id, head_sha=None):
+    """
+    Single-flight for /analyze-pr. Returns (key, existing_task_id, meta): if an identical
+    submission is queued, running or finished within DEDUP_WINDOW_SECONDS its task is returned,
+    otherwise the key is claimed for `task_id` and existing_task_id is None.
+    `head_sha` is the PR's head as read from GitHub with the caller's token, if already known.
+    `force` always claims the key. Any Redis or lookup error just disables dedup for the request,
+    so callers GitHub won't show the PR to never join another caller's task.
+    """
+    try:
+        key = submission_key(req, head_sha)
+    except Exception as e:
+        logger.warning(f"Skipping dedup of {req.repo_url}#{req.pr_number}: {e}")
+        return None, None, None
+    try:
+        if req.force:
+            r.set(key, task_id, ex=DEDUP_WINDOW_SECONDS)
+            return key, None, None
+        while not r.set(key, task_id, nx=True, ex=DEDUP_WINDOW_SECONDS):
+            existing = r.get(key)
+            if existing is None:
+                continue  # expired in between, try to claim it again
+            existing = existing.decode()
+            meta = get_task_status(existing)
+            if meta and meta["status"] != "failed":
+                return key, existing, meta
+            # The previous run failed or is gone: this submission takes over
+            r.set(key, task_id, ex=DEDUP_WINDOW_SECONDS)
+            break
+        return key, None, None
+    except Exception as e:
+        logger.warning(f"Redis unavailable, skipping dedup of {key}: {e}")
+        return None, None, None
+
+
+def release_submission(key, task_id):
+    """Frees the key if `task_id` still holds it, e.g. when queueing the task failed."""
+    if key is None:
+        return
+    try:
+        if r.get(key) == task_id.encode():
+            r.delete(key)
+    except Exception as e:
+        logger.warning(f"Could not release {key}: {e}")
@@ -3,16 +3,31 @@ import os
 import re
 import base64
 import json
-import aiohttp
 import asyncio
-import base64
-from app.logging_wrapper import log_async_exceptions,log_exceptions
+from contextlib import aclosing
+from app.logging_wrapper import log_async_exceptions,log_exceptions,logger
+from app.github_scheduler import github_get
+from app.github_archive import fetch_archive_members, iter_archive_members
+from app.parser import split_diff_by_file, changed_line_ranges
+from app.github_cache import conditional_get, get_cached_blobs, store_blobs
+from app.file_classifier import classify_files, parse_gitattributes, FILE_USE_GITATTRIBUTES
 
-# GitHub API base URL
-API_URL = "https://api.github.com"
+# GitHub API base URL (GitHub Enterprise, or a local stand-in such as the benchmark's fake server)
+API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
 
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 
+# Max number of file contents fetched at the same time for one PR
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "16"))
+
+# PRs with more changed files than this are fetched from a single repository tarball
+ARCHIVE_FETCH_THRESHOLD = int(os.getenv("ARCHIVE_FETCH_THRESHOLD", "100"))
+
+# "full" reviews whole files, "diff" reviews only the changed regions of each file
+REVIEW_MODE = os.getenv("REVIEW_MODE", "full")
+# Lines of head-file context kept around each change in diff mode
+DIFF_CONTEXT_LINES = int(os.getenv("DIFF_CONTEXT_LINES", "5"))
+
 @log_exceptions
 def parse_repo_url(url):
     """Parses GitHub URL to extract owner and repo name."""
@@ -34,6 +49,18 @@ def get_github_headers(token):
         "Accept": "application/vnd.github.v3+json",
     }
 
+def get_pr_summary(owner, repo, pr_number, token, timeout=5):
+    """PR JSON (head SHA, changed_files, additions, ...) in one blocking call, for callers outside the event loop."""
+    url = f"{API_URL}/repos/{owner}/{repo}/pulls/{pr_number}"
+    resp = requests.get(url, headers=get_github_headers(token), timeout=timeout)
+    if resp.status_code != 200:
+        raise Exception(f"GitHub API Error: {resp.status_code} {resp.text}")
+    return resp.json()
+
+def get_pr_head_sha(owner, repo, pr_number, token, timeout=5):
+    """Current head SHA of a PR in one blocking call."""
+    return get_pr_summary(owner, repo, pr_number, token, timeout).get('head', {}).get('sha')
+
 def format_pr_details_to_text(pr_data):
     """Formats PR JSON data into a human-readable text string."""
     details = []
@@ -98,13 +125,8 @@ async def fetch_pr_details(owner, repo, pr_number, token):
     url = f"{API_URL}/repos/{owner}/{repo}/pulls/{pr_number}"
     headers = get_github_headers(token)
 
-    async with aiohttp.ClientSession(headers=headers) as session:
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                raise Exception(f"GitHub API Error: {resp.status} {text}")
-            data = await resp.json()
-            return format_pr_details_to_text(data), data
+    data, _ = await conditional_get(url, headers)
+    return format_pr_details_to_text(data), data
 
 @log_async_exceptions
 async def fetch_pr_files(owner: str, repo: str, pr_number: int, token: str) -> list:
@@ -112,42 +134,38 @@ async def fetch_pr_files(owner: str, repo: str, pr_number: int, token: str) -> l
     Fetch the list of files in a PR, paging concurrently.
     """
     url = f"{API_URL}/repos/{owner}/{repo}/pulls/{pr_number}/files"
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    headers = get_github_headers(token)
+
+    async def fetch_page(page):
+        return await conditional_get(f"{url}?per_page=100&page={page}", headers)
+
+    # 1) First request to get page count from Link header
+    first_page, link = await fetch_page(1)
+
+    # 2) Parse total number of pages from 'Link' header, if present
+    last_page = 1
+    match = re.search(r'<[^>]+[&?]page=(\d+)>; rel="last"', link)
+    if match:
+        last_page = int(match.group(1))
+
+    # 3) If there's more than one page, fetch the rest concurrently
+    results = []
+    if last_page > 1:
+        pages = await asyncio.gather(*(fetch_page(page) for page in range(2, last_page + 1)))
+        for page_files, _ in pages:
+            results.extend(page_files)
 
-    async with aiohttp.ClientSession(headers=headers) as session:
-        # 1) First request to get page count from Link header
-        async with session.get(f"{url}?per_page=100&page=1") as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                raise Exception(f"GitHub API Error: {resp.status} {text}")
-            first_page = await resp.json()
-            link = resp.headers.get("Link", "")
-            
-        # 2) Parse total number of pages from 'Link' header, if present
-        last_page = 1
-        match = re.search(r'<[^>]+[&?]page=(\d+)>; rel="last"', link)
-        if match:
-            last_page = int(match.group(1))
-
-        # 3) If there's more than one page, fetch the rest concurrently
-        tasks = []
-        for page in range(2, last_page + 1):
-            tasks.append(session.get(f"{url}?per_page=100&page={page}"))
-
-        results = []
-        if tasks:
-            responses = await asyncio.gather(*tasks)
-            for resp in responses:
-                if resp.status != 200:
-                    text = await resp.text()
-                    raise Exception(f"GitHub API Error: {resp.status} {text}")
-                results.extend(await resp.json())
-
-        # Combine first page + the rest
-        return first_page + results
+    # Combine first page + the rest
+    return first_page + results
+
+@log_async_exceptions
+async def fetch_pr_diff(owner, repo, pr_number, token):
+    """Asynchronously fetches the unified diff of the whole PR."""
+    url = f"{API_URL}/repos/{owner}/{repo}/pulls/{pr_number}"
+    headers = get_github_headers(token)
+    headers["Accept"] = "application/vnd.github.v3.diff"
+    diff_text, _ = await conditional_get(url, headers, as_text=True)
+    return diff_text
 
 @log_async_exceptions
 async def fetch_file_content(owner: str, repo: str, file_path: str, ref: str, token: str) -> str:
@@ -155,36 +173,105 @@ async def fetch_file_content(owner: str, repo: str, file_path: str, ref: str, to
     url = f"{API_URL}/repos/{owner}/{repo}/contents/{file_path}?ref={ref}"
     headers = get_github_headers(token)
     
-    async with aiohttp.ClientSession(headers=headers) as session:
-        async with session.get(url) as resp:
-            resp.raise_for_status()
-            content_data = await resp.json()
-        
-        # If GitHub returns base64‐encoded content
-        if content_data.get("encoding") == "base64":
-            raw = content_data.get("content") or ""
-            return base64.b64decode(raw).decode("utf-8", errors="replace")
-        
-        # Fallback to download_url if provided
-        download_url = content_data.get("download_url")
-        if download_url:
-            async with session.get(download_url) as dl_resp:
-                dl_resp.raise_for_status()
-                return await dl_resp.text()
-        
-        # Sometimes content is inline but not base64
-        if "content" in content_data:
-            return content_data["content"]
-        
-        # Empty file case
-        if content_data.get("type") == "file" and content_data.get("size") == 0:
-            return ""
-        
-        # Last resort: error message
-        file_type = content_data.get("type", "N/A")
-        file_size = content_data.get("size", "N/A")
-        return (f"Could not decode/retrieve content for {file_path}. "
-                f"Type: {file_type}, Size: {file_size}")
+    async with github_get(url, headers) as resp:
+        resp.raise_for_status()
+        content_data = await resp.json()
+    
+    # If GitHub returns base64‐encoded content
+    if content_data.get("encoding") == "base64":
+        raw = content_data.get("content") or ""
+        return base64.b64decode(raw).decode("utf-8", errors="replace")
+    
+    # Fallback to download_url if provided
+    download_url = content_data.get("download_url")
+    if download_url:
+        async with github_get(download_url, headers) as dl_resp:
+            dl_resp.raise_for_status()
+            return await dl_resp.text()
+    
+    # Sometimes content is inline but not base64
+    if "content" in content_data:
+        return content_data["content"]
+    
+    # Empty file case
+    if content_data.get("type") == "file" and content_data.get("size") == 0:
+        return ""
+    
+    # Last resort: error message
+    file_type = content_data.get("type", "N/A")
+    file_size = content_data.get("size", "N/A")
+    return (f"Could not decode/retrieve content for {file_path}. "
+            f"Type: {file_type}, Size: {file_size}")
+
+
+async def fetch_files_concurrently(owner, repo, filenames, ref, token, concurrency=None):
+    """
+    Fetches the content of several files at once, with at most `concurrency` requests in flight.
+    Returns one dict per filename, in input order: {"filename", "content", "error"}.
+    A failed file gets content None and the exception in "error"; the others are unaffected.
+    """
+    semaphore = asyncio.Semaphore(concurrency or FETCH_CONCURRENCY)
+
+    async def fetch_one(filename):
+        async with semaphore:
+            try:
+                content = await fetch_file_content(owner, repo, filename, ref, token)
+                return {"filename": filename, "content": content, "error": None}
+            except Exception as e:
+                return {"filename": filename, "content": None, "error": e}
+
+    return await asyncio.gather(*(fetch_one(filename) for filename in filenames))
+
+
+@log_async_exceptions
+async def fetch_files_from_archive(owner, repo, filenames, ref, token):
+    """
+    Fetches the given files from one streamed tarball of the repository at `ref`.
+    Returns the same {"filename", "content", "error"} entries as fetch_files_concurrently.
+    """
+    url = f"{API_URL}/repos/{owner}/{repo}/tarball/{ref}"
+    headers = get_github_headers(token)
+    members = await fetch_archive_members(url, headers, filenames)
+    return [
+        {"filename": filename, "content": members[filename], "error": None}
+        if filename in members else
+        {"filename": filename, "content": None, "error": FileNotFoundError(f"{filename} not found in archive for {ref}")}
+        for filename in filenames
+    ]
+
+
+async def download_files(owner, repo, filenames, ref, token):
+    """
+    Picks the fetch strategy for a PR: one tarball above ARCHIVE_FETCH_THRESHOLD files,
+    per-file contents requests otherwise (or when the archive download fails).
+    """
+    if len(filenames) > ARCHIVE_FETCH_THRESHOLD:
+        try:
+            return await fetch_files_from_archive(owner, repo, filenames, ref, token)
+        except Exception as e:
+            logger.warning(f"Archive fetch failed for {owner}/{repo}@{ref}, falling back to per-file fetch: {e}")
+    return await fetch_files_concurrently(owner, repo, filenames, ref, token)
+
+
+async def fetch_files(owner, repo, filenames, ref, token, blob_shas=None):
+    """
+    Returns {"filename", "content", "error"} entries for `filenames` at `ref`, in order.
+    Contents already cached are served from the cache; only the rest is downloaded. `blob_shas`
+    ({filename: blob sha} from the PR's file list) lets unchanged files hit the cache across
+    pushes, branches and PRs; without it contents are only cached for the commit `ref`.
+    """
+    cached = await get_cached_blobs(owner, repo, filenames, ref, blob_shas)
+    missing = [filename for filename in filenames if filename not in cached]
+    downloaded = await download_files(owner, repo, missing, ref, token) if missing else []
+    await store_blobs(owner, repo, {e["filename"]: e["content"] for e in downloaded if e["error"] is None},
+                      ref, blob_shas)
+
+    by_name = {e["filename"]: e for e in downloaded}
+    return [
+        {"filename": filename, "content": cached[filename], "error": None}
+        if filename in cached else by_name[filename]
+        for filename in filenames
+    ]
 
 
 def format_file_content(content,filename):
@@ -201,30 +288,148 @@ def format_file_content(content,filename):
     return "\n".join(buf)
 
 
-@log_async_exceptions
-async def run_pr_fetch(repo_url, pr_number, token=None):
+FORMATTED_HEADER_REGEX = re.compile(r"^--- (?:Content|Changed regions) for: (.*) ---$", re.M)
+
+def get_formatted_filename(file_text):
+    """Returns the filename from the header written by format_file_content/format_file_regions."""
+    match = FORMATTED_HEADER_REGEX.match(file_text)
+    return match.group(1) if match else None
+
+
+def format_file_regions(content, filename, ranges):
+    """Formats only the given (start, end) line ranges of a file, keeping absolute line numbers."""
+    if not content:
+        return format_file_content(content, filename)
+    lines = content.splitlines()
+    max_width = len(str(len(lines)))
+    buf = [f"--- Changed regions for: {filename} ---"]
+    for start, end in ranges:
+        if start > len(lines):
+            continue
+        if len(buf) > 1:
+            buf.append("...")
+        for i in range(start, min(end, len(lines)) + 1):
+            buf.append(f"{i:{max_width}d}: {lines[i - 1]}")
+    if len(buf) == 1:
+        return format_file_content(content, filename)
+    return "\n".join(buf)
+
+
+async def fetch_changed_ranges(owner, repo, pr_number, files, token, context_lines=None):
+    """
+    Maps each changed file to the head-file line ranges touched by the PR.
+    Uses the PR's unified diff, falling back to the per-file patches if the diff can't be fetched
+    (GitHub refuses diffs above its size limit).
     """
-    Fetch PR details and file contents. 
-    Inputs: repo_url, pull request number, and GitHub token.
-    Returns: (pr_details_text, [file_content_text, ...])
+    if context_lines is None:
+        context_lines = DIFF_CONTEXT_LINES
+    try:
+        diff_text = await fetch_pr_diff(owner, repo, pr_number, token)
+        file_diffs = {part["filename"]: part["hunk"] for part in split_diff_by_file(diff_text)}
+    except Exception as e:
+        logger.warning(f"Could not fetch diff for PR #{pr_number}, using per-file patches: {e}")
+        file_diffs = {f.get('filename'): f.get('patch') or "" for f in files}
+    return {filename: changed_line_ranges(file_diff, context_lines) for filename, file_diff in file_diffs.items()}
+
+
+async def fetch_file_attributes(owner, repo, ref, token):
+    """Generated/vendored patterns from the repository's .gitattributes at `ref` ({} if there is none)."""
+    if not FILE_USE_GITATTRIBUTES or not ref:
+        return {}
+    entry = (await fetch_files(owner, repo, [".gitattributes"], ref, token))[0]
+    return parse_gitattributes(entry["content"]) if entry["error"] is None else {}
+
+
+async def fetch_pr_snapshot(owner, repo, pr_number, token):
+    """
+    Returns (pr_details_text, pr_json, files) where files are the PR's changed files (added,
+    modified or renamed) as listed by GitHub, each with its head blob `sha` and `language`.
+    Binaries, lockfiles and vendored files are left out; generated, minified and oversized
+    ones carry a stand-in review as "summary" and must not be fetched or reviewed.
     """
-    if token is None:
-        token = GITHUB_TOKEN
-    owner, repo = parse_repo_url(repo_url)
-    # PR details
     pr_text, pr_json = await fetch_pr_details(owner, repo, pr_number, token)
-    files = await fetch_pr_files(owner, repo, pr_number, token)
+    files, attributes = await asyncio.gather(
+        fetch_pr_files(owner, repo, pr_number, token),
+        fetch_file_attributes(owner, repo, pr_json.get('head', {}).get('sha'), token),
+    )
+    files = [f for f in files if f.get('status') in ['added', 'modified', 'renamed']]
+    files, skipped = classify_files(files, attributes)
+    if skipped:
+        logger.info(f"Skipping {len(skipped)} files of PR #{pr_number}: "
+                    + ", ".join(f"{name} ({reason})" for name, reason in skipped[:20]))
+    return pr_text, pr_json, files
+
+
+def format_fetched_files(fetched, ranges):
+    """
+    Formats fetch_files entries for review: only the changed regions of files with `ranges`
+    ({filename: [(start, end)]}), whole files otherwise. Returns [(filename, formatted_text)];
+    failed files are logged and left out.
+    """
+    formatted = []
+    for entry in fetched:
+        if entry["error"] is not None:
+            logger.warning(f"Skipping {entry['filename']}: fetch failed with {entry['error']}")
+            continue
+        if ranges.get(entry["filename"]):
+            text = format_file_regions(entry["content"], entry["filename"], ranges[entry["filename"]])
+        else:
+            text = format_file_content(entry["content"], entry["filename"])
+        formatted.append((entry["filename"], text))
+    return formatted
+
 
-    ref = pr_json.get('head', {}).get('sha')
-    file_texts = []
-    for f in files:
-        status = f.get('status')
-        filename = f.get('filename')
-        if status in ['added', 'modified', 'renamed']:
-            fetched_file_content = await fetch_file_content(owner, repo, filename, ref, token)
-            formatted_file_content = format_file_content( fetched_file_content,filename)
-            file_texts.append(formatted_file_content)
-    return pr_text , file_texts
+async def iter_formatted_files(owner, repo, pr_number, files, ref, token, window, mode=None, ranges=None):
+    """
+    Fetches the given PR files at `ref` and yields them formatted for review (whole files, or only
+    the changed regions in "diff" mode) as lists of up to `window` (filename, formatted_text), so
+    only a few windows of contents are held however big the PR is. Failed files are left out.
+    Cached files come first. If more than ARCHIVE_FETCH_THRESHOLD of the PR's files are left to
+    download, they are streamed out of one tarball; the rest, or whatever the tarball didn't
+    deliver, is fetched file by file one window at a time.
+    In diff mode, `ranges` from fetch_changed_ranges saves fetching the PR diff again.
+    """
+    mode = mode or REVIEW_MODE
+    if mode != "diff":
+        ranges = {}
+    elif ranges is None and files:
+        # Only the line ranges are kept, not the PR's diff
+        ranges = await fetch_changed_ranges(owner, repo, pr_number, files, token)
+    ranges = ranges or {}
+    blob_shas = {f.get('filename'): f.get('sha') for f in files if f.get('sha')}
+    filenames = [f.get('filename') for f in files]
 
+    missing = []
+    for start in range(0, len(filenames), window):
+        names = filenames[start:start + window]
+        cached = await get_cached_blobs(owner, repo, names, ref, blob_shas)
+        missing.extend(name for name in names if name not in cached)
+        if cached:
+            yield format_fetched_files(
+                [{"filename": name, "content": cached[name], "error": None} for name in names if name in cached],
+                ranges,
+            )
 
+    if len(missing) > ARCHIVE_FETCH_THRESHOLD:
+        url = f"{API_URL}/repos/{owner}/{repo}/tarball/{ref}"
+        delivered = set()
+        try:
+            async with aclosing(iter_archive_members(url, get_github_headers(token), missing, window)) as members:
+                async for contents in members:
+                    delivered.update(contents)
+                    await store_blobs(owner, repo, contents, ref, blob_shas)
+                    yield format_fetched_files(
+                        [{"filename": name, "content": text, "error": None} for name, text in contents.items()],
+                        ranges,
+                    )
+        except Exception as e:
+            logger.warning(f"Archive fetch failed for {owner}/{repo}@{ref} after {len(delivered)} files, "
+                           f"fetching the other {len(missing) - len(delivered)} one by one: {e}")
+        missing = [name for name in missing if name not in delivered]
 
+    for start in range(0, len(missing), window):
+        names = missing[start:start + window]
+        downloaded = await fetch_files_concurrently(owner, repo, names, ref, token)
+        await store_blobs(owner, repo, {e["filename"]: e["content"] for e in downloaded if e["error"] is None},
+                          ref, blob_shas)
+        yield format_fetched_files(downloaded, ranges)
@@ -0,0 +1,179 @@
+import os
+import re
+import functools
+import posixpath
+
+# Files never fetched nor reviewed: binaries, lockfiles, minified bundles and vendored code
+SKIP_GLOBS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.ico", "*.webp", "*.bmp", "*.tiff", "*.pdf",
+    "*.zip", "*.tar", "*.gz", "*.tgz", "*.bz2", "*.xz", "*.7z", "*.jar", "*.war", "*.whl",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot", "*.mp3", "*.mp4", "*.mov", "*.wav",
+    "*.so", "*.dll", "*.dylib", "*.exe", "*.bin", "*.o", "*.a", "*.class", "*.pyc", "*.pyo",
+    "*.min.js", "*.min.css", "*.map",
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "npm-shrinkwrap.json", "poetry.lock",
+    "Pipfile.lock", "uv.lock", "Cargo.lock", "Gemfile.lock", "composer.lock", "go.sum", "mix.lock",
+    "**/node_modules/**", "**/vendor/**", "**/third_party/**", "dist/**", "build/**",
+] + [g.strip() for g in os.getenv("FILE_SKIP_GLOBS", "").split(",") if g.strip()]
+
+# Generated code: not reviewed, listed in the results with a one-line summary
+GENERATED_GLOBS = [
+    "*_pb2.py", "*_pb2_grpc.py", "*.pb.go", "*.pb.cc", "*.pb.h", "*.generated.*", "*.g.dart",
+    "**/migrations/*.py",
+] + [g.strip() for g in os.getenv("FILE_GENERATED_GLOBS", "").split(",") if g.strip()]
+
+# Data files (fixtures, snapshots, exports) above this many changed lines are summarized, not reviewed
+DATA_EXTENSIONS = {".json", ".csv", ".tsv", ".xml", ".svg", ".snap", ".ndjson", ".jsonl"}
+FILE_DATA_MAX_LINES = int(os.getenv("FILE_DATA_MAX_LINES", "200"))
+# Any file with more changed lines (or a bigger patch) than this is summarized instead of reviewed
+FILE_MAX_CHANGED_LINES = int(os.getenv("FILE_MAX_CHANGED_LINES", "5000"))
+FILE_MAX_PATCH_BYTES = int(os.getenv("FILE_MAX_PATCH_BYTES", str(512 * 1024)))
+# Added lines this long only come out of minifiers and code generators
+FILE_MAX_LINE_LENGTH = int(os.getenv("FILE_MAX_LINE_LENGTH", "1000"))
+# Honour linguist-generated / linguist-vendored in the repository's .gitattributes
+FILE_USE_GITATTRIBUTES = os.getenv("FILE_USE_GITATTRIBUTES", "1") == "1"
+
+LANGUAGES = {
+    ".py": "python", ".pyi": "python",
+    ".js": "javascript", ".jsx": "javascript", ".mjs": "javascript", ".cjs": "javascript",
+    ".ts": "typescript", ".tsx": "typescript",
+    ".go": "go", ".java": "java", ".kt": "kotlin", ".kts": "kotlin", ".scala": "scala",
+    ".rb": "ruby", ".rs": "rust", ".php": "php", ".cs": "csharp", ".swift": "swift",
+    ".c": "c", ".h": "c", ".cc": "cpp", ".cpp": "cpp", ".cxx": "cpp", ".hpp": "cpp",
+    ".sh": "shell", ".bash": "shell", ".sql": "sql",
+    ".yml": "yaml", ".yaml": "yaml", ".toml": "toml", ".json": "json",
+    ".md": "markdown", ".rst": "rst", ".html": "html", ".css": "css", ".scss": "css",
+}
+FILENAME_LANGUAGES = {"Dockerfile": "dockerfile", "Makefile": "make"}
+
+# Languages with a static analyzer; files in any other language are reviewed by the LLM alone
+STATIC_ANALYZER_LANGUAGES = {"python"}
+
+
+def detect_language(path):
+    """Language of a file from its name, or "text" if unknown."""
+    name = posixpath.basename(path)
+    if name in FILENAME_LANGUAGES:
+        return FILENAME_LANGUAGES[name]
+    return LANGUAGES.get(posixpath.splitext(name)[1].lower(), "text")
+
+
+def has_static_analyzer(language):
+    return language in STATIC_ANALYZER_LANGUAGES
+
+
+@functools.lru_cache(maxsize=1024)
+def _glob_regex(pattern):
+    """Translates a git-style glob ("**" spans directories, "*" and "?" don't) to a regex."""
+    out, i = [], 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            out.append("[^/]")
+            i += 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile("".join(out))
+
+
+def glob_match(pattern, path):
+    """
+    Matches a path as git matches .gitattributes patterns: a pattern without a slash matches
+    the file name in any directory, one with a slash the path from the repository root.
+    """
+    if "/" not in pattern:
+        return _glob_regex(pattern).fullmatch(posixpath.basename(path)) is not None
+    return _glob_regex(pattern.lstrip("/")).fullmatch(path) is not None
+
+
+def parse_gitattributes(text):
+    """
+    Patterns of a .gitattributes file marking files as generated or vendored:
+    {"generated": [patterns], "vendored": [patterns]}. Later lines win, as in git.
+    """
+    marks = {"generated": {}, "vendored": {}}
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        pattern, *attributes = line.split()
+        for attribute in attributes:
+            for kind in marks:
+                name = f"linguist-{kind}"
+                if attribute in (name, f"{name}=true"):
+                    marks[kind][pattern] = True
+                elif attribute in (f"-{name}", f"{name}=false", f"!{name}"):
+                    marks[kind][pattern] = False
+    return {kind: [p for p, on in patterns.items() if on] for kind, patterns in marks.items()}
+
+
+def _longest_added_line(patch):
+    return max((len(line) - 1 for line in patch.splitlines() if line.startswith("+")), default=0)
+
+
+def classify_file(f, attributes=None):
+    """
+    Decides what to do with one PR file from its GitHub metadata alone (path, status, patch and
+    line counts). Returns (action, reason) with action "review", "summarize" or "skip".
+    """
+    path = f.get("filename", "")
+    attributes = attributes or {}
+    patch = f.get("patch") or ""
+    has_stats = "changes" in f
+    changes = f.get("changes") or 0
+
+    if any(glob_match(g, path) for g in SKIP_GLOBS + attributes.get("vendored", [])):
+        return "skip", "vendored, binary or lockfile"
+    if has_stats and not changes and not patch:
+        return "skip", "renamed without changes" if f.get("status") == "renamed" else "binary"
+    if any(glob_match(g, path) for g in GENERATED_GLOBS + attributes.get("generated", [])):
+        return "summarize", "generated"
+    # GitHub leaves out the patch of diffs too large to show
+    if changes > FILE_MAX_CHANGED_LINES or (has_stats and not patch) or len(patch) > FILE_MAX_PATCH_BYTES:
+        return "summarize", "too large to review"
+    if _longest_added_line(patch) > FILE_MAX_LINE_LENGTH:
+        return "summarize", "minified or generated"
+    if posixpath.splitext(path)[1].lower() in DATA_EXTENSIONS and changes > FILE_DATA_MAX_LINES:
+        return "summarize", "data file"
+    return "review", None
+
+
+def summary_review(f, reason):
+    """Stands in for the review of a file that isn't sent to the LLM."""
+    return {
+        "file_name": f["filename"],
+        "issues": [],
+        "summary": {
+            "not_reviewed": reason,
+            "language": detect_language(f["filename"]),
+            "additions": f.get("additions", 0),
+            "deletions": f.get("deletions", 0),
+        },
+    }
+
+
+def classify_files(files, attributes=None):
+    """
+    Classifies PR files before any content is fetched. Every returned file gets its "language";
+    summarized files also get their stand-in review as "summary". Returns (kept, skipped), where
+    kept are the files to review or summarize in PR order and skipped are [(filename, reason)].
+    """
+    kept, skipped = [], []
+    for f in files:
+        action, reason = classify_file(f, attributes)
+        if action == "skip":
+            skipped.append((f["filename"], reason))
+            continue
+        f = dict(f, language=detect_language(f["filename"]))
+        if action == "summarize":
+            f["summary"] = summary_review(f, reason)
+        kept.append(f)
+    return kept, skipped
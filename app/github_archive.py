@@ -0,0 +1,209 @@
+import os
+import queue
+import asyncio
+import tarfile
+import threading
+from app.github_scheduler import github_get, PRIORITY_LOW
+
+# Size of each chunk read from the archive download
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", str(64 * 1024)))
+# Max chunks buffered between the download and the extractor thread
+ARCHIVE_MAX_BUFFERED_CHUNKS = int(os.getenv("ARCHIVE_MAX_BUFFERED_CHUNKS", "64"))
+# Seconds between two attempts to queue a chunk while the extractor is behind
+ARCHIVE_FEED_POLL_SECONDS = 0.01
+
+
+class ArchivePipe:
+    """
+    Blocking file-like object fed with downloaded chunks from the event loop.
+    tarfile reads from it in a worker thread, so the archive is never fully held in memory or on disk.
+    """
+
+    def __init__(self, max_chunks=ARCHIVE_MAX_BUFFERED_CHUNKS):
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._buffer = bytearray()
+        self._eof = False
+        # Set by the reader once it no longer needs data, so the writer can stop
+        self.finished = False
+        # Set by the writer when the download stops early, so the reader doesn't wait forever
+        self.closed = False
+
+    async def feed(self, chunk):
+        """
+        Queues a chunk (None marks the end) from the event loop without blocking it or any
+        executor thread, waiting while the reader is behind; gives up once the reader has finished.
+        """
+        while not self.finished:
+            try:
+                self._queue.put_nowait(chunk)
+                return
+            except queue.Full:
+                await asyncio.sleep(ARCHIVE_FEED_POLL_SECONDS)
+
+    def close(self):
+        self.closed = True
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            try:
+                chunk = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if not self.closed:
+                    continue
+                chunk = None
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer.extend(chunk)
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def extract_members(pipe, wanted, on_member=None):
+    """
+    Streams a gzipped tarball from `pipe` and returns {path: text} for the wanted paths.
+    GitHub prefixes every entry with a '<owner>-<repo>-<sha>/' directory, which is stripped.
+    With `on_member`, each wanted path is handed to `on_member(path, text)` as soon as it is
+    read instead of being kept in the returned dict.
+    """
+    found = {}
+    remaining = set(wanted)
+    try:
+        with tarfile.open(fileobj=pipe, mode="r|gz") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                path = member.name.split("/", 1)[-1]
+                if path not in remaining:
+                    continue
+                handle = tar.extractfile(member)
+                text = handle.read().decode("utf-8", errors="replace")
+                if on_member is None:
+                    found[path] = text
+                else:
+                    on_member(path, text)
+                remaining.discard(path)
+                if not remaining:
+                    break
+    finally:
+        pipe.finished = True
+    return found
+
+
+def start_extractor(pipe, wanted, on_member=None):
+    """
+    Runs extract_members on a thread of its own and returns a future of its result. It blocks on
+    the download for as long as the archive streams, so it must not hold one of the loop's
+    default executor threads: enough concurrent archives would leave none for anything else.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run():
+        result, error = None, None
+        try:
+            result = extract_members(pipe, wanted, on_member)
+        except Exception as e:
+            error = e
+        try:
+            loop.call_soon_threadsafe(settle, result, error)
+        except RuntimeError:
+            pass  # the loop is gone, nobody is waiting any more
+
+    threading.Thread(target=run, name="archive-extractor", daemon=True).start()
+    return future
+
+
+def _ignore_outcome(future):
+    future.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+
+async def download_archive(pipe, url, headers):
+    """Streams the tarball at `url` into `pipe` until it ends or the reader has found everything."""
+    try:
+        async with github_get(url, headers, PRIORITY_LOW) as resp:
+            if resp.status != 200:
+                text = await resp.text()
+                raise Exception(f"GitHub API Error: {resp.status} {text}")
+            async for chunk in resp.content.iter_chunked(ARCHIVE_CHUNK_SIZE):
+                if pipe.finished:
+                    break
+                await pipe.feed(chunk)
+        await pipe.feed(None)
+    except BaseException:
+        # Unblock the extractor before surfacing the download error (or cancellation)
+        pipe.close()
+        raise
+
+
+async def fetch_archive_members(url, headers, wanted):
+    """
+    Downloads the repository tarball at `url` once and extracts only the `wanted` paths.
+    Download and extraction run side by side; the download stops as soon as every path was found.
+    """
+    pipe = ArchivePipe()
+    extractor = start_extractor(pipe, wanted)
+    try:
+        await download_archive(pipe, url, headers)
+    except BaseException:
+        _ignore_outcome(extractor)
+        raise
+    return await extractor
+
+
+async def iter_archive_members(url, headers, wanted, window):
+    """
+    Like fetch_archive_members, but yields the `wanted` paths as they stream in, as {path: text}
+    dicts of up to `window` entries in archive order. Extraction (and so the download) waits
+    while the caller is busy with a window, so only about two windows of contents are held.
+    """
+    pipe = ArchivePipe()
+    members = queue.Queue(maxsize=max(window, 1))
+
+    def on_member(path, text):
+        while not pipe.closed:
+            try:
+                members.put((path, text), timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise RuntimeError("Archive reader stopped")
+
+    extractor = start_extractor(pipe, wanted, on_member)
+    download = asyncio.create_task(download_archive(pipe, url, headers))
+    try:
+        batch = {}
+        while True:
+            # Checked before the queue: once extraction is over, an empty queue means the end
+            finished = extractor.done()
+            try:
+                path, text = members.get_nowait()
+            except queue.Empty:
+                if finished:
+                    break
+                await asyncio.sleep(ARCHIVE_FEED_POLL_SECONDS)
+                continue
+            batch[path] = text
+            if len(batch) >= window:
+                yield batch
+                batch = {}
+        if batch:
+            yield batch
+        await download
+        extractor.result()
+    finally:
+        pipe.close()
+        download.cancel()
+        _ignore_outcome(download)
+        _ignore_outcome(extractor)
@@ -0,0 +1,107 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+from app.cache import RedisLRUCache
+from app.github_scheduler import github_get, PRIORITY_HIGH
+
+# Total bytes of GitHub responses kept in Redis before LRU eviction
+GITHUB_CACHE_MAX_BYTES = int(os.getenv("GITHUB_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Lifetime of revalidatable API responses (PR details, file lists, diffs)
+GITHUB_CACHE_TTL = int(os.getenv("GITHUB_CACHE_TTL", str(24 * 3600)))
+# Lifetime of file contents, which never change for a given blob or commit SHA
+GITHUB_BLOB_CACHE_TTL = int(os.getenv("GITHUB_BLOB_CACHE_TTL", str(7 * 24 * 3600)))
+
+SHA_REGEX = re.compile(r"^[0-9a-f]{40}$")
+
+github_cache = RedisLRUCache("github", GITHUB_CACHE_MAX_BYTES, ttl=GITHUB_CACHE_TTL)
+
+
+def _response_key(url, headers):
+    accept = headers.get("Accept", "")
+    return "etag:" + hashlib.sha256(f"{accept} {url}".encode()).hexdigest()
+
+
+def blob_key(owner, repo, blob_sha):
+    """A git blob SHA hashes the content itself: one entry serves every push, branch and PR."""
+    return f"blob:{owner}/{repo}:{blob_sha}"
+
+
+def commit_file_key(owner, repo, path, ref):
+    return f"file:{owner}/{repo}:{ref}:{path}"
+
+
+def _content_keys(owner, repo, filenames, ref, blob_shas):
+    """{cache key: path} of the files whose content can be cached: by blob SHA, else by commit SHA."""
+    blob_shas = blob_shas or {}
+    keys = {}
+    for filename in filenames:
+        blob_sha = blob_shas.get(filename)
+        if blob_sha and SHA_REGEX.match(blob_sha):
+            keys[blob_key(owner, repo, blob_sha)] = filename
+        elif ref and SHA_REGEX.match(ref):
+            keys[commit_file_key(owner, repo, filename, ref)] = filename
+    return keys
+
+
+async def conditional_get(url, headers, as_text=False, priority=PRIORITY_HIGH):
+    """
+    GETs a GitHub URL, revalidating any cached copy with If-None-Match.
+    A 304 reuses the cached body and doesn't count against the rate limit.
+    Returns (data, link_header).
+    """
+    key = _response_key(url, headers)
+    cached = await asyncio.to_thread(github_cache.get, key, False)
+    cached = json.loads(cached) if cached else None
+
+    request_headers = dict(headers)
+    if cached and cached.get("etag"):
+        request_headers["If-None-Match"] = cached["etag"]
+
+    async with github_get(url, request_headers, priority) as resp:
+        if resp.status == 304 and cached:
+            await asyncio.to_thread(github_cache.incr, "hits")
+            return cached["data"], cached.get("link", "")
+        if resp.status != 200:
+            text = await resp.text()
+            raise Exception(f"GitHub API Error: {resp.status} {text}")
+        data = await resp.text() if as_text else await resp.json()
+        etag = resp.headers.get("ETag")
+        link = resp.headers.get("Link", "")
+
+    await asyncio.to_thread(github_cache.incr, "misses")
+    if etag:
+        entry = json.dumps({"etag": etag, "link": link, "data": data})
+        await asyncio.to_thread(github_cache.set, key, entry)
+    return data, link
+
+
+async def get_cached_blobs(owner, repo, filenames, ref, blob_shas=None):
+    """
+    Returns {path: content} for the files already cached, looked up by their blob SHA from the
+    PR's file list (`blob_shas`, {path: sha}) or, for files without one, at commit `ref`.
+    """
+    keys = _content_keys(owner, repo, filenames, ref, blob_shas)
+    if not keys:
+        return {}
+    found = await asyncio.to_thread(github_cache.get_many, list(keys))
+    return {keys[key]: value.decode("utf-8") for key, value in found.items()}
+
+
+async def store_blobs(owner, repo, contents, ref, blob_shas=None):
+    """Caches {path: content} fetched at `ref` under the keys get_cached_blobs looks up."""
+    keys = {filename: key for key, filename in _content_keys(owner, repo, list(contents), ref, blob_shas).items()}
+    if not keys:
+        return
+
+    def store():
+        for filename, key in keys.items():
+            github_cache.set(key, contents[filename], ttl=GITHUB_BLOB_CACHE_TTL)
+
+    await asyncio.to_thread(store)
+
+
+def get_github_cache_stats():
+    """Hit/miss/eviction counters and size of the GitHub response cache."""
+    return github_cache.stats()
@@ -0,0 +1,52 @@
+import os
+import asyncio
+import aiohttp
+from app.logging_wrapper import logger
+
+# Connection pool settings for the shared GitHub session
+GITHUB_POOL_LIMIT = int(os.getenv("GITHUB_POOL_LIMIT", "100"))
+GITHUB_POOL_LIMIT_PER_HOST = int(os.getenv("GITHUB_POOL_LIMIT_PER_HOST", "20"))
+GITHUB_DNS_CACHE_TTL = int(os.getenv("GITHUB_DNS_CACHE_TTL", "300"))
+GITHUB_KEEPALIVE_TIMEOUT = float(os.getenv("GITHUB_KEEPALIVE_TIMEOUT", "60"))
+GITHUB_REQUEST_TIMEOUT = float(os.getenv("GITHUB_REQUEST_TIMEOUT", "60"))
+
+_session = None
+_session_loop = None
+
+
+def _build_session():
+    connector = aiohttp.TCPConnector(
+        limit=GITHUB_POOL_LIMIT,
+        limit_per_host=GITHUB_POOL_LIMIT_PER_HOST,
+        use_dns_cache=True,
+        ttl_dns_cache=GITHUB_DNS_CACHE_TTL,
+        keepalive_timeout=GITHUB_KEEPALIVE_TIMEOUT,
+    )
+    timeout = aiohttp.ClientTimeout(total=GITHUB_REQUEST_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+def get_github_session():
+    """
+    Returns the pooled aiohttp session shared by all GitHub calls in this process.
+    Sessions are bound to an event loop, so a new one is built if the loop changed.
+    Auth headers are passed per request since tokens can differ between PRs.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        if _session is not None and not _session.closed and _session_loop is not None and _session_loop.is_closed():
+            # The owning loop is gone; the connector cannot be closed cleanly anymore.
+            logger.debug("Dropping GitHub session bound to a closed event loop")
+        _session = _build_session()
+        _session_loop = loop
+    return _session
+
+
+async def close_github_session():
+    """Closes the shared GitHub session, if one is open on the running loop."""
+    global _session, _session_loop
+    if _session is not None and not _session.closed and _session_loop is asyncio.get_running_loop():
+        await _session.close()
+    _session = None
+    _session_loop = None
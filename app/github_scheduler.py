@@ -0,0 +1,191 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import hashlib
+import itertools
+from contextlib import asynccontextmanager
+from app.github_client import get_github_session
+from app.logging_wrapper import logger
+
+# Requests in flight at once per GitHub token (GitHub's secondary limits punish big bursts)
+GITHUB_MAX_CONCURRENT_PER_TOKEN = int(os.getenv("GITHUB_MAX_CONCURRENT_PER_TOKEN", "20"))
+# Once fewer than this fraction of the hourly budget is left, requests are spread until the reset
+GITHUB_PACE_FRACTION = float(os.getenv("GITHUB_PACE_FRACTION", "0.2"))
+# Retries of a request rejected by a primary or secondary rate limit
+GITHUB_MAX_RETRIES = int(os.getenv("GITHUB_MAX_RETRIES", "4"))
+# Base delay for exponential backoff when GitHub gives no Retry-After/reset hint
+GITHUB_BACKOFF_BASE = float(os.getenv("GITHUB_BACKOFF_BASE", "1.0"))
+GITHUB_BACKOFF_MAX = float(os.getenv("GITHUB_BACKOFF_MAX", "120"))
+
+# Lower value is served first
+PRIORITY_HIGH = 0     # PR metadata: details, file lists, diffs
+PRIORITY_NORMAL = 1   # file contents
+PRIORITY_LOW = 2      # bulk downloads
+
+
+class TokenBudget:
+    """Rate-limit state of one GitHub token, as last reported by GitHub."""
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = 0.0
+        self.paused_until = 0.0
+        self.next_slot_at = 0.0
+        self.in_flight = 0
+        self.waiters = []
+        self.throttled = 0
+
+    def update(self, headers):
+        try:
+            if "X-RateLimit-Remaining" in headers:
+                self.remaining = int(headers["X-RateLimit-Remaining"])
+            if "X-RateLimit-Limit" in headers:
+                self.limit = int(headers["X-RateLimit-Limit"])
+            if "X-RateLimit-Reset" in headers:
+                self.reset_at = float(headers["X-RateLimit-Reset"])
+        except ValueError:
+            pass
+
+    def delay(self, now):
+        """Seconds the next request has to wait, reserving its pacing slot."""
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.remaining is None or not self.limit or self.reset_at <= now:
+            return 0.0
+        if self.remaining >= self.limit * GITHUB_PACE_FRACTION:
+            return 0.0
+        interval = (self.reset_at - now) / max(self.remaining, 1)
+        slot = max(now, self.next_slot_at)
+        self.next_slot_at = slot + interval
+        return slot - now
+
+
+class GitHubScheduler:
+    """
+    Schedules all GitHub requests of a worker process.
+    Each token gets a concurrency cap with a priority queue in front of it, is paced once its
+    remaining budget runs low, and is paused for every request when GitHub rate-limits it.
+    """
+
+    def __init__(self, max_concurrent=GITHUB_MAX_CONCURRENT_PER_TOKEN):
+        self.max_concurrent = max_concurrent
+        self.budgets = {}
+        self._seq = itertools.count()
+
+    def budget_for(self, headers):
+        auth = headers.get("Authorization", "")
+        key = hashlib.sha256(auth.encode()).hexdigest()[:12]
+        if key not in self.budgets:
+            self.budgets[key] = TokenBudget()
+        return self.budgets[key]
+
+    async def _acquire(self, budget, priority):
+        if budget.in_flight < self.max_concurrent and not budget.waiters:
+            budget.in_flight += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(budget.waiters, (priority, next(self._seq), fut))
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    self.release(budget)
+                raise
+        delay = budget.delay(time.time())
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.release(budget)
+                raise
+
+    def release(self, budget):
+        """Frees a slot taken by send(), handing it straight to the most urgent waiter, if any."""
+        while budget.waiters:
+            _, _, fut = heapq.heappop(budget.waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        budget.in_flight -= 1
+
+    def _retry_delay(self, resp, attempt):
+        """Returns the backoff for a rate-limited response, or None if it isn't one."""
+        if resp.status not in (403, 429):
+            return None
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        if resp.headers.get("X-RateLimit-Remaining") == "0":
+            reset = float(resp.headers.get("X-RateLimit-Reset", 0))
+            return max(reset - time.time(), 1.0)
+        if resp.status == 429:
+            return min(GITHUB_BACKOFF_BASE * 2 ** attempt, GITHUB_BACKOFF_MAX)
+        return None
+
+    async def send(self, url, headers, priority=PRIORITY_NORMAL):
+        """
+        Sends a GET and returns the unread response, still holding its slot so reading the body
+        (e.g. a tarball) counts against the concurrency cap. The caller must release the response
+        and then the slot with release(budget_for(headers)); github_get does both.
+        """
+        budget = self.budget_for(headers)
+        session = get_github_session()
+        for attempt in range(GITHUB_MAX_RETRIES + 1):
+            await self._acquire(budget, priority)
+            try:
+                resp = await session.get(url, headers=headers)
+            except BaseException:
+                self.release(budget)
+                raise
+            budget.update(resp.headers)
+
+            delay = self._retry_delay(resp, attempt)
+            if delay is None or attempt == GITHUB_MAX_RETRIES:
+                return resp
+            resp.release()
+            self.release(budget)
+            delay = min(delay, GITHUB_BACKOFF_MAX) + random.uniform(0, delay * 0.25 + 0.1)
+            budget.throttled += 1
+            budget.paused_until = max(budget.paused_until, time.time() + delay)
+            logger.warning(f"GitHub rate limit hit ({resp.status}) for {url}, backing off {delay:.1f}s")
+
+    def stats(self):
+        return {
+            key: {
+                "limit": b.limit,
+                "remaining": b.remaining,
+                "reset_at": b.reset_at,
+                "in_flight": b.in_flight,
+                "waiting": len(b.waiters),
+                "throttled": b.throttled,
+            }
+            for key, b in self.budgets.items()
+        }
+
+
+scheduler = GitHubScheduler()
+
+
+@asynccontextmanager
+async def github_get(url, headers, priority=PRIORITY_NORMAL):
+    """
+    GETs a GitHub URL through the shared scheduler; use like `session.get` in `async with`.
+    The request keeps its slot until the block exits, body download included.
+    """
+    resp = await scheduler.send(url, headers, priority)
+    try:
+        yield resp
+    finally:
+        resp.release()
+        scheduler.release(scheduler.budget_for(headers))
+
+
+def get_scheduler_stats():
+    """Per-token budget, queue and throttling counters of this worker's scheduler."""
+    return scheduler.stats()
@@ -0,0 +1,178 @@
+import os
+import time
+from app.redis_store import r
+from app.fetch_pr_github import parse_repo_url, get_pr_summary, GITHUB_TOKEN
+from app.metrics import queue_wait_seconds
+from app.redis_rate_limiter import LLM_TENANT_QUOTAS
+from app.logging_wrapper import logger
+
+# Celery queues review tasks are routed to by estimated cost; each can get its own workers
+LANE_FAST, LANE_STANDARD, LANE_BULK = "review.fast", "review.standard", "review.bulk"
+LANES = (LANE_FAST, LANE_STANDARD, LANE_BULK)
+
+# Ask GitHub for a PR's size at submission (one call, whose head SHA also serves dedup)
+LANE_ESTIMATE_COST = os.getenv("LANE_ESTIMATE_COST", "1") == "1"
+# PRs up to these many files and changed lines take the fast lane
+LANE_FAST_MAX_FILES = int(os.getenv("LANE_FAST_MAX_FILES", "10"))
+LANE_FAST_MAX_LINES = int(os.getenv("LANE_FAST_MAX_LINES", "500"))
+# PRs with at least this many files or changed lines take the bulk lane
+LANE_BULK_MIN_FILES = int(os.getenv("LANE_BULK_MIN_FILES", "200"))
+LANE_BULK_MIN_LINES = int(os.getenv("LANE_BULK_MIN_LINES", "20000"))
+# A tenant's tasks lose one priority step for every this many it already has queued or running in a lane
+LANE_TENANT_SHARE = int(os.getenv("LANE_TENANT_SHARE", "2"))
+# Recent queue wait times kept per lane for /queues
+LANE_WAIT_SAMPLES = int(os.getenv("LANE_WAIT_SAMPLES", "500"))
+
+# Celery message priority per request priority (Redis broker: 0 is served first, 9 last)
+BASE_PRIORITY = {"high": 0, "normal": 3, "low": 6}
+MAX_PRIORITY = 9
+
+
+def choose_lane(files, lines):
+    """Lane for a PR of `files` changed files and `lines` changed lines (None if unknown)."""
+    if files is None:
+        return LANE_STANDARD
+    lines = lines or 0
+    if files >= LANE_BULK_MIN_FILES or lines >= LANE_BULK_MIN_LINES:
+        return LANE_BULK
+    if files <= LANE_FAST_MAX_FILES and lines <= LANE_FAST_MAX_LINES:
+        return LANE_FAST
+    return LANE_STANDARD
+
+
+def estimate_cost(req, owner, repo):
+    """(changed files, changed lines, head SHA) of the PR from GitHub, or Nones if unavailable."""
+    if not LANE_ESTIMATE_COST:
+        return None, None, None
+    try:
+        pr = get_pr_summary(owner, repo, req.pr_number, req.github_token or GITHUB_TOKEN)
+    except Exception as e:
+        logger.warning(f"Could not size {owner}/{repo}#{req.pr_number}, using the standard lane: {e}")
+        return None, None, None
+    lines = (pr.get("additions") or 0) + (pr.get("deletions") or 0)
+    return pr.get("changed_files"), lines, pr.get("head", {}).get("sha")
+
+
+def message_priority(lane, tenant, priority=None):
+    """
+    Celery priority of a new task: the request's priority, pushed back one step per
+    LANE_TENANT_SHARE tasks the tenant already has in the lane, so no tenant crowds out the rest.
+    """
+    base = BASE_PRIORITY.get(priority or "normal", BASE_PRIORITY["normal"])
+    try:
+        active = int(r.hget(f"lane:{lane}:tenants", tenant) or 0)
+    except Exception as e:
+        logger.warning(f"Could not read the load of tenant {tenant} in {lane}: {e}")
+        active = 0
+    return min(base + active // max(LANE_TENANT_SHARE, 1), MAX_PRIORITY)
+
+
+def resolve_tenant(req, owner):
+    """
+    Tenant a submission counts against: the requested one if it is configured in
+    LLM_TENANT_QUOTAS, the repository owner otherwise. Any other name would let a caller reset its
+    fair-share penalty and dodge its LLM quota by sending a new tenant with every request.
+    """
+    if req.tenant and req.tenant in LLM_TENANT_QUOTAS:
+        return req.tenant
+    if req.tenant and req.tenant != owner:
+        logger.warning(f"Ignoring unconfigured tenant {req.tenant!r}, counting the request against {owner}")
+    return owner
+
+
+def route_submission(req):
+    """
+    Decides where an /analyze-pr submission runs. Returns a dict with the lane (Celery queue),
+    the Celery message priority, the tenant (see resolve_tenant) and the PR's
+    head SHA if it was looked up.
+    """
+    owner, repo = parse_repo_url(req.repo_url)
+    tenant = resolve_tenant(req, owner)
+    files, lines, head_sha = estimate_cost(req, owner, repo)
+    lane = choose_lane(files, lines)
+    return {
+        "lane": lane,
+        "priority": message_priority(lane, tenant, req.priority),
+        "tenant": tenant,
+        "files": files,
+        "head_sha": head_sha,
+    }
+
+
+def lane_task_queued(task_id, lane, tenant):
+    """Counts a task against its lane's depth and its tenant's share until it finishes."""
+    try:
+        pipe = r.pipeline()
+        pipe.zadd(f"lane:{lane}:queued", {task_id: time.time()})
+        pipe.hincrby(f"lane:{lane}:tenants", tenant, 1)
+        # Counts of tasks lost with a killed worker don't linger forever
+        pipe.expire(f"lane:{lane}:tenants", 24 * 3600)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record task {task_id} in {lane}: {e}")
+
+
+def lane_task_started(task_id, lane):
+    """Moves a task from queued to running and records how long it waited."""
+    try:
+        pipe = r.pipeline()
+        pipe.zscore(f"lane:{lane}:queued", task_id)
+        pipe.zrem(f"lane:{lane}:queued", task_id)
+        pipe.sadd(f"lane:{lane}:running", task_id)
+        queued_at = pipe.execute()[0]
+        if queued_at is None:
+            return None
+        waited = max(time.time() - queued_at, 0.0)
+        queue_wait_seconds.observe(waited, lane=lane)
+        pipe = r.pipeline()
+        pipe.lpush(f"lane:{lane}:waits", round(waited, 3))
+        pipe.ltrim(f"lane:{lane}:waits", 0, LANE_WAIT_SAMPLES - 1)
+        pipe.execute()
+        return waited
+    except Exception as e:
+        logger.warning(f"Could not record start of task {task_id} in {lane}: {e}")
+        return None
+
+
+def lane_task_finished(task_id, lane, tenant):
+    """Releases the task's place in its lane (also used when queueing it failed)."""
+    try:
+        pipe = r.pipeline()
+        pipe.zrem(f"lane:{lane}:queued", task_id)
+        pipe.srem(f"lane:{lane}:running", task_id)
+        pipe.hincrby(f"lane:{lane}:tenants", tenant, -1)
+        left = pipe.execute()[-1]
+        if left <= 0:
+            r.hdel(f"lane:{lane}:tenants", tenant)
+    except Exception as e:
+        logger.warning(f"Could not release task {task_id} in {lane}: {e}")
+
+
+def _percentile(ordered, q):
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)] if ordered else None
+
+
+def get_lane_stats():
+    """Per lane: queued and running tasks, age of the oldest queued one, recent wait percentiles and tenants."""
+    now = time.time()
+    pipe = r.pipeline()
+    for lane in LANES:
+        pipe.zcard(f"lane:{lane}:queued")
+        pipe.zrange(f"lane:{lane}:queued", 0, 0, withscores=True)
+        pipe.scard(f"lane:{lane}:running")
+        pipe.lrange(f"lane:{lane}:waits", 0, -1)
+        pipe.hgetall(f"lane:{lane}:tenants")
+    replies = pipe.execute()
+    stats = {}
+    for i, lane in enumerate(LANES):
+        queued, oldest, running, waits, tenants = replies[i * 5:i * 5 + 5]
+        waits = sorted(float(w) for w in waits)
+        stats[lane] = {
+            "queued": queued,
+            "running": running,
+            "oldest_wait_seconds": round(now - oldest[0][1], 3) if oldest else 0.0,
+            "wait_p50_seconds": _percentile(waits, 0.5),
+            "wait_p95_seconds": _percentile(waits, 0.95),
+            "tenants": {k.decode(): int(v) for k, v in tenants.items()},
+        }
+    return stats
@@ -1,46 +1,119 @@
+import os
+import json
+import asyncio
+import hashlib
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import PromptTemplate
-from langchain_core.rate_limiters import InMemoryRateLimiter
 from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
+from app.metrics import stage
 from app.logging_wrapper import log_async_exceptions,log_exceptions
+from app.cache import TieredCache
+from app.redis_rate_limiter import RedisTokenBucketRateLimiter, is_rate_limit_error
 
 load_dotenv()
 
-rate_limiter = InMemoryRateLimiter(
-    requests_per_second=0.2,    
+LLM_MODEL = "gemini-2.0-flash"
+
+# Parsed responses kept per process, and bytes/lifetime of the shared Redis tier
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_LOCAL_ENTRIES = int(os.getenv("LLM_CACHE_LOCAL_ENTRIES", "512"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(3 * 24 * 3600)))
+
+llm_cache = TieredCache("llm", LLM_CACHE_LOCAL_ENTRIES, LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL)
+
+# Shared by every worker through Redis; rate and burst come from LLM_REQUESTS_PER_SECOND/LLM_MAX_BUCKET_SIZE
+rate_limiter = RedisTokenBucketRateLimiter(
     check_every_n_seconds=0.1,   # check every 100 ms
-    max_bucket_size=5            # allow small bursts
 )
 
+def llm_cache_key(model, prompt_template, input_vars):
+    """Cache key from the model, a hash of the template and a hash of the prompt inputs."""
+    template_hash = hashlib.sha256(prompt_template.encode()).hexdigest()
+    input_hash = hashlib.sha256(json.dumps(input_vars, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{model}:{template_hash}:{input_hash}"
+
+def get_llm_cache_stats():
+    return llm_cache.stats()
+
+# Compiled chains by (model, template, parser) and chat clients by model, built once per process
+_chains = {}
+_llms = {}
+# Event loop each client's async transport was created on
+_llm_loops = {}
+
+
+def get_llm(model=LLM_MODEL):
+    """
+    Returns the chat client for a model, shared by every call in this process so its
+    gRPC channels (and their HTTP/2 connections) are reused instead of set up per call.
+    """
+    llm = _llms.get(model)
+    if llm is None:
+        llm = _llms[model] = ChatGoogleGenerativeAI(model=model, rate_limiter=rate_limiter)
+    return llm
+
+
+def _bind_to_running_loop(llm):
+    # The async transport belongs to the loop it was created on; rebuild it lazily if the loop changed
+    loop = asyncio.get_running_loop()
+    if _llm_loops.get(id(llm)) is not loop:
+        llm.async_client_running = None
+        _llm_loops[id(llm)] = loop
+
+
+def get_chain(prompt_template, parser=None, model=LLM_MODEL):
+    """
+    Returns (chain, full_template) for a template/parser/model, compiling it on first use.
+    The format instructions are rendered once here and baked into the prompt as a partial.
+    """
+    key = (model, prompt_template, id(parser))
+    compiled = _chains.get(key)
+    if compiled is None:
+        template = prompt_template
+        partials = {}
+        if parser:
+            template += "\n {format_instructions} "
+            partials["format_instructions"] = parser.get_format_instructions()
+        prompt = PromptTemplate.from_template(template, partial_variables=partials)
+        chain = prompt | get_llm(model) | (parser if parser else lambda x: x)
+        # Keep the parser referenced so its id can't be reused by another object
+        compiled = _chains[key] = (chain, template + partials.get("format_instructions", ""), parser)
+    return compiled[0], compiled[1]
+
 @log_async_exceptions
 async def aexecute_chain(prompt_template, input_vars, parser=None):
+    """
+    Runs the prompt through Gemini. Parsed responses are cached: identical inputs are answered
+    from the cache without calling the model or waiting on the rate limiter.
+    """
     try:
+        chain, full_template = get_chain(prompt_template, parser)
         if parser:
-            prompt_template += "\n {format_instructions} "
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=list(input_vars.keys()),
-            partial_variables={} if parser is None else {"format_instructions": parser.get_format_instructions()}
-        )
-        llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash",rate_limiter=rate_limiter)
-        chain = prompt | llm | (parser if parser else lambda x: x)
-        response = await chain.ainvoke(input_vars)
+            cache_key = llm_cache_key(LLM_MODEL, full_template, input_vars)
+            if LLM_CACHE_ENABLED:
+                cached = await llm_cache.get(cache_key)
+                if cached is not None:
+                    return json.loads(cached)
+        _bind_to_running_loop(get_llm())
+        try:
+            async with stage("llm_call"):
+                response = await chain.ainvoke(input_vars)
+        except Exception as e:
+            if is_rate_limit_error(e):
+                await asyncio.to_thread(rate_limiter.report_throttled)
+            raise
+        await asyncio.to_thread(rate_limiter.report_success)
+        if parser and LLM_CACHE_ENABLED and response:
+            await llm_cache.set(cache_key, json.dumps(response))
         return response
     except Exception as e:
         raise RuntimeError("Failed to execute LLM chain") from e
     
 @log_exceptions
 def execute_chain(prompt_template, input_vars, parser=None):
-        if parser:
-            prompt_template += "\n {format_instructions} "
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=list(input_vars.keys()),
-            partial_variables={} if parser is None else {"format_instructions": parser.get_format_instructions()}
-        )
-        llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash",rate_limiter=rate_limiter)
-        chain = prompt | llm | (parser if parser else lambda x: x)
+        chain, _ = get_chain(prompt_template, parser)
         response = chain.invoke(input_vars)
         if parser:
              return response
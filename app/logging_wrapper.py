@@ -1,7 +1,9 @@
+import os
+import time
+import random
 import functools
 import logging
 import traceback
-from datetime import datetime
 from typing import Callable, Any, Optional, Dict, Tuple, List
 
 # Configure logging
@@ -15,21 +17,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger("pr_reviewer")
 
+from app.metrics import function_seconds, function_errors
+
+# Fraction of decorated calls that log their start/completion at INFO (errors are always logged).
+# Durations always go to the pr_review_function_seconds histogram on /metrics instead.
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0"))
+
+def _sampled():
+    return LOG_SAMPLE_RATE > 0 and random.random() < LOG_SAMPLE_RATE
+
 def log_exceptions(func):
     """Decorator to log exceptions for synchronous functions"""
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         func_name = func.__name__
+        sampled = _sampled()
         try:
-            logger.info(f"Starting {func_name}")
+            if sampled:
+                logger.info(f"Starting {func_name}")
             result = func(*args, **kwargs)
-            execution_time = (datetime.now() - start_time).total_seconds()
-            logger.info(f"Completed {func_name} in {execution_time}s")
+            execution_time = time.perf_counter() - start_time
+            function_seconds.observe(execution_time, function=func_name)
+            if sampled:
+                logger.info(f"Completed {func_name} in {execution_time:.6f}s")
             return result
         except Exception as e:
-            execution_time = (datetime.now() - start_time).total_seconds()
-            logger.error(f"Error in {func_name} after {execution_time}s: {str(e)}")
+            execution_time = time.perf_counter() - start_time
+            function_seconds.observe(execution_time, function=func_name)
+            function_errors.inc(function=func_name)
+            logger.error(f"Error in {func_name} after {execution_time:.6f}s: {str(e)}")
             logger.debug(f"Traceback: {traceback.format_exc()}")
             raise
     return wrapper
@@ -38,17 +55,23 @@ def log_async_exceptions(func):
     """Decorator to log exceptions for async functions"""
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         func_name = func.__name__
+        sampled = _sampled()
         try:
-            logger.info(f"Starting async {func_name}")
+            if sampled:
+                logger.info(f"Starting async {func_name}")
             result = await func(*args, **kwargs)
-            execution_time = (datetime.now() - start_time).total_seconds()
-            logger.info(f"Completed async {func_name} in {execution_time}s")
+            execution_time = time.perf_counter() - start_time
+            function_seconds.observe(execution_time, function=func_name)
+            if sampled:
+                logger.info(f"Completed async {func_name} in {execution_time:.6f}s")
             return result
         except Exception as e:
-            execution_time = (datetime.now() - start_time).total_seconds()
-            logger.error(f"Error in async {func_name} after {execution_time}s: {str(e)}")
+            execution_time = time.perf_counter() - start_time
+            function_seconds.observe(execution_time, function=func_name)
+            function_errors.inc(function=func_name)
+            logger.error(f"Error in async {func_name} after {execution_time:.6f}s: {str(e)}")
             logger.debug(f"Traceback: {traceback.format_exc()}")
             raise
-    return wrapper
\ No newline at end of file
+    return wrapper
@@ -1,10 +1,20 @@
 import uvicorn
 import os
-from fastapi import FastAPI, HTTPException
+import json
+import uuid
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from app.models import AnalyzePRRequest, StatusResponse, ResultsResponse
 from app.tasks import analyze_pr
-from app.redis_store import get_task_status, get_final_result
-from app.logging_wrapper import log_async_exceptions,log_exceptions
+from app.redis_store import (
+    get_final_result, mark_task_queued, aget_task_status, aget_task_results, aread_task_events,
+    aget_task_trace, aget_metrics_snapshots
+)
+from app.metrics import render_metrics
+from app.dedup import claim_submission, release_submission
+from app.lanes import route_submission, lane_task_queued, lane_task_finished, get_lane_stats
+from app.logging_wrapper import log_async_exceptions,log_exceptions,logger
 
 app = FastAPI()
 
@@ -12,27 +22,109 @@ app = FastAPI()
 @app.post("/analyze-pr")
 def start(req: AnalyzePRRequest):
     # print(req)
-    task = analyze_pr.delay(req.repo_url, req.pr_number, req.github_token)
-    return {"task_id": task.id}
+    task_id = str(uuid.uuid4())
+    route = route_submission(req)
+    # Sizing the PR already read its head SHA with the caller's token, so dedup needn't ask GitHub again
+    key, existing, meta = claim_submission(req, task_id, route["head_sha"])
+    if existing:
+        # Same PR head already queued, running or reviewed recently: join it instead of re-running
+        response = {"task_id": existing, "status": meta["status"], "deduplicated": True}
+        if meta["status"] == "completed":
+            response["results"] = get_final_result(existing)
+        return response
+
+    try:
+        # Recorded before queueing so duplicates arriving meanwhile already see the task
+        mark_task_queued(task_id, req.repo_url, req.pr_number)
+    except Exception as e:
+        logger.warning(f"Could not record task {task_id} as queued: {e}")
+    lane, tenant = route["lane"], route["tenant"]
+    lane_task_queued(task_id, lane, tenant)
+    try:
+        task = analyze_pr.apply_async(
+            args=[req.repo_url, req.pr_number, req.github_token, req.review_mode],
+            kwargs={"priority": req.priority, "tenant": tenant, "lane": lane},
+            task_id=task_id, queue=lane, priority=route["priority"],
+        )
+    except Exception:
+        release_submission(key, task_id)
+        lane_task_finished(task_id, lane, tenant)
+        raise
+    return {"task_id": task.id, "status": "queued", "lane": lane}
 
 @log_exceptions
 @app.get("/status/{task_id}", response_model=StatusResponse)
-def status(task_id: str):
-    meta = get_task_status(task_id)
+async def status(task_id: str):
+    meta = await aget_task_status(task_id)
     if not meta: raise HTTPException(404, "Not found")
     return {"task_id": task_id, "status": meta["status"]}
 
 @log_exceptions
 @app.get("/results/{task_id}")
-def results(task_id: str):
-    status = get_task_status(task_id)
+async def results(task_id: str):
+    status, final_review = await aget_task_results(task_id)
     if not status or status["status"] != "completed":
         raise HTTPException(404, "Results not ready")
-    final_review = get_final_result(task_id)
     res = {"task_id":task_id , "status": "completed" , "results" : final_review}
     # print(res)
     return res
 
+# Seconds a /stream connection waits for new events before sending a keep-alive comment
+STREAM_KEEPALIVE_SECONDS = int(os.getenv("STREAM_KEEPALIVE_SECONDS", "15"))
+
+async def task_event_stream(task_id: str, last_event_id: str = "0"):
+    """
+    Relays the task's Redis stream as Server-Sent Events: every stored event is replayed first,
+    then new ones are pushed as they land. Ends once the task has completed or failed.
+    """
+    while True:
+        events = await aread_task_events(task_id, last_event_id, block_ms=STREAM_KEEPALIVE_SECONDS * 1000)
+        if not events:
+            yield ": keep-alive\n\n"
+            continue
+        for event_id, event, data in events:
+            last_event_id = event_id
+            yield f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+            if event == "status" and json.loads(data)["status"] in ("completed", "failed"):
+                return
+
+@log_exceptions
+@app.get("/stream/{task_id}")
+async def stream(task_id: str, last_event_id: Optional[str] = Header(None)):
+    if not await aget_task_status(task_id): raise HTTPException(404, "Not found")
+    return StreamingResponse(
+        task_event_stream(task_id, last_event_id or "0"),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@log_exceptions
+@app.get("/trace/{task_id}")
+async def trace(task_id: str):
+    """Timed stages (fetch, static_analysis, llm_call, ...) recorded while the task ran."""
+    if not await aget_task_status(task_id): raise HTTPException(404, "Not found")
+    spans = await aget_task_trace(task_id)
+    return {"task_id": task_id, "spans": sorted(spans, key=lambda span: span["start"])}
+
+@log_exceptions
+@app.get("/queues")
+def queues():
+    """Depth, running tasks, wait times and per-tenant load of each scheduling lane."""
+    return get_lane_stats()
+
+# Worker metrics older than this many seconds (e.g. from a stopped worker) are left out of /metrics
+METRICS_STALE_SECONDS = int(os.getenv("METRICS_STALE_SECONDS", "300"))
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics of the API process and of the workers that reported recently."""
+    try:
+        snapshots = await aget_metrics_snapshots(METRICS_STALE_SECONDS)
+    except Exception as e:
+        logger.warning(f"Could not read worker metrics: {e}")
+        snapshots = []
+    return PlainTextResponse(render_metrics(snapshots), media_type="text/plain; version=0.0.4")
+
 
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000)
\ No newline at end of file
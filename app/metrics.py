@@ -0,0 +1,193 @@
+import os
+import time
+import socket
+import threading
+import contextvars
+import functools
+
+# Histogram buckets in seconds, from a cache hit up to a slow LLM call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_hostname = socket.gethostname()
+_registry = []
+
+
+def process_label():
+    """
+    Identifies this process' series when several processes report to one /metrics. Read at
+    each use: Celery prefork children import this module once, in the parent, before forking.
+    """
+    return f"{_hostname}:{os.getpid()}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels, safe to update from any thread."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def samples(self, series, extra):
+        for key, value in series:
+            labels = list(zip(self.labelnames, key)) + extra
+            yield f"{self.name}_total{_format_labels(labels)} {value}"
+
+
+class Histogram:
+    """Cumulative histogram (count, sum and buckets) per label set."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(series)] for key, series in self._values.items()]
+
+    def samples(self, series, extra):
+        for key, values in series:
+            labels = list(zip(self.labelnames, key)) + extra
+            for bound, count in zip(self.buckets, values):
+                yield f"{self.name}_bucket{_format_labels(labels + [('le', bound)])} {count}"
+            yield f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {values[-2]}"
+            yield f"{self.name}_count{_format_labels(labels)} {values[-2]}"
+            yield f"{self.name}_sum{_format_labels(labels)} {values[-1]}"
+
+
+def snapshot():
+    """Current values of every metric in this process, as plain JSON-able data."""
+    return {metric.name: metric.snapshot() for metric in _registry}
+
+
+def render_metrics(snapshots=()):
+    """
+    Prometheus text exposition of this process' metrics plus `snapshots`, a list of
+    (process_label, snapshot()) reported by other processes (e.g. Celery workers).
+    """
+    label = process_label()
+    sources = [(label, snapshot())] + [s for s in snapshots if s[0] != label]
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for process, data in sources:
+            lines.extend(metric.samples(data.get(metric.name, []), [("process", process)]))
+    return "\n".join(lines) + "\n"
+
+
+stage_seconds = Histogram(
+    "pr_review_stage_seconds",
+    "Time spent per pipeline stage (llm_call includes llm_rate_limit_wait)",
+    ["stage"],
+)
+stage_errors = Counter("pr_review_stage_errors", "Failed calls per pipeline stage", ["stage"])
+queue_wait_seconds = Histogram(
+    "pr_review_queue_wait_seconds",
+    "Time review tasks waited in their lane before a worker started them",
+    ["lane"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+function_seconds = Histogram(
+    "pr_review_function_seconds", "Duration of functions wrapped by the logging decorators", ["function"]
+)
+function_errors = Counter(
+    "pr_review_function_errors", "Exceptions raised by functions wrapped by the logging decorators", ["function"]
+)
+
+
+# Spans of the task being traced in the current context, or None when not tracing
+_current_spans = contextvars.ContextVar("current_spans", default=None)
+
+
+class stage:
+    """
+    Times a pipeline stage with the monotonic clock, as `with stage("fetch"):` or
+    `async with`, or as a decorator. Also records a span if a task trace is active.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._started_at = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        stage_seconds.observe(duration, stage=self.name)
+        if exc_type is not None:
+            stage_errors.inc(stage=self.name)
+        spans = _current_spans.get()
+        if spans is not None:
+            spans.append({
+                "name": self.name,
+                "start": self._started_at,
+                "duration": duration,
+                "error": exc_type is not None,
+            })
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def start_trace():
+    """Starts collecting spans for the current task; returns the (shared, growing) span list."""
+    spans = []
+    _current_spans.set(spans)
+    return spans
@@ -5,6 +5,13 @@ class AnalyzePRRequest(BaseModel):
     repo_url: str
     pr_number: int
     github_token: Optional[str]
+    review_mode: Optional[Literal["full","diff"]] = None
+    # Run a new review even if the same PR head was reviewed or is being reviewed right now
+    force: bool = False
+    # Scheduling: priority within the PR's lane, and who the review is for (one of LLM_TENANT_QUOTAS;
+    # anything else counts as the repo owner)
+    priority: Literal["high","normal","low"] = "normal"
+    tenant: Optional[str] = None
 
 class StatusResponse(BaseModel):
     task_id: str
@@ -1,10 +1,12 @@
 import re
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 HUNK_REGEX = re.compile(
     r"^diff --git a/(.+?) b/(.+?)$(?:.*?)(?=^diff --git|\Z)", re.M|re.S
 )
 
+HUNK_HEADER_REGEX = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@.*$", re.M)
+
 def split_diff_by_file(diff_text: str) -> List[Dict]:
     parts = []
     for m in HUNK_REGEX.finditer(diff_text):
@@ -13,3 +15,46 @@ def split_diff_by_file(diff_text: str) -> List[Dict]:
             "hunk": m.group(0)
         })
     return parts
+
+def split_hunks(file_diff: str) -> List[Dict]:
+    """Splits one file's diff into hunks with their head-side start line and body lines."""
+    headers = list(HUNK_HEADER_REGEX.finditer(file_diff))
+    hunks = []
+    for i, m in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(file_diff)
+        body = file_diff[m.end():end].split("\n")[1:]
+        hunks.append({
+            "new_start": int(m.group(3)),
+            "new_count": int(m.group(4)) if m.group(4) is not None else 1,
+            "lines": body
+        })
+    return hunks
+
+def changed_line_ranges(file_diff: str, context_lines: int = 3) -> List[Tuple[int, int]]:
+    """
+    Returns merged (start, end) head-file line ranges covering every change in the diff,
+    widened by `context_lines` on each side. Pure deletions are anchored at the
+    head line that follows them.
+    """
+    ranges = []
+    for hunk in split_hunks(file_diff):
+        new_line = hunk["new_start"]
+        for line in hunk["lines"]:
+            if line.startswith("+"):
+                ranges.append((new_line - context_lines, new_line + context_lines))
+                new_line += 1
+            elif line.startswith("-"):
+                ranges.append((new_line - context_lines, new_line + context_lines - 1))
+            elif line.startswith(" "):
+                new_line += 1
+
+    merged = []
+    for start, end in sorted(ranges):
+        start = max(start, 1)
+        if end < start:
+            end = start
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
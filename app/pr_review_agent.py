@@ -1,9 +1,12 @@
+import asyncio
 from app.llm_garden import aexecute_chain
 from typing import List ,Optional,Literal
 from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
-from app.static_analyzer_tools import run_static_analyzer 
-from app.logging_wrapper import log_async_exceptions,log_exceptions
+from app.analysis_pool import analyze_code
+from app.chunker import chunk_file, merge_chunk_reviews
+from app.fetch_pr_github import get_formatted_filename
+from app.logging_wrapper import log_async_exceptions,log_exceptions,logger
 
 
 class issue_model(BaseModel):
@@ -17,7 +20,11 @@ class final_review(BaseModel):
     issues:List[issue_model]
     summary:dict
 
+class final_review_batch(BaseModel):
+    reviews:List[final_review]
+
 final_review_parser = JsonOutputParser(pydantic_object = final_review)
+final_review_batch_parser = JsonOutputParser(pydantic_object = final_review_batch)
 
 @log_async_exceptions
 async def review_hunk(pr_info:str,pr_file:str):
@@ -37,9 +44,92 @@ async def review_hunk(pr_info:str,pr_file:str):
 {static_report}
 """ 
   
-    static_report = run_static_analyzer(pr_file)
+    static_report = await analyze_code(pr_file)
     input_vars = {"pr_info":pr_info,"code_hunk":pr_file,"static_report":static_report}
     review = await aexecute_chain(prompt_template,input_vars,final_review_parser)
     return review
 
 
+@log_async_exceptions
+async def review_batch(pr_info:str,pr_files:List[str],filenames:List[str]):
+    """Reviews several small files in one LLM call; returns the raw list of reviews."""
+    prompt_template = """You are a PR review assistant. Analyze each of the following files together with its static analysis report. For every file provide issues categorized as:
+
+1. style: Code style and formatting issues
+2. bug: Potential bugs or errors
+3. performance: Suggestions to improve performance
+4. best_practice: Adherence to best practices
+
+Return exactly one review per file, in the order given, with file_name set to the file's path.
+=== PR Info ====
+{pr_info}
+
+{code_hunks}
+"""
+
+    static_reports = await asyncio.gather(*(analyze_code(pr_file) for pr_file in pr_files))
+    code_hunks = "\n\n".join(
+        f"=== File {i}: {filename} ===\n{pr_file}\n\n=== Static Analysis Report for {filename} ===\n{report}"
+        for i, (filename, pr_file, report) in enumerate(zip(filenames, pr_files, static_reports), 1)
+    )
+    input_vars = {"pr_info":pr_info,"code_hunks":code_hunks}
+    response = await aexecute_chain(prompt_template,input_vars,final_review_batch_parser)
+    return response.get("reviews", []) if isinstance(response, dict) else response
+
+
+@log_async_exceptions
+async def review_chunk(pr_info:str,pr_file:str,file_outline:str,first_line:int,last_line:int):
+    """Reviews lines first_line..last_line of a file too large for one call."""
+    prompt_template = """You are a PR review assistant. Analyze the following part of a larger file and its static analysis report. Then provide issues categorized as:
+
+1. style: Code style and formatting issues
+2. bug: Potential bugs or errors
+3. performance: Suggestions to improve performance
+4. best_practice: Adherence to best practices
+
+Only lines {first_line}-{last_line} of the file are shown. Report issues for those lines only, using the line numbers shown.
+=== PR Info ====
+{pr_info}
+
+=== File Outline (imports and signatures) ===
+{file_outline}
+
+=== Code Hunk ===
+{code_hunk}
+
+=== Static Analysis Report ===
+{static_report}
+"""
+
+    static_report = await analyze_code(pr_file)
+    input_vars = {"pr_info":pr_info,"file_outline":file_outline,"first_line":first_line,
+                  "last_line":last_line,"code_hunk":pr_file,"static_report":static_report}
+    return await aexecute_chain(prompt_template,input_vars,final_review_parser)
+
+
+@log_async_exceptions
+async def review_file(pr_info:str,pr_file:str):
+    """
+    Reviews one formatted file. Files over the chunk token budget are split at function/class
+    boundaries, the chunks reviewed concurrently and their issues merged into one review.
+    """
+    file_outline, chunks = chunk_file(pr_file)
+    if len(chunks) == 1:
+        return await review_hunk(pr_info, pr_file)
+
+    results = await asyncio.gather(
+        *(review_chunk(pr_info, text, file_outline, first, last) for first, last, text in chunks),
+        return_exceptions=True,
+    )
+    reviewed = [(chunk[:2], r) for chunk, r in zip(chunks, results) if isinstance(r, dict)]
+    if not reviewed:
+        raise next(r for r in results if isinstance(r, Exception))
+    failed = len(chunks) - len(reviewed)
+    if failed:
+        logger.warning(f"{failed} of {len(chunks)} chunks of {get_formatted_filename(pr_file)} could not be reviewed")
+    return merge_chunk_reviews(
+        get_formatted_filename(pr_file) or reviewed[0][1].get("file_name"),
+        [ranges for ranges, _ in reviewed],
+        [r for _, r in reviewed],
+    )
+
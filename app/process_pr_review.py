@@ -1,11 +1,39 @@
+import os
 import asyncio
-from app.fetch_pr_github import run_pr_fetch
-from app.pr_review_agent import review_hunk
+from contextlib import aclosing
+from app.fetch_pr_github import (
+    fetch_pr_snapshot, iter_formatted_files, fetch_changed_ranges, parse_repo_url, GITHUB_TOKEN, REVIEW_MODE
+)
+from app.redis_store import get_pr_review_state, set_pr_review_state
+from app.llm_garden import LLM_MODEL
+from app.static_analyzer_tools import ANALYZER_VERSION
+from app.pr_review_agent import review_file, review_batch
+from app.review_batcher import pack_files, match_reviews, batch_filenames, estimate_tokens
+from app.analysis_pool import analyze_code
+from app.chunker import LLM_CHUNK_TOKEN_BUDGET
+from app.redis_rate_limiter import llm_tenant
+from app.metrics import stage
 from app.logging_wrapper import log_async_exceptions,log_exceptions
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Re-review only the files whose blob changed since the PR was last reviewed
+INCREMENTAL_REVIEW = os.getenv("INCREMENTAL_REVIEW", "1") == "1"
+# Stored reviews are only carried over if they came from the same model and analyzer
+REVIEW_STATE_VERSION = f"{LLM_MODEL}:{ANALYZER_VERSION}"
+
+# Files are fetched this many at a time and flow through analyze -> review -> persist in
+# bounded queues, so a worker holds a few windows of file contents however big the PR is
+PIPELINE_FETCH_WINDOW = int(os.getenv("PIPELINE_FETCH_WINDOW", "32"))
+# Batches waiting between two stages, and concurrent batches per stage
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+PIPELINE_ANALYZE_WORKERS = int(os.getenv("PIPELINE_ANALYZE_WORKERS", "4"))
+PIPELINE_REVIEW_WORKERS = int(os.getenv("PIPELINE_REVIEW_WORKERS", "16"))
+
+# What a review keeps of each PR file once it is planned; patches in particular are dropped
+PLANNED_FILE_FIELDS = ("filename", "sha", "status", "language", "summary")
+
 async def retry_once(coro_func, *args, **kwargs):
     try:
         return await coro_func(*args, **kwargs)
@@ -17,16 +45,192 @@ async def retry_once(coro_func, *args, **kwargs):
             logger.error(f"Second attempt failed with: {e2}")
             return e2  # Let the caller filter this if needed
 
-@log_async_exceptions
-async def review_pr_agents(repo_url, pr_number, token=None):
-    pr_info, pr_files = await run_pr_fetch(repo_url, pr_number, token=token)
-    
-    review_tasks = [
-        asyncio.create_task(retry_once(review_hunk, pr_info, hunk))
-        for hunk in pr_files
+async def review_files(pr_info, pr_files, batch):
+    """
+    Reviews one packed batch. Several files share a single LLM call; any file the batched
+    answer doesn't cover (or all of them, if the call or parsing fails) is reviewed on its own.
+    Returns one result (review or exception) per file in the batch.
+    """
+    if len(batch) == 1:
+        return [await retry_once(review_file, pr_info, pr_files[batch[0]])]
+
+    filenames = batch_filenames(pr_files, batch)
+    try:
+        matched = match_reviews(filenames, await review_batch(pr_info, [pr_files[i] for i in batch], filenames))
+    except Exception as e:
+        logger.warning(f"Batched review of {len(batch)} files failed, reviewing them one by one: {e}")
+        matched = [None] * len(batch)
+
+    fallback = [i for i, review in zip(batch, matched) if review is None]
+    if fallback:
+        singles = await asyncio.gather(*(retry_once(review_file, pr_info, pr_files[i]) for i in fallback))
+        by_index = dict(zip(fallback, singles))
+        matched = [review if review is not None else by_index[i] for i, review in zip(batch, matched)]
+    return matched
+
+async def notify(callback, *args):
+    """Runs a (blocking) progress callback off the event loop; its failures never fail the review."""
+    if callback is None:
+        return
+    try:
+        await asyncio.to_thread(callback, *args)
+    except Exception as e:
+        logger.warning(f"Progress callback {getattr(callback, '__name__', callback)} failed: {e}")
+
+def carried_reviews(files, previous):
+    """
+    Results that need no review, {filename: {"sha", "review"}}: the stand-in summaries of files
+    the classifier kept out of review, and previous results of files whose blob SHA hasn't changed.
+    """
+    carried = {
+        f["filename"]: previous[f["filename"]]
+        for f in files
+        if f.get("sha") and previous.get(f["filename"], {}).get("sha") == f["sha"]
+    }
+    carried.update((f["filename"], {"sha": f.get("sha"), "review": f["summary"]}) for f in files if "summary" in f)
+    return carried
+
+def load_review_state(owner, repo, pr_number, mode):
+    """Per-file results of the PR's last review, {filename: {"sha", "review"}}, if they can be reused."""
+    if not INCREMENTAL_REVIEW:
+        return {}
+    try:
+        state = get_pr_review_state(owner, repo, pr_number)
+    except Exception as e:
+        logger.warning(f"Could not load previous review of PR #{pr_number}, reviewing every file: {e}")
+        return {}
+    if not state or state.get("version") != REVIEW_STATE_VERSION or state.get("mode") != mode:
+        return {}
+    return state.get("files", {})
+
+def save_review_state(owner, repo, pr_number, head_sha, mode, files):
+    try:
+        set_pr_review_state(owner, repo, pr_number, {
+            "version": REVIEW_STATE_VERSION, "head_sha": head_sha, "mode": mode, "files": files
+        })
+    except Exception as e:
+        logger.warning(f"Could not store review of PR #{pr_number}: {e}")
+
+async def plan_review(owner, repo, pr_number, token, mode):
+    """
+    Fetches the PR and splits its files into those that need a review and those whose blob SHA
+    is unchanged since the PR's last review. Returns (pr_info, head_sha, files, carried, changed,
+    ranges) with carried = {filename: {"sha", "review"}} and, in diff mode, the changed line
+    ranges of each file to review (None otherwise). Files keep only PLANNED_FILE_FIELDS.
+    """
+    async with stage("fetch"):
+        pr_info, pr_json, files = await fetch_pr_snapshot(owner, repo, pr_number, token)
+    head_sha = pr_json.get('head', {}).get('sha')
+    previous = await asyncio.to_thread(load_review_state, owner, repo, pr_number, mode)
+    carried = carried_reviews(files, previous)
+    changed = [f for f in files if f["filename"] not in carried]
+    ranges = None
+    if mode == "diff" and changed:
+        async with stage("fetch"):
+            ranges = await fetch_changed_ranges(owner, repo, pr_number, changed, token)
+        ranges = {f["filename"]: ranges[f["filename"]] for f in changed if f["filename"] in ranges}
+    # Patches were only needed for the ranges: a big PR's would otherwise be held for the whole run
+    files = [{field: f[field] for field in PLANNED_FILE_FIELDS if field in f} for f in files]
+    changed = [f for f in files if f["filename"] not in carried]
+    if previous:
+        logger.info(f"Re-reviewing {len(changed)} changed files of PR #{pr_number}, {len(carried)} carried over")
+    return pr_info, head_sha, files, carried, changed, ranges
+
+async def pipeline_stage(inbox, outbox, workers, handle):
+    """
+    Runs `handle(item)` for every item of `inbox` on `workers` concurrent consumers and puts the
+    results in `outbox`. A None item ends the stage, which then puts None in `outbox`.
+    """
+    async def consume():
+        while True:
+            item = await inbox.get()
+            if item is None:
+                await inbox.put(None)  # lets the other consumers of the stage stop too
+                return
+            await outbox.put(await handle(item))
+
+    await asyncio.gather(*(consume() for _ in range(max(workers, 1))))
+    await outbox.put(None)
+
+async def review_changed_files(pr_info, owner, repo, pr_number, changed, head_sha, token, mode,
+                               position, on_result=None, ranges=None):
+    """
+    Fetches and reviews the given PR files. Returns {filename: review or exception}; files that
+    couldn't be fetched map to an exception too. `on_result(position[filename], result)` is
+    called as soon as each file is done. In diff mode, `ranges` from plan_review saves fetching
+    the PR diff again.
+    Runs as a pipeline of fetch -> analyze -> review -> persist stages joined by bounded queues:
+    fetching waits whenever review falls behind, so only reviews, not file contents, accumulate.
+    """
+    by_file = {}
+    analysis_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    review_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    persist_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+
+    async def fetch():
+        fetched = set()
+        windows = iter_formatted_files(owner, repo, pr_number, changed, head_sha, token, PIPELINE_FETCH_WINDOW, mode,
+                                       ranges)
+        try:
+            async with aclosing(windows):
+                while True:
+                    async with stage("fetch"):
+                        formatted = await anext(windows, None)
+                    if formatted is None:
+                        break
+                    fetched.update(name for name, _ in formatted)
+                    # Small files are packed into shared LLM calls: latency is dominated by request count
+                    for batch in pack_files([text for _, text in formatted]):
+                        await analysis_queue.put([formatted[i] for i in batch])
+        except Exception as e:
+            logger.warning(f"Could not fetch {len(changed) - len(fetched)} files of PR #{pr_number}: {e}")
+        failed = [(f["filename"], RuntimeError(f"Could not fetch {f['filename']}"))
+                  for f in changed if f["filename"] not in fetched]
+        if failed:
+            await persist_queue.put(failed)
+        await analysis_queue.put(None)
+
+    async def analyze(batch):
+        # Warms the analysis cache so the reviews' own analyze_code calls return at once;
+        # files split into chunks are analyzed per chunk by the review instead
+        await asyncio.gather(*(
+            analyze_code(text) for _, text in batch if estimate_tokens(text) <= LLM_CHUNK_TOKEN_BUDGET
+        ), return_exceptions=True)
+        return batch
+
+    async def review(batch):
+        texts = [text for _, text in batch]
+        try:
+            results = await review_files(pr_info, texts, list(range(len(texts))))
+        except Exception as e:
+            results = [e] * len(batch)
+        return [(name, result) for (name, _), result in zip(batch, results)]
+
+    async def persist():
+        while (results := await persist_queue.get()) is not None:
+            for name, result in results:
+                by_file[name] = result
+                await notify(on_result, position[name], result)
+
+    stages = [
+        asyncio.create_task(fetch()),
+        asyncio.create_task(pipeline_stage(analysis_queue, review_queue, PIPELINE_ANALYZE_WORKERS, analyze)),
+        asyncio.create_task(pipeline_stage(review_queue, persist_queue, PIPELINE_REVIEW_WORKERS, review)),
+        asyncio.create_task(persist()),
     ]
-    
-    reviews = await asyncio.gather(*review_tasks, return_exceptions=True)
+    try:
+        await asyncio.gather(*stages)
+    finally:
+        for task in stages:
+            task.cancel()
+    return by_file
+
+def finish_review(owner, repo, pr_number, head_sha, mode, files, by_file):
+    """
+    Puts the per-file results in PR order, stores the successful ones for incremental
+    re-reviews and returns them. Raises if no file could be reviewed.
+    """
+    reviews = [by_file[f["filename"]] for f in files if f["filename"] in by_file]
 
     successful_reviews = []
     failed_reviews = []
@@ -41,4 +245,48 @@ async def review_pr_agents(repo_url, pr_number, token=None):
     if not successful_reviews:
         raise RuntimeError("All review tasks failed. No successful reviews generated.")
 
+    # Failed files are left out so the next push reviews them again
+    blob_shas = {f["filename"]: f.get("sha") for f in files}
+    save_review_state(owner, repo, pr_number, head_sha, mode, {
+        filename: {"sha": blob_shas[filename], "review": result}
+        for filename, result in by_file.items()
+        if not isinstance(result, Exception)
+    })
     return successful_reviews
+
+@log_async_exceptions
+async def review_pr_agents(repo_url, pr_number, token=None, review_mode=None, on_files=None, on_result=None,
+                           fan_out=None):
+    """
+    Fetches a PR and reviews its files. Files whose blob SHA is unchanged since the PR's last
+    review keep their previous result; only the others are fetched and reviewed.
+    `on_files(total)` is called once the files are known and `on_result(index, result)` as soon
+    as each file's review (or exception) is ready, `index` being the file's position in the PR.
+    `fan_out(plan)` may take over reviewing the changed files elsewhere (e.g. on other workers):
+    if it returns True, nothing is reviewed here and None is returned.
+    """
+    owner, repo = parse_repo_url(repo_url)
+    token = token or GITHUB_TOKEN
+    mode = review_mode or REVIEW_MODE
+    # LLM quota is shared per repository owner unless the caller already set a tenant
+    if llm_tenant.get() is None:
+        llm_tenant.set(owner)
+    pr_info, head_sha, files, carried, changed, ranges = await plan_review(owner, repo, pr_number, token, mode)
+    position = {f["filename"]: i for i, f in enumerate(files)}
+
+    await notify(on_files, len(carried) + len(changed))
+    for filename, entry in carried.items():
+        await notify(on_result, position[filename], entry["review"])
+
+    if fan_out is not None and changed:
+        plan = {"pr_info": pr_info, "owner": owner, "repo": repo, "pr_number": pr_number,
+                "head_sha": head_sha, "mode": mode, "files": files, "changed": changed, "position": position,
+                "ranges": ranges}
+        if await asyncio.to_thread(fan_out, plan):
+            return None
+
+    by_file = {filename: entry["review"] for filename, entry in carried.items()}
+    by_file.update(await review_changed_files(
+        pr_info, owner, repo, pr_number, changed, head_sha, token, mode, position, on_result, ranges
+    ))
+    return await asyncio.to_thread(finish_review, owner, repo, pr_number, head_sha, mode, files, by_file)
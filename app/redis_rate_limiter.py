@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import random
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from langchain_core.rate_limiters import BaseRateLimiter, InMemoryRateLimiter
+from app.redis_store import r
+from app.metrics import stage
+from app.logging_wrapper import logger
+
+# Provider quota shared by every worker, and the burst the bucket allows
+LLM_REQUESTS_PER_SECOND = float(os.getenv("LLM_REQUESTS_PER_SECOND", "0.2"))
+LLM_MAX_BUCKET_SIZE = int(os.getenv("LLM_MAX_BUCKET_SIZE", "5"))
+# Floor the adaptive rate may drop to after repeated 429s
+LLM_MIN_REQUESTS_PER_SECOND = float(os.getenv("LLM_MIN_REQUESTS_PER_SECOND", "0.02"))
+# Default per-tenant rate (0 disables tenant quotas) and per-tenant overrides as JSON
+LLM_TENANT_REQUESTS_PER_SECOND = float(os.getenv("LLM_TENANT_REQUESTS_PER_SECOND", "0"))
+LLM_TENANT_QUOTAS = json.loads(os.getenv("LLM_TENANT_QUOTAS", "{}"))
+
+# Tokens that must stay in the shared bucket after a request of this priority takes one,
+# so lower priorities never drain the burst that higher ones rely on
+PRIORITY_RESERVE = {"high": 0, "normal": 1, "low": 2}
+
+# Priority and tenant of the LLM calls made in the current task
+llm_priority = contextvars.ContextVar("llm_priority", default="normal")
+llm_tenant = contextvars.ContextVar("llm_tenant", default=None)
+
+
+@contextmanager
+def llm_request_context(priority=None, tenant=None):
+    """Sets the priority/tenant used by the rate limiter for LLM calls made inside the block."""
+    tokens = []
+    if priority is not None:
+        tokens.append((llm_priority, llm_priority.set(priority)))
+    if tenant is not None:
+        tokens.append((llm_tenant, llm_tenant.set(tenant)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+# Refills and takes one token atomically from the shared bucket (KEYS[1]) and, if given,
+# the tenant bucket (KEYS[2]). Uses Redis' clock so all workers agree on time.
+# Returns {1, "0"} on success or {0, seconds_to_wait}.
+ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local max_rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local tenant_rate = tonumber(ARGV[4])
+local ttl = 3600
+
+local function refill(key, rate, cap)
+    local b = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(b[1]) or cap
+    local ts = tonumber(b[2]) or now
+    return math.min(cap, tokens + math.max(0, now - ts) * rate)
+end
+
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or max_rate
+local tokens = refill(KEYS[1], rate, capacity)
+local wait = 0
+if tokens - reserve < 1 then
+    wait = (1 + reserve - tokens) / rate
+end
+
+local tenant_tokens = nil
+if #KEYS > 1 then
+    tenant_tokens = refill(KEYS[2], tenant_rate, 1)
+    if tenant_tokens < 1 then
+        wait = math.max(wait, (1 - tenant_tokens) / tenant_rate)
+    end
+end
+
+if wait == 0 then
+    tokens = tokens - 1
+    if tenant_tokens then tenant_tokens = tenant_tokens - 1 end
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], ttl)
+if tenant_tokens then
+    redis.call('HSET', KEYS[2], 'tokens', tenant_tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[2], ttl)
+end
+if wait == 0 then
+    return {1, '0'}
+end
+return {0, tostring(wait)}
+"""
+
+# Adjusts the shared rate: ARGV[1] = factor (multiplicative), ARGV[2] = step (additive), clamped
+ADJUST_SCRIPT = """
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or tonumber(ARGV[4])
+rate = math.max(tonumber(ARGV[3]), math.min(tonumber(ARGV[4]), rate * tonumber(ARGV[1]) + tonumber(ARGV[2])))
+redis.call('HSET', KEYS[1], 'rate', rate)
+return tostring(rate)
+"""
+
+
+class RedisTokenBucketRateLimiter(BaseRateLimiter):
+    """
+    Token bucket kept in Redis and shared by every worker, so the fleet as a whole stays
+    within the provider quota. Requests carry a priority and an optional tenant (see
+    llm_request_context). The rate adapts to the provider: halved on every 429 and grown
+    back towards the quota on success. Falls back to a per-process bucket while Redis is down.
+    """
+
+    def __init__(self, key="ratelimit:gemini", requests_per_second=LLM_REQUESTS_PER_SECOND,
+                 max_bucket_size=LLM_MAX_BUCKET_SIZE, min_requests_per_second=LLM_MIN_REQUESTS_PER_SECOND,
+                 check_every_n_seconds=0.1, client=None):
+        self.key = key
+        self.max_rate = requests_per_second
+        self.min_rate = min_requests_per_second
+        self.capacity = max_bucket_size
+        self.check_every_n_seconds = check_every_n_seconds
+        self.client = client or r
+        self._acquire_script = self.client.register_script(ACQUIRE_SCRIPT)
+        self._adjust_script = self.client.register_script(ADJUST_SCRIPT)
+        self._fallback = InMemoryRateLimiter(
+            requests_per_second=requests_per_second,
+            check_every_n_seconds=check_every_n_seconds,
+            max_bucket_size=max_bucket_size,
+        )
+        self._redis_down_until = 0.0
+
+    def _tenant_rate(self, tenant):
+        if tenant is None:
+            return 0
+        return float(LLM_TENANT_QUOTAS.get(tenant, LLM_TENANT_REQUESTS_PER_SECOND))
+
+    def _try_acquire(self):
+        """One atomic attempt. Returns (acquired, seconds_to_wait)."""
+        tenant = llm_tenant.get()
+        tenant_rate = self._tenant_rate(tenant)
+        keys = [self.key]
+        if tenant_rate > 0:
+            keys.append(f"{self.key}:tenant:{tenant}")
+        reserve = min(PRIORITY_RESERVE.get(llm_priority.get(), 1), self.capacity - 1)
+        acquired, wait = self._acquire_script(keys=keys, args=[self.max_rate, self.capacity, reserve, tenant_rate])
+        return bool(acquired), float(wait)
+
+    def _redis_available(self):
+        return time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, e):
+        logger.warning(f"Redis rate limiter unavailable, using per-process limiter for 30s: {e}")
+        self._redis_down_until = time.monotonic() + 30
+
+    def _sleep_time(self, wait):
+        # Jitter keeps waiting workers from retrying in lockstep
+        return max(wait, self.check_every_n_seconds) * random.uniform(1.0, 1.2)
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        with stage("llm_rate_limit_wait"):
+            while True:
+                if not self._redis_available():
+                    return self._fallback.acquire(blocking=blocking)
+                try:
+                    acquired, wait = self._try_acquire()
+                except Exception as e:
+                    self._redis_failed(e)
+                    continue
+                if acquired or not blocking:
+                    return acquired
+                time.sleep(self._sleep_time(wait))
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        async with stage("llm_rate_limit_wait"):
+            while True:
+                if not self._redis_available():
+                    return await self._fallback.aacquire(blocking=blocking)
+                try:
+                    acquired, wait = await asyncio.to_thread(self._try_acquire)
+                except Exception as e:
+                    self._redis_failed(e)
+                    continue
+                if acquired or not blocking:
+                    return acquired
+                await asyncio.sleep(self._sleep_time(wait))
+
+    def _adjust(self, factor, step):
+        if not self._redis_available():
+            return
+        try:
+            self._adjust_script(keys=[self.key], args=[factor, step, self.min_rate, self.max_rate])
+        except Exception as e:
+            self._redis_failed(e)
+
+    def report_throttled(self):
+        """Multiplicative decrease after the provider answered 429."""
+        self._adjust(0.5, 0)
+        logger.warning("LLM provider throttled us, halving the shared request rate")
+
+    def report_success(self):
+        """Additive increase back towards the configured quota."""
+        self._adjust(1, self.max_rate * 0.05)
+
+    def current_rate(self):
+        try:
+            rate = self.client.hget(self.key, "rate")
+            return float(rate) if rate is not None else self.max_rate
+        except Exception:
+            return self.max_rate
+
+
+def is_rate_limit_error(error):
+    """True if an exception (or its cause chain) is a provider 429 / quota error."""
+    while error is not None:
+        text = f"{type(error).__name__} {error}"
+        if "ResourceExhausted" in text or "429" in text or "RESOURCE_EXHAUSTED" in text:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
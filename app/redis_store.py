@@ -1,37 +1,294 @@
 import os
-import redis
+import time
+import gzip
 import json
+import asyncio
+import redis
+import redis.asyncio as aioredis
+from app.metrics import stage
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib json module
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # optional: falls back to gzip
+    zstandard = None
 
 
 # Get Redis URL from environment variable with a default
 REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/0')
 
+# Connections per process for the async API; requests wait for a free one instead of failing
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', '50'))
+# Seconds task state (status, per-file results, events, final result) is kept
+TASK_TTL = int(os.environ.get('TASK_TTL', str(7 * 24 * 3600)))
+# Stored blobs bigger than this are compressed (zstd if installed, else gzip)
+REDIS_COMPRESS_MIN_BYTES = int(os.environ.get('REDIS_COMPRESS_MIN_BYTES', '1024'))
+
 # Create Redis connection
 r = redis.Redis.from_url(REDIS_URL)
 
+# Events kept per task stream for /stream clients that connect late or reconnect
+TASK_EVENTS_MAXLEN = int(os.environ.get('TASK_EVENTS_MAXLEN', '2000'))
+
+# Async clients are bound to the event loop they were created on
+_aredis = None
+_aredis_stream = None
+_aredis_loop = None
+
+
+def _build_async_client(max_connections=None):
+    if max_connections is None:
+        pool = aioredis.ConnectionPool.from_url(REDIS_URL)
+    else:
+        pool = aioredis.BlockingConnectionPool.from_url(REDIS_URL, max_connections=max_connections)
+    return aioredis.Redis(connection_pool=pool)
+
+
+def get_async_redis(blocking_reads=False):
+    """
+    Returns the pooled redis.asyncio client of the running loop. Blocking reads (XREAD for
+    /stream) get their own pool so long-lived streams can't starve /status and /results.
+    """
+    global _aredis, _aredis_stream, _aredis_loop
+    loop = asyncio.get_running_loop()
+    if _aredis is None or _aredis_loop is not loop:
+        _aredis = _build_async_client(REDIS_MAX_CONNECTIONS)
+        _aredis_stream = _build_async_client()
+        _aredis_loop = loop
+    return _aredis_stream if blocking_reads else _aredis
+
+
+# First byte of a stored blob says how it is encoded; JSON written before had no prefix
+_PLAIN, _GZIP, _ZSTD = b"J", b"G", b"Z"
+
+
+def dumps(obj) -> bytes:
+    return orjson.dumps(obj) if orjson is not None else json.dumps(obj).encode()
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def encode_blob(obj) -> bytes:
+    """Serializes and, above REDIS_COMPRESS_MIN_BYTES, compresses a value for storage."""
+    data = dumps(obj)
+    if len(data) < REDIS_COMPRESS_MIN_BYTES:
+        return _PLAIN + data
+    if zstandard is not None:
+        return _ZSTD + zstandard.ZstdCompressor(level=3).compress(data)
+    return _GZIP + gzip.compress(data, compresslevel=6)
+
+
+def decode_blob(blob):
+    if blob is None:
+        return None
+    prefix, data = blob[:1], blob[1:]
+    if prefix == _PLAIN:
+        return loads(data)
+    if prefix == _ZSTD:
+        return loads(zstandard.ZstdDecompressor().decompress(data))
+    if prefix == _GZIP:
+        return loads(gzip.decompress(data))
+    return loads(blob)
+
+
+def _expire(pipe, task_id, *suffixes):
+    for suffix in suffixes:
+        pipe.expire(f"task:{task_id}:{suffix}", TASK_TTL)
+
+
+def _decode_meta(meta):
+    return {k.decode(): v.decode() for k, v in meta.items()} if meta else None
+
+
+@stage("redis_write")
+def mark_task_queued(task_id: str, repo_url, pr_number):
+    """Records a just-queued task; never overwrites state the worker may already have written."""
+    pipe = r.pipeline()
+    pipe.hsetnx(f"task:{task_id}:meta", "status", "pending")
+    pipe.hsetnx(f"task:{task_id}:meta", "repo_url", repo_url)
+    pipe.hsetnx(f"task:{task_id}:meta", "pr_number", pr_number)
+    _expire(pipe, task_id, "meta")
+    pipe.execute()
+
+@stage("redis_write")
 def init_task(task_id: str, repo_url, pr_number):
-    r.hset(f"task:{task_id}:meta", mapping={
+    """
+    Sets up a task's state as it starts running. A task Celery redelivers starts over: the first
+    run's results, events and trace are dropped, and a `reset` event tells /stream clients
+    already connected to discard what they got from it.
+    """
+    pipe = r.pipeline()
+    pipe.exists(f"task:{task_id}:events")
+    pipe.hset(f"task:{task_id}:meta", mapping={
         "status": "pending",
         "repo_url": repo_url,
         "pr_number": pr_number
     })
-    r.delete(f"task:{task_id}:hunks")
-    r.delete(f"task:{task_id}:result")
+    pipe.delete(f"task:{task_id}:hunks", f"task:{task_id}:done", f"task:{task_id}:failed",
+                f"task:{task_id}:result", f"task:{task_id}:trace")
+    # Emptied rather than deleted: the stream keeps its last ID, so the second run's events sort
+    # after everything a connected client has already read
+    pipe.xtrim(f"task:{task_id}:events", maxlen=0, approximate=False)
+    _expire(pipe, task_id, "meta")
+    if pipe.execute()[0]:
+        pipe = r.pipeline()
+        publish_task_event(task_id, "reset", {"reason": "redelivered"}, pipe)
+        _expire(pipe, task_id, "events")
+        pipe.execute()
+
+def publish_task_event(task_id: str, event: str, data: dict, pipe=None):
+    """Appends an event to the task's Redis stream, which /stream/{task_id} relays over SSE."""
+    (pipe or r).xadd(
+        f"task:{task_id}:events",
+        {"event": event, "data": json.dumps(data)},
+        maxlen=TASK_EVENTS_MAXLEN,
+        approximate=True,
+    )
 
+@stage("redis_write")
 def set_task_status(task_id: str, status: str):
-    r.hset(f"task:{task_id}:meta", "status", status)
+    pipe = r.pipeline()
+    pipe.hset(f"task:{task_id}:meta", "status", status)
+    publish_task_event(task_id, "status", {"status": status}, pipe)
+    _expire(pipe, task_id, "meta", "events")
+    pipe.execute()
+
+@stage("redis_write")
+def set_task_total(task_id: str, total: int):
+    pipe = r.pipeline()
+    pipe.hset(f"task:{task_id}:meta", mapping={"total": total, "done": 0, "failed": 0})
+    publish_task_event(task_id, "progress", {"done": 0, "failed": 0, "total": total}, pipe)
+    _expire(pipe, task_id, "meta", "events")
+    pipe.execute()
+
+@stage("redis_write")
+def add_file_result(task_id: str, index: int, result, error=None):
+    """
+    Stores one file's review as soon as it is done and publishes it with the new progress counts.
+    `result` is the review dict, or None with `error` set when the file couldn't be reviewed.
+    Counts are kept as sets of file indexes, so a file reported again (e.g. by a retried shard)
+    is only counted once.
+    """
+    meta_key = f"task:{task_id}:meta"
+    entry = {"index": index, "review": result, "error": error}
+    pipe = r.pipeline()
+    pipe.rpush(f"task:{task_id}:hunks", json.dumps(entry))
+    pipe.sadd(f"task:{task_id}:done", index)
+    if error is None:
+        pipe.srem(f"task:{task_id}:failed", index)
+    else:
+        pipe.sadd(f"task:{task_id}:failed", index)
+    pipe.scard(f"task:{task_id}:done")
+    pipe.scard(f"task:{task_id}:failed")
+    pipe.hget(meta_key, "total")
+    *_, done, failed, total = pipe.execute()
+
+    pipe = r.pipeline()
+    pipe.hset(meta_key, mapping={"done": done, "failed": failed})
+    publish_task_event(task_id, "file", entry, pipe)
+    publish_task_event(task_id, "progress", {
+        "done": done, "failed": failed, "total": int(total) if total else None
+    }, pipe)
+    _expire(pipe, task_id, "hunks", "done", "failed", "events")
+    pipe.execute()
+
+def get_file_results(task_id: str):
+    return [json.loads(item) for item in r.lrange(f"task:{task_id}:hunks", 0, -1)]
+
+def read_task_events(task_id: str, last_id="0", block_ms=15000, count=100):
+    """
+    Blocks until events newer than `last_id` arrive on the task stream (or the timeout passes).
+    Returns [(event_id, event, data_json)].
+    """
+    return _decode_events(r.xread({f"task:{task_id}:events": last_id}, count=count, block=block_ms))
+
+def _decode_events(response):
+    events = []
+    for _, entries in response or []:
+        for event_id, fields in entries:
+            events.append((event_id.decode(), fields[b"event"].decode(), fields[b"data"].decode()))
+    return events
 
 
 def get_task_status(task_id: str):
-    print(task_id)
-    meta = r.hgetall(f"task:{task_id}:meta")
-    return {k.decode(): v.decode() for k,v in meta.items()} if meta else None
+    return _decode_meta(r.hgetall(f"task:{task_id}:meta"))
 
 
+@stage("redis_write")
 def set_final_result(task_id: str, result: dict):
-    r.set(f"task:{task_id}:result", json.dumps(result))
-    set_task_status(task_id, "completed")
+    pipe = r.pipeline()
+    pipe.set(f"task:{task_id}:result", encode_blob(result), ex=TASK_TTL)
+    pipe.hset(f"task:{task_id}:meta", "status", "completed")
+    publish_task_event(task_id, "status", {"status": "completed"}, pipe)
+    _expire(pipe, task_id, "meta", "events")
+    pipe.execute()
 
 def get_final_result(task_id: str):
-    data = r.get(f"task:{task_id}:result")
-    return json.loads(data) if data else None
+    return decode_blob(r.get(f"task:{task_id}:result"))
+
+
+async def aget_task_status(task_id: str):
+    return _decode_meta(await get_async_redis().hgetall(f"task:{task_id}:meta"))
+
+async def aget_task_results(task_id: str):
+    """Status and final result of a task in one round trip: (meta or None, result or None)."""
+    pipe = get_async_redis().pipeline(transaction=False)
+    pipe.hgetall(f"task:{task_id}:meta")
+    pipe.get(f"task:{task_id}:result")
+    meta, result = await pipe.execute()
+    return _decode_meta(meta), decode_blob(result)
+
+async def aread_task_events(task_id: str, last_id="0", block_ms=15000, count=100):
+    """Async read_task_events; waits on a connection from the stream pool."""
+    client = get_async_redis(blocking_reads=True)
+    return _decode_events(await client.xread({f"task:{task_id}:events": last_id}, count=count, block=block_ms))
+
+# Seconds the last review of a PR is kept for incremental re-reviews
+PR_REVIEW_STATE_TTL = int(os.environ.get('PR_REVIEW_STATE_TTL', str(30 * 24 * 3600)))
+
+def get_pr_review_state(owner: str, repo: str, pr_number):
+    """Last reviewed head SHA and per-file results of a PR, or None if it was never reviewed."""
+    return decode_blob(r.get(f"pr:{owner}/{repo}:{pr_number}:review"))
+
+@stage("redis_write")
+def set_pr_review_state(owner: str, repo: str, pr_number, state: dict):
+    r.set(f"pr:{owner}/{repo}:{pr_number}:review", encode_blob(state), ex=PR_REVIEW_STATE_TTL)
+
+
+@stage("redis_write")
+def add_task_spans(task_id: str, spans):
+    """Appends the timed stages of a (shard of a) task to its trace, served by /trace/{task_id}."""
+    if not spans:
+        return
+    pipe = r.pipeline()
+    pipe.rpush(f"task:{task_id}:trace", *(dumps(span) for span in spans))
+    _expire(pipe, task_id, "trace")
+    pipe.execute()
+
+async def aget_task_trace(task_id: str):
+    return [loads(span) for span in await get_async_redis().lrange(f"task:{task_id}:trace", 0, -1)]
+
+def push_metrics_snapshot(process: str, data: dict):
+    """Publishes a worker process' metrics so the API's /metrics can report them."""
+    r.hset("metrics:processes", process, dumps({"ts": time.time(), "metrics": data}))
+
+async def aget_metrics_snapshots(stale_seconds: float):
+    """[(process, metrics)] reported by workers within `stale_seconds`; older entries are dropped."""
+    client = get_async_redis()
+    snapshots, stale = [], []
+    now = time.time()
+    for process, entry in (await client.hgetall("metrics:processes")).items():
+        entry = loads(entry)
+        if now - entry["ts"] > stale_seconds:
+            stale.append(process)
+        else:
+            snapshots.append((process.decode(), entry["metrics"]))
+    if stale:
+        await client.hdel("metrics:processes", *stale)
+    return snapshots
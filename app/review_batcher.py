@@ -0,0 +1,58 @@
+import os
+from app.fetch_pr_github import get_formatted_filename
+
+# Prompt tokens one batched review call may carry (file contents plus their analysis reports)
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "8000"))
+# Files estimated below this many tokens are packed together; bigger ones get their own call
+LLM_BATCH_SMALL_FILE_TOKENS = int(os.getenv("LLM_BATCH_SMALL_FILE_TOKENS", "2000"))
+LLM_BATCH_MAX_FILES = int(os.getenv("LLM_BATCH_MAX_FILES", "12"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for packing."""
+    return len(text) // 4 + 1
+
+
+def pack_files(pr_files):
+    """
+    Bin-packs formatted files into review batches, first-fit decreasing by size.
+    Returns lists of indexes into `pr_files`; large files end up alone in their batch.
+    Batches come back in order of their first file so results stay roughly in PR order.
+    """
+    sizes = [estimate_tokens(f) for f in pr_files]
+    singles = [[i] for i, size in enumerate(sizes) if size >= LLM_BATCH_SMALL_FILE_TOKENS]
+    small = sorted((i for i, size in enumerate(sizes) if size < LLM_BATCH_SMALL_FILE_TOKENS),
+                   key=lambda i: sizes[i], reverse=True)
+
+    bins = []  # [used_tokens, [indexes]]
+    for i in small:
+        for b in bins:
+            if b[0] + sizes[i] <= LLM_BATCH_TOKEN_BUDGET and len(b[1]) < LLM_BATCH_MAX_FILES:
+                b[0] += sizes[i]
+                b[1].append(i)
+                break
+        else:
+            bins.append([sizes[i], [i]])
+
+    batches = singles + [sorted(b[1]) for b in bins]
+    return sorted(batches, key=lambda batch: batch[0])
+
+
+def match_reviews(filenames, reviews):
+    """
+    Maps a batched response back to its files: by file_name, then by position if the model
+    returned exactly one review per file without usable names. Unmatched files map to None.
+    """
+    reviews = [r for r in reviews or [] if isinstance(r, dict)]
+    by_name = {}
+    for review in reviews:
+        by_name.setdefault(str(review.get("file_name", "")).strip(), review)
+
+    matched = [by_name.get(name) for name in filenames]
+    if not any(matched) and len(reviews) == len(filenames):
+        matched = list(reviews)
+    return matched
+
+
+def batch_filenames(pr_files, batch):
+    return [get_formatted_filename(pr_files[i]) or f"file_{i}" for i in batch]
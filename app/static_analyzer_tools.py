@@ -1,89 +1,186 @@
-from langchain.tools import BaseTool
-import tempfile
-import os
-import subprocess
+import re
 import ast
-from radon.complexity import cc_visit
 from app.logging_wrapper import log_async_exceptions,log_exceptions
 import textwrap
 
+# Bump whenever the checks or their output change
+ANALYZER_VERSION = "3"
+
+COMPLEXITY_THRESHOLD = 10
+NESTING_THRESHOLD = 3
+FUNCTION_LENGTH_THRESHOLD = 50
+MAX_LINE_LENGTH = 100
+
+# Everything that changes the report for a given input; part of the analysis cache key
+ANALYZER_CONFIG = {
+    "version": ANALYZER_VERSION,
+    "complexity": COMPLEXITY_THRESHOLD,
+    "nesting": NESTING_THRESHOLD,
+    "function_length": FUNCTION_LENGTH_THRESHOLD,
+    "max_line_length": MAX_LINE_LENGTH,
+}
+
+# Same defaults as pylint's invalid-name check
+SNAKE_CASE_REGEX = re.compile(r"^([^\W\dA-Z][^\WA-Z]*|__[^\WA-Z\d_][^\WA-Z]+__)$")
+PASCAL_CASE_REGEX = re.compile(r"^[^\W\da-z][^\W_]*$")
+GOOD_NAMES = {"i", "j", "k", "ex", "Run", "_"}
+
+FORMATTED_HEADER_REGEX = re.compile(r"^--- (?:Content|Changed regions) for: .* ---$")
+FORMATTED_LINE_REGEX = re.compile(r"^\s*(\d+): ?(.*)$")
+
+
+def extract_source(code_hunk: str) -> str:
+    """
+    Recovers plain source from `format_file_content`/`format_file_regions` output.
+    Lines are put back at their original numbers (gaps become blank lines), so every
+    reported line number matches the head file. The result is dedented either way, so
+    regions or chunks made only of methods still parse.
+    """
+    lines = code_hunk.splitlines()
+    if not lines or not FORMATTED_HEADER_REGEX.match(lines[0]):
+        return textwrap.dedent(code_hunk)
+    numbered = {}
+    for line in lines[1:]:
+        m = FORMATTED_LINE_REGEX.match(line)
+        if m:
+            numbered[int(m.group(1))] = m.group(2)
+    if not numbered:
+        return ""
+    return textwrap.dedent("\n".join(numbered.get(i, "") for i in range(1, max(numbered) + 1)))
+
+
+class SmellVisitor(ast.NodeVisitor):
+    """
+    Collects every check in one walk over the tree: cyclomatic complexity per function
+    (counted like radon), nesting depth of if/for/while, function length and naming.
+    """
+
+    def __init__(self):
+        self.functions = []     # [name, complexity, length] per function, in source order
+        self.max_depth = 0
+        self.naming = []        # (line, col, message)
+        self._frames = []       # functions currently being visited
+        self._depth = 0
+        self._in_class = False
+
+    def _add(self, amount):
+        if self._frames:
+            self._frames[-1][1] += amount
+
+    def _check_name(self, node, name, kind, regex, style):
+        if name in GOOD_NAMES or regex.match(name):
+            return
+        self.naming.append((
+            node.lineno, node.col_offset,
+            f'C0103: {kind} name "{name}" doesn\'t conform to {style} naming style (invalid-name)'
+        ))
+
+    def visit_FunctionDef(self, node):
+        kind = "Method" if self._in_class else "Function"
+        self._check_name(node, node.name, kind, SNAKE_CASE_REGEX, "snake_case")
+        args = node.args
+        for arg in args.posonlyargs + args.args + args.kwonlyargs + [args.vararg, args.kwarg]:
+            if arg is not None:
+                self._check_name(arg, arg.arg, "Argument", SNAKE_CASE_REGEX, "snake_case")
+        frame = [node.name, 1, node.end_lineno - node.lineno + 1]
+        self.functions.append(frame)
+        self._frames.append(frame)
+        in_class, self._in_class = self._in_class, False
+        self.generic_visit(node)
+        self._in_class = in_class
+        self._frames.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        self._check_name(node, node.name, "Class", PASCAL_CASE_REGEX, "PascalCase")
+        in_class, self._in_class = self._in_class, True
+        self.generic_visit(node)
+        self._in_class = in_class
+
+    def visit_Name(self, node):
+        if self._frames and isinstance(node.ctx, ast.Store):
+            self._check_name(node, node.id, "Variable", SNAKE_CASE_REGEX, "snake_case")
+
+    def generic_visit(self, node):
+        nests = isinstance(node, (ast.If, ast.For, ast.While))
+        if nests:
+            self._depth += 1
+            self.max_depth = max(self.max_depth, self._depth)
+
+        if isinstance(node, (ast.If, ast.IfExp, ast.Assert)):
+            self._add(1)
+        elif isinstance(node, (ast.For, ast.AsyncFor, ast.While)):
+            self._add(1 + bool(node.orelse))
+        elif isinstance(node, ast.Try):
+            self._add(len(node.handlers) + bool(node.orelse))
+        elif isinstance(node, ast.BoolOp):
+            self._add(len(node.values) - 1)
+        elif isinstance(node, ast.comprehension):
+            self._add(len(node.ifs) + 1)
+        elif isinstance(node, ast.Match):
+            wildcard = any(getattr(case.pattern, "pattern", False) is None for case in node.cases)
+            self._add(max(0, len(node.cases) - wildcard))
+
+        super().generic_visit(node)
+        if nests:
+            self._depth -= 1
+
+
+def check_line_lengths(source: str):
+    return [
+        (i, 0, f"C0301: Line too long ({len(line)}/{MAX_LINE_LENGTH}) (line-too-long)")
+        for i, line in enumerate((l.rstrip() for l in source.splitlines()), 1)
+        if len(line) > MAX_LINE_LENGTH
+    ]
+
+
 @log_exceptions
 def run_static_analyzer(code_hunk: str) -> str:
         """
         Analyze the provided Python code hunk and report detected code smells.
+        The source is parsed once and all checks run in-process in a single AST walk.
         """
-        code_hunk = textwrap.dedent(code_hunk)
+        source = extract_source(code_hunk)
         results = []
+        style_issues = []
 
-        # 1. Check cyclomatic complexity using radon
         try:
-            blocks = cc_visit(code_hunk)
-            for block in blocks:
-                if block.complexity > 10:
+            tree = ast.parse(source)
+        except (SyntaxError, ValueError) as e:
+            tree = None
+            results.append(f"AST analysis error: {e}")
+
+        if tree is not None:
+            visitor = SmellVisitor()
+            visitor.visit(tree)
+
+            # 1. Cyclomatic complexity
+            for name, complexity, _ in visitor.functions:
+                if complexity > COMPLEXITY_THRESHOLD:
                     results.append(
-                        f"Function '{block.name}' has high cyclomatic complexity: {block.complexity}."
+                        f"Function '{name}' has high cyclomatic complexity: {complexity}."
                     )
-        except Exception as e:
-            results.append(f"Cyclomatic complexity analysis error: {e}")
 
-        # 2. Detect deeply nested conditionals
-        try:
-            tree = ast.parse(code_hunk)
-            max_depth = 0
-
-            def depth(node, current):
-                nonlocal max_depth
-                if isinstance(node, (ast.If, ast.For, ast.While)):
-                    current += 1
-                    max_depth = max(max_depth, current)
-                for child in ast.iter_child_nodes(node):
-                    depth(child, current)
-
-            depth(tree, 0)
-            if max_depth > 3:
-                results.append(f"Deeply nested control flow detected (depth={max_depth}).")
-        except Exception as e:
-            results.append(f"AST analysis error: {e}")
+            # 2. Deeply nested conditionals
+            if visitor.max_depth > NESTING_THRESHOLD:
+                results.append(f"Deeply nested control flow detected (depth={visitor.max_depth}).")
 
-        # 3. Check for long functions (over 50 lines)
-        lines = code_hunk.splitlines()
-        func_line_counts = {}
-        current_name = None
-        current_count = 0
-        for line in lines:
-            if line.strip().startswith('def '):
-                if current_name and current_count > 50:
+            # 3. Long functions
+            for name, _, length in visitor.functions:
+                if length > FUNCTION_LENGTH_THRESHOLD:
                     results.append(
-                        f"Function '{current_name}' is too long ({current_count} lines)."
+                        f"Function '{name}' is too long ({length} lines)."
                     )
-                current_name = line.strip().split()[1].split('(')[0]
-                current_count = 1
-            elif current_name:
-                current_count += 1
-        if current_name and current_count > 50:
-            results.append(
-                f"Function '{current_name}' is too long ({current_count} lines)."
-            )
-
-        # 4. Invoke pylint for naming and style issues
-        try:
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as tmp:
-                tmp.write(code_hunk)
-                tmp_path = tmp.name
-            result = subprocess.run([
-                'pylint', tmp_path, '--disable=all', '--enable=C0103,C0301,E1101'
-            ], capture_output=True, text=True)
-            if result.stdout:
-                results.append("Pylint issues:\n" + result.stdout)
-        except Exception as e:
-            results.append(f"Pylint analysis error: {e}")
-        finally:
-            try:
-                os.remove(tmp_path)
-            except:
-                pass
+            style_issues.extend(visitor.naming)
+
+        # 4. Naming and line-length issues, in pylint's message format
+        style_issues.extend(check_line_lengths(source))
+        if style_issues:
+            results.append("Pylint issues:\n" + "\n".join(
+                f"{line}:{col}: {message}" for line, col, message in sorted(style_issues)
+            ))
 
         if not results:
             return "No obvious code smells detected."
         return "\n".join(results)
-
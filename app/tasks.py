@@ -1,10 +1,25 @@
 import os
 import time
+import uuid
 import logging
-from celery import Celery
+from celery import Celery, chord
+from kombu import Queue
+from celery.signals import worker_init, worker_shutdown, worker_process_init, worker_process_shutdown
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as PreforkPool
 from app.redis_store import *
 import asyncio
-from app.process_pr_review import review_pr_agents
+from app.process_pr_review import (
+    review_pr_agents, review_changed_files, finish_review, load_review_state, carried_reviews
+)
+from app.redis_rate_limiter import llm_tenant, llm_request_context
+from app.lanes import (
+    LANES, LANE_STANDARD, LANE_BULK, BASE_PRIORITY, message_priority, lane_task_queued, lane_task_started, lane_task_finished
+)
+from app.fetch_pr_github import GITHUB_TOKEN
+from app.worker_runtime import start_worker_runtime, stop_worker_runtime, run_coroutine
+from app.analysis_pool import start_analysis_pool, shutdown_analysis_pool
+from app.metrics import stage, start_trace, snapshot, process_label
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -13,6 +28,14 @@ logger = logging.getLogger(__name__)
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://redis:6379/0')
 CELERY_BACKEND_URL = os.environ.get('CELERY_BACKEND_URL','redis://redis:6379/0')
 
+# PRs with more files to review than this are split into shards reviewed across the worker pool
+SHARD_FILE_THRESHOLD = int(os.environ.get('SHARD_FILE_THRESHOLD', '50'))
+# Files per shard, and how often a failed shard is retried before its files count as failed
+SHARD_SIZE = int(os.environ.get('SHARD_SIZE', '20'))
+SHARD_MAX_RETRIES = int(os.environ.get('SHARD_MAX_RETRIES', '2'))
+# Minimum seconds between two pushes of this worker's metrics to Redis (read by the API's /metrics)
+METRICS_PUSH_INTERVAL = float(os.environ.get('METRICS_PUSH_INTERVAL', '15'))
+
 # Initialize Celery
 cel = Celery(__name__, broker=CELERY_BROKER_URL, backend=CELERY_BACKEND_URL)
 
@@ -25,7 +48,15 @@ cel.conf.update(
     task_reject_on_worker_lost=True,
     task_serializer='json',
     accept_content=['json'],
-    result_serializer='json')
+    result_serializer='json',
+    # One queue per lane; a worker started without -Q consumes all of them
+    task_queues=[Queue(lane) for lane in LANES],
+    task_default_queue=LANE_STANDARD,
+    # Lets message priorities (0 first, 9 last) order tasks within a lane on the Redis broker
+    broker_transport_options={'priority_steps': list(range(10)), 'sep': ':', 'queue_order_strategy': 'priority'},
+    task_default_priority=3,
+    # Take one task at a time so a queued high-priority or small PR isn't stuck behind prefetched ones
+    worker_prefetch_multiplier=1)
 
 # Windows-specific configuration
 if os.name == 'nt':  # Windows
@@ -35,6 +66,58 @@ if os.name == 'nt':  # Windows
         worker_cancel_long_running_tasks_on_connection_loss=True,
     )
 
+def _forks_children(worker):
+    return issubclass(get_implementation(worker.pool_cls), PreforkPool)
+
+@worker_process_init.connect
+def warm_worker(**kwargs):
+    """
+    Starts the static analysis pool and the long-lived event loop once per worker process,
+    so every task reuses them along with the sessions and clients living on that loop.
+    """
+    start_analysis_pool()
+    start_worker_runtime()
+
+@worker_init.connect
+def warm_main_process(sender=None, **kwargs):
+    """
+    The threads pool runs tasks in the main worker process, which (unlike prefork children)
+    may start the analysis processes: one pool for all the worker's tasks.
+    """
+    if sender is not None and not _forks_children(sender):
+        warm_worker()
+
+@worker_process_shutdown.connect
+def stop_worker(**kwargs):
+    stop_worker_runtime()
+    shutdown_analysis_pool()
+    report_metrics(force=True)
+
+@worker_shutdown.connect
+def stop_main_process(sender=None, **kwargs):
+    if sender is not None and not _forks_children(sender):
+        stop_worker()
+
+_metrics_pushed_at = 0.0
+
+def report_metrics(force=False):
+    """Pushes this worker's metrics snapshot, at most every METRICS_PUSH_INTERVAL seconds."""
+    global _metrics_pushed_at
+    now = time.monotonic()
+    if not force and now - _metrics_pushed_at < METRICS_PUSH_INTERVAL:
+        return
+    _metrics_pushed_at = now
+    try:
+        push_metrics_snapshot(process_label(), snapshot())
+    except Exception as e:
+        logger.warning(f"Could not push worker metrics: {e}")
+
+def save_trace(task_id, spans):
+    try:
+        add_task_spans(task_id, spans)
+    except Exception as e:
+        logger.warning(f"Could not store trace of task {task_id}: {e}")
+
 def safe_redis_operation(operation, *args, **kwargs):
     """Wrapper for Redis operations with error handling"""
     max_retries = 2
@@ -51,15 +134,162 @@ def safe_redis_operation(operation, *args, **kwargs):
                 raise
             time.sleep(1)  # Wait before retrying
 
+def publish_file_result(task_id, index, result):
+    """Stores and streams one file's review (or failure) while the rest of the PR is still running."""
+    if isinstance(result, Exception):
+        safe_redis_operation(add_file_result, task_id, index, None, error=str(result))
+    else:
+        safe_redis_operation(add_file_result, task_id, index, result)
+
+def _shard_ranges(ranges, shard):
+    if ranges is None:
+        return None
+    return {f["filename"]: ranges[f["filename"]] for f in shard if f["filename"] in ranges}
+
+def fan_out_review(task_id, github_token, plan, lane=None, tenant=None, priority=None):
+    """
+    Sends the changed files of a large PR to the pool as a chord of shard tasks, merged by
+    merge_review_shards. Returns False (review in this process) for PRs under the threshold.
+    Every shard counts against the tenant's share of the lane until it is done, so a huge PR's
+    shards drop in priority one share at a time instead of crowding out other tenants.
+    """
+    changed = plan["changed"]
+    if len(changed) <= SHARD_FILE_THRESHOLD:
+        return False
+    lane = lane or LANE_BULK
+    tenant = tenant or plan["owner"]
+    shards = [changed[i:i + SHARD_SIZE] for i in range(0, len(changed), SHARD_SIZE)]
+    header, shard_ids = [], []
+    for shard in shards:
+        shard_id = str(uuid.uuid4())
+        shard_priority = message_priority(lane, tenant, priority)
+        lane_task_queued(shard_id, lane, tenant)
+        shard_ids.append(shard_id)
+        header.append(review_shard.s(
+            task_id, plan["pr_info"], plan["owner"], plan["repo"], plan["pr_number"],
+            shard, [plan["position"][f["filename"]] for f in shard],
+            plan["head_sha"], github_token, plan["mode"], tenant, lane,
+            _shard_ranges(plan.get("ranges"), shard),
+        ).set(queue=lane, priority=shard_priority, task_id=shard_id))
+    files = [{"filename": f["filename"], "sha": f.get("sha"), **({"summary": f["summary"]} if "summary" in f else {})}
+             for f in plan["files"]]
+    merge = merge_review_shards.s(task_id, plan["owner"], plan["repo"], plan["pr_number"],
+                                  plan["head_sha"], plan["mode"], files)
+    try:
+        # The merge is cheap and releases the PR's result: it goes at the request's own priority
+        chord(header)(merge.set(queue=lane, priority=BASE_PRIORITY.get(priority or "normal", BASE_PRIORITY["normal"])))
+    except Exception:
+        for shard_id in shard_ids:
+            lane_task_finished(shard_id, lane, tenant)
+        raise
+    logger.info("Fanned out %d files of PR #%s into %d shards", len(changed), plan["pr_number"], len(shards))
+    return True
+
+async def run_review(repo_url, pr_number, github_token, review_mode=None, task_id=None,
+                     priority=None, tenant=None, lane=None):
+    """Runs the review; returns None if the PR was fanned out to shard tasks instead."""
+    on_files = on_result = fan_out = None
+    if task_id is not None:
+        on_files = lambda total: safe_redis_operation(set_task_total, task_id, total)
+        on_result = lambda index, result: publish_file_result(task_id, index, result)
+        fan_out = lambda plan: fan_out_review(task_id, github_token, plan, lane, tenant, priority)
+    spans = start_trace()
+    try:
+        # The tenant's LLM quota and the request's priority apply to every LLM call of the review
+        with llm_request_context(priority, tenant):
+            async with stage("review"):
+                return await review_pr_agents(repo_url, pr_number, github_token, review_mode,
+                                              on_files=on_files, on_result=on_result, fan_out=fan_out)
+    finally:
+        if task_id is not None:
+            # Off the loop: it is shared by every review running in this worker
+            await asyncio.to_thread(save_trace, task_id, spans)
+
+async def run_shard(task_id, pr_info, owner, repo, pr_number, files, positions, head_sha, github_token, mode,
+                    tenant=None, ranges=None):
+    llm_tenant.set(tenant or owner)
+    position = dict(zip((f["filename"] for f in files), positions))
+    on_result = lambda index, result: publish_file_result(task_id, index, result)
+    spans = start_trace()
+    try:
+        async with stage("shard"):
+            return await review_changed_files(pr_info, owner, repo, pr_number, files, head_sha,
+                                              github_token or GITHUB_TOKEN, mode, position, on_result, ranges)
+    finally:
+        await asyncio.to_thread(save_trace, task_id, spans)
+
+@cel.task(bind=True, max_retries=SHARD_MAX_RETRIES)
+def review_shard(self, task_id, pr_info, owner, repo, pr_number, files, positions, head_sha, github_token, mode,
+                 tenant=None, lane=None, ranges=None):
+    """
+    Reviews one shard of a large PR. A shard that errors out, or whose files all failed, is
+    retried on its own; once out of retries its files are reported as failed so the merge runs.
+    The shard keeps its place in the tenant's lane share until it stops retrying.
+    """
+    if lane is not None:
+        lane_task_started(self.request.id, lane)
+    retrying = False
+    try:
+        by_file = run_coroutine(run_shard(task_id, pr_info, owner, repo, pr_number, files, positions,
+                                        head_sha, github_token, mode, tenant, ranges))
+        if by_file and all(isinstance(result, Exception) for result in by_file.values()):
+            raise next(iter(by_file.values()))
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            retrying = True
+            raise self.retry(exc=e, countdown=5 * 2 ** self.request.retries)
+        logger.error("Shard of PR #%s failed after %d retries: %s", pr_number, self.request.retries, e)
+        by_file = {f["filename"]: e for f in files}
+        for f, index in zip(files, positions):
+            publish_file_result(task_id, index, e)
+    finally:
+        if lane is not None and not retrying:
+            lane_task_finished(self.request.id, lane, tenant)
+        report_metrics()
+    return {
+        "reviews": {name: result for name, result in by_file.items() if not isinstance(result, Exception)},
+        "errors": {name: str(result) for name, result in by_file.items() if isinstance(result, Exception)},
+    }
+
+@cel.task
+def merge_review_shards(shard_results, task_id, owner, repo, pr_number, head_sha, mode, files):
+    """Chord callback: combines the shards with the carried-over results and stores the final result."""
+    try:
+        by_file = {name: entry["review"] for name, entry in
+                   carried_reviews(files, load_review_state(owner, repo, pr_number, mode)).items()}
+        for shard in shard_results:
+            by_file.update((name, RuntimeError(error)) for name, error in shard["errors"].items())
+            by_file.update(shard["reviews"])
+        reviews = finish_review(owner, repo, pr_number, head_sha, mode, files, by_file)
+        logger.info("Merged %d shards of PR #%s, got %d reviews", len(shard_results), pr_number, len(reviews))
+        set_final_result(task_id, reviews)
+        return len(reviews)
+    except Exception as e:
+        set_task_status(task_id, "failed")
+        raise e
+    finally:
+        report_metrics()
+
 @cel.task(bind=True)
-def analyze_pr(self,repo_url,pr_number,github_token):
+def analyze_pr(self,repo_url,pr_number,github_token,review_mode=None,priority=None,tenant=None,lane=None):
+    if lane is not None:
+        lane_task_started(self.request.id, lane)
+    init_task(self.request.id, repo_url, pr_number)
     set_task_status(self.request.id, "processing")
     try:
-        reviews  =  asyncio.run(review_pr_agents(repo_url,pr_number,github_token))
+        reviews  =  run_coroutine(run_review(repo_url,pr_number,github_token,review_mode,self.request.id,
+                                             priority,tenant,lane))
+        if reviews is None:
+            # Large PR: the shards are running and merge_review_shards stores the result
+            return None
         logger.info("Finished agents, got %d reviews", len(reviews))
         set_final_result(self.request.id,reviews)
         return reviews
     except Exception as e:
         set_task_status(self.request.id, "failed")
         raise e
+    finally:
+        if lane is not None:
+            lane_task_finished(self.request.id, lane, tenant)
+        report_metrics()
 
@@ -0,0 +1,80 @@
+import os
+import asyncio
+import threading
+from app.github_client import close_github_session
+from app.logging_wrapper import logger
+
+# Seconds given to in-flight coroutines and open sessions when the worker shuts down
+WORKER_SHUTDOWN_TIMEOUT = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "10"))
+
+_loop = None
+_thread = None
+_pid = None
+_lock = threading.Lock()
+
+
+def _serve(loop, ready):
+    asyncio.set_event_loop(loop)
+    loop.call_soon(ready.set)
+    loop.run_forever()
+
+
+def start_worker_runtime():
+    """
+    Starts this process's long-lived event loop in a daemon thread; safe to call more than once.
+    Every task coroutine runs on it, so pooled sessions, LLM clients and in-process caches
+    stay warm from one task to the next.
+    """
+    global _loop, _thread, _pid
+    with _lock:
+        # A forked child inherits the loop object but not the thread running it
+        if _loop is not None and _pid == os.getpid() and _thread.is_alive():
+            return _loop
+        ready = threading.Event()
+        _loop = asyncio.new_event_loop()
+        _thread = threading.Thread(target=_serve, args=(_loop, ready), name="worker-runtime", daemon=True)
+        _pid = os.getpid()
+        _thread.start()
+        ready.wait()
+        return _loop
+
+
+def run_coroutine(coro):
+    """
+    Runs a coroutine on the worker loop from synchronous (task) code and returns its result.
+    Safe to call from several threads at once, e.g. with the threads pool.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, start_worker_runtime())
+    try:
+        return future.result()
+    except BaseException:
+        # e.g. a task time limit: don't leave the coroutine running on the shared loop
+        future.cancel()
+        raise
+
+
+async def _drain():
+    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=WORKER_SHUTDOWN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+    await close_github_session()
+
+
+def stop_worker_runtime():
+    """Lets in-flight coroutines finish (up to WORKER_SHUTDOWN_TIMEOUT), closes sessions and the loop."""
+    global _loop, _thread
+    with _lock:
+        if _loop is None or _pid != os.getpid() or not _thread.is_alive():
+            _loop = _thread = None
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(_drain(), _loop).result(WORKER_SHUTDOWN_TIMEOUT + 5)
+        except Exception as e:
+            logger.warning(f"Worker runtime did not shut down cleanly: {e}")
+        _loop.call_soon_threadsafe(_loop.stop)
+        _thread.join(timeout=5)
+        if not _thread.is_alive():
+            _loop.close()
+        _loop = _thread = None
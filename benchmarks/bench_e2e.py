@@ -0,0 +1,264 @@
+"""
+End-to-end throughput of PR reviews against local stand-ins for GitHub (benchmarks.fake_github)
+and Gemini (benchmarks.fake_llm). Two modes, each at several concurrency levels:
+
+  direct  review_pr_agents called on the worker event loop, N PRs in flight at once
+  api     N clients each POST /analyze-pr and poll /results, against the API served by uvicorn
+          and a Celery worker (threads pool) running in this process
+
+Reports p50/p95 PR latency, files/sec and the time spent per pipeline stage (from app.metrics),
+and writes them as JSON; pass a previous file as --baseline to fail on regressions.
+Needs a Redis server (REDIS_URL, default redis://localhost:6379/0); every PR gets a fresh number,
+SHA and contents, so the caches in Redis don't skew the results.
+
+    python -m benchmarks.bench_e2e --files 20 --lines 150 --concurrency 1,4,16 --output bench.json
+    python -m benchmarks.bench_e2e --output new.json --baseline bench.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import itertools
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+os.environ.setdefault("CELERY_BROKER_URL", os.environ["REDIS_URL"])
+os.environ.setdefault("CELERY_BACKEND_URL", os.environ["REDIS_URL"])
+
+import logging
+import requests
+import uvicorn
+from app import fetch_pr_github
+from app import metrics
+from app.logging_wrapper import logger
+from app.process_pr_review import review_pr_agents
+from app.worker_runtime import run_coroutine, stop_worker_runtime
+from app.analysis_pool import shutdown_analysis_pool
+from benchmarks.fake_github import FakeGitHub
+from benchmarks.fake_llm import install_fake_llm
+
+RESULT_FORMAT_VERSION = 1
+TOKEN = "bench-token"
+# Fresh PR numbers for every run, so no cache (ETag, blob, analysis, LLM, review state) applies
+_pr_numbers = itertools.count(int(time.time()) % 1_000_000 * 1000)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def stage_totals():
+    """{stage: (calls, seconds)} recorded so far in this process."""
+    return {key[0]: (series[-2], series[-1]) for key, series in metrics.stage_seconds.snapshot()}
+
+
+def stage_breakdown(before, after):
+    breakdown = {}
+    for name, (calls, seconds) in sorted(after.items()):
+        prev_calls, prev_seconds = before.get(name, (0, 0.0))
+        if calls > prev_calls:
+            breakdown[name] = {"calls": calls - prev_calls, "seconds": round(seconds - prev_seconds, 4)}
+    return breakdown
+
+
+async def review_direct(repo_url, pr_numbers, concurrency):
+    """Reviews the PRs with at most `concurrency` in flight; returns [(latency, reviewed, ok)]."""
+    pending = list(pr_numbers)
+    outcomes = []
+
+    async def client():
+        while pending:
+            pr_number = pending.pop()
+            start = time.perf_counter()
+            try:
+                reviews = await review_pr_agents(repo_url, pr_number, TOKEN)
+                outcomes.append((time.perf_counter() - start, len(reviews), True))
+            except Exception as e:
+                logger.warning(f"Benchmark PR #{pr_number} failed: {e}")
+                outcomes.append((time.perf_counter() - start, 0, False))
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return outcomes
+
+
+def start_api():
+    """Serves app.main on a free local port from a daemon thread; returns the base URL."""
+    from app.main import app
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    threading.Thread(target=server.run, name="bench-api", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+def start_worker(concurrency):
+    """Runs a Celery worker (threads pool) for app.tasks in a daemon thread."""
+    from celery.worker import WorkController
+    from app.tasks import cel
+    worker = WorkController(app=cel, pool_cls="threads", concurrency=concurrency, loglevel="WARNING",
+                            without_heartbeat=True, without_mingle=True, without_gossip=True)
+    threading.Thread(target=worker.start, name="bench-worker", daemon=True).start()
+    return worker
+
+
+def review_via_api(api_url, repo_url, pr_number, poll_interval, timeout):
+    """Submits one PR and polls until its results are in; returns (latency, reviewed, ok)."""
+    session = requests.Session()
+    start = time.perf_counter()
+    resp = session.post(f"{api_url}/analyze-pr", json={
+        "repo_url": repo_url, "pr_number": pr_number, "github_token": TOKEN,
+    })
+    resp.raise_for_status()
+    task_id = resp.json()["task_id"]
+    while time.perf_counter() - start < timeout:
+        resp = session.get(f"{api_url}/results/{task_id}")
+        if resp.status_code == 200:
+            return time.perf_counter() - start, len(resp.json()["results"]), True
+        status = session.get(f"{api_url}/status/{task_id}")
+        if status.status_code == 200 and status.json()["status"] == "failed":
+            break
+        time.sleep(poll_interval)
+    logger.warning(f"Benchmark PR #{pr_number} failed or timed out (task {task_id})")
+    return time.perf_counter() - start, 0, False
+
+
+def run_level(mode, concurrency, args, repo_url, api_url=None):
+    pr_numbers = [next(_pr_numbers) for _ in range(args.prs or concurrency * 2)]
+    before = stage_totals()
+    start = time.perf_counter()
+    if mode == "direct":
+        outcomes = run_coroutine(review_direct(repo_url, pr_numbers, concurrency))
+    else:
+        with ThreadPoolExecutor(concurrency) as pool:
+            outcomes = list(pool.map(
+                lambda n: review_via_api(api_url, repo_url, n, args.poll_interval, args.timeout), pr_numbers
+            ))
+    wall = time.perf_counter() - start
+    latencies = [latency for latency, _, ok in outcomes if ok] or [wall]
+    reviewed = sum(count for _, count, _ in outcomes)
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "prs": len(pr_numbers),
+        "failed_prs": sum(1 for _, _, ok in outcomes if not ok),
+        "files": len(pr_numbers) * args.files,
+        "files_reviewed": reviewed,
+        "wall_seconds": round(wall, 4),
+        "latency_p50": round(percentile(latencies, 50), 4),
+        "latency_p95": round(percentile(latencies, 95), 4),
+        "files_per_sec": round(reviewed / wall, 3),
+        "stages": stage_breakdown(before, stage_totals()),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "commit": commit}
+
+
+def compare(results, baseline, tolerance):
+    """Prints the change against a baseline per (mode, concurrency); returns the regressions."""
+    previous = {(run["mode"], run["concurrency"]): run for run in baseline.get("runs", [])}
+    regressions = []
+    for run in results["runs"]:
+        old = previous.get((run["mode"], run["concurrency"]))
+        if old is None:
+            continue
+        p95 = run["latency_p95"] / old["latency_p95"] - 1 if old["latency_p95"] else 0.0
+        rate = run["files_per_sec"] / old["files_per_sec"] - 1 if old["files_per_sec"] else 0.0
+        print(f"{run['mode']:>6} x{run['concurrency']:<3} p95 {p95:+7.1%}  files/sec {rate:+7.1%}")
+        if p95 > tolerance or rate < -tolerance:
+            regressions.append((run["mode"], run["concurrency"]))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=["direct", "api", "both"], default="both")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated PRs in flight per level")
+    parser.add_argument("--prs", type=int, default=0, help="PRs per level (default: 2 x concurrency)")
+    parser.add_argument("--files", type=int, default=20, help="files per synthetic PR")
+    parser.add_argument("--lines", type=int, default=120, help="lines per synthetic file")
+    parser.add_argument("--github-latency", type=float, default=0.02, help="seconds added to every GitHub response")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="mean seconds per LLM call")
+    parser.add_argument("--llm-rps", type=float, default=0, help="provider-side LLM requests/sec limit (0: none)")
+    parser.add_argument("--workers", type=int, default=4, help="Celery worker threads in api mode")
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before an api-mode PR counts as failed")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.WARNING)
+
+    github = FakeGitHub(args.files, args.lines, args.github_latency)
+    fetch_pr_github.API_URL = github.start()
+    llm = install_fake_llm(args.llm_latency, args.llm_rps)
+    repo_url = "https://github.com/bench/synthetic"
+    levels = [int(level) for level in args.concurrency.split(",")]
+    modes = ["direct", "api"] if args.mode == "both" else [args.mode]
+
+    api_url = worker = None
+    if "api" in modes:
+        worker = start_worker(args.workers)
+        api_url = start_api()
+
+    # Warm-up (process pools, compiled chains, connections) is not measured
+    run_coroutine(review_direct(repo_url, [next(_pr_numbers)], 1))
+
+    runs = []
+    for mode in modes:
+        for concurrency in levels:
+            calls, throttled = llm.calls, llm.throttled
+            run = run_level(mode, concurrency, args, repo_url, api_url)
+            run["llm_calls"], run["llm_throttled"] = llm.calls - calls, llm.throttled - throttled
+            runs.append(run)
+            print(f"{mode:>6} x{concurrency:<3} p50 {run['latency_p50']:7.3f}s  p95 {run['latency_p95']:7.3f}s  "
+                  f"{run['files_per_sec']:8.2f} files/s  failed PRs {run['failed_prs']}")
+            for name, stage in run["stages"].items():
+                print(f"{'':13}{name:<20} {stage['seconds']:9.3f}s over {stage['calls']} calls")
+
+    if worker is not None:
+        worker.stop()
+    stop_worker_runtime()
+    shutdown_analysis_pool()
+
+    results = {
+        "version": RESULT_FORMAT_VERSION,
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "environment": environment(),
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regressed beyond {args.tolerance:.0%}: {regressions}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""
+Per-call setup overhead of an LLM chain: rebuilding prompt, format instructions and client
+on every call (the old aexecute_chain) versus the compiled-chain registry in app.llm_garden.
+No model is called; both sides render the same prompt so only setup cost differs.
+
+    python -m benchmarks.bench_llm_chain [iterations]
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+from langchain.prompts import PromptTemplate
+from langchain_google_genai import ChatGoogleGenerativeAI
+from app.llm_garden import LLM_MODEL, get_chain, rate_limiter
+from app.pr_review_agent import final_review_parser
+
+TEMPLATE = "Review this code.\n=== PR Info ====\n{pr_info}\n\n=== Code Hunk ===\n{code_hunk}\n"
+INPUT_VARS = {"pr_info": "Title: benchmark", "code_hunk": "1: def foo():\n2:     return 42"}
+
+
+def rebuild_per_call():
+    template = TEMPLATE + "\n {format_instructions} "
+    prompt = PromptTemplate(
+        template=template,
+        input_variables=list(INPUT_VARS.keys()),
+        partial_variables={"format_instructions": final_review_parser.get_format_instructions()},
+    )
+    llm = ChatGoogleGenerativeAI(model=LLM_MODEL, rate_limiter=rate_limiter)
+    chain = prompt | llm | final_review_parser
+    return chain.first.invoke(INPUT_VARS)
+
+
+def compiled_registry():
+    chain, _ = get_chain(TEMPLATE, final_review_parser)
+    return chain.first.invoke(INPUT_VARS)
+
+
+def bench(fn, iterations):
+    fn()  # warm-up (and first compilation for the registry)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    before = bench(rebuild_per_call, iterations)
+    after = bench(compiled_registry, iterations)
+    print(f"rebuild per call:  {before * 1e6:9.1f} us/call")
+    print(f"compiled registry: {after * 1e6:9.1f} us/call")
+    print(f"speedup:           {before / after:9.1f}x")
@@ -0,0 +1,74 @@
+"""
+Task-start overhead of a small PR: a fresh event loop per task (asyncio.run, new session and
+connections every time) versus the worker's long-lived loop in app.worker_runtime (warm pooled
+session). Each "task" makes a few GitHub-style requests to a local HTTP server.
+
+    python -m benchmarks.bench_worker_runtime [tasks]
+"""
+import sys
+import time
+import asyncio
+import threading
+from aiohttp import web
+from app.github_client import get_github_session, close_github_session
+from app.worker_runtime import run_coroutine, stop_worker_runtime
+
+REQUESTS_PER_TASK = 3
+
+
+async def handler(request):
+    return web.json_response({"sha": "a" * 40})
+
+
+def start_server():
+    ready = threading.Event()
+    holder = {}
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(web.Application())
+        runner.app.router.add_get("/{tail:.*}", handler)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        loop.run_until_complete(site.start())
+        holder["port"] = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{holder['port']}"
+
+
+async def small_pr(url):
+    session = get_github_session()
+    for i in range(REQUESTS_PER_TASK):
+        async with session.get(f"{url}/repos/o/r/pulls/{i}") as resp:
+            await resp.json()
+
+
+async def per_task_loop(url):
+    try:
+        await small_pr(url)
+    finally:
+        await close_github_session()
+
+
+def bench(run_task, tasks):
+    run_task()  # warm-up
+    start = time.perf_counter()
+    for _ in range(tasks):
+        run_task()
+    return (time.perf_counter() - start) / tasks
+
+
+if __name__ == "__main__":
+    tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    url = start_server()
+    before = bench(lambda: asyncio.run(per_task_loop(url)), tasks)
+    after = bench(lambda: run_coroutine(small_pr(url)), tasks)
+    stop_worker_runtime()
+    print(f"asyncio.run per task: {before * 1e3:8.2f} ms/task")
+    print(f"worker runtime:       {after * 1e3:8.2f} ms/task")
+    print(f"speedup:              {before / after:8.1f}x")
@@ -0,0 +1,209 @@
+"""
+Local stand-in for the GitHub REST API, serving synthetic pull requests through the endpoints
+app.fetch_pr_github uses: PR details and diff, the paged file list, file contents and the
+repository tarball. Every PR number gets its own head SHA and file contents, so caches keyed by
+URL, SHA or content never carry over from one benchmarked PR to the next.
+
+    server = FakeGitHub(files_per_pr=20, lines_per_file=120)
+    url = server.start()   # then point GITHUB_API_URL / fetch_pr_github.API_URL at it
+"""
+import io
+import time
+import base64
+import asyncio
+import hashlib
+import tarfile
+import threading
+from aiohttp import web
+
+PER_PAGE_MAX = 100
+
+
+def head_sha(owner, repo, pr_number):
+    return hashlib.sha1(f"{owner}/{repo}#{pr_number}".encode()).hexdigest()
+
+
+def blob_sha(content):
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def synthetic_file(pr_number, index, lines):
+    """A Python module of about `lines` lines: small functions with branches and loops."""
+    out = [f'"""Synthetic module {index} of PR {pr_number}."""', "import os", ""]
+    fn = 0
+    while len(out) < lines:
+        out.extend([
+            "",
+            f"def handler_{pr_number}_{index}_{fn}(items, limit={fn + 1}):",
+            f'    """Processes items for step {fn}."""',
+            "    total = 0",
+            "    for item in items:",
+            "        if item > limit:",
+            "            total += item * 2",
+            "        else:",
+            "            total -= 1",
+            f"    return total + {fn}",
+        ])
+        fn += 1
+    return "\n".join(out[:lines]) + "\n"
+
+
+class FakeGitHub:
+    """
+    Synthetic PRs of `files_per_pr` Python files of `lines_per_file` lines each. `latency` seconds
+    are added to every response, and the usual X-RateLimit-* headers report a large budget.
+    """
+
+    def __init__(self, files_per_pr=20, lines_per_file=120, latency=0.0):
+        self.files_per_pr = files_per_pr
+        self.lines_per_file = lines_per_file
+        self.latency = latency
+        self.requests = 0
+        self._files = {}
+
+    def files(self, pr_number):
+        """[(filename, content)] of a PR, generated once per PR number."""
+        files = self._files.get(pr_number)
+        if files is None:
+            files = self._files[pr_number] = [
+                (f"pkg/module_{i}.py", synthetic_file(pr_number, i, self.lines_per_file))
+                for i in range(self.files_per_pr)
+            ]
+        return files
+
+    def _headers(self, etag=None):
+        headers = {
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": "4999",
+            "X-RateLimit-Reset": str(int(time.time()) + 3600),
+        }
+        if etag:
+            headers["ETag"] = f'"{etag}"'
+        return headers
+
+    async def _respond(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _diff(self, pr_number):
+        parts = []
+        for filename, content in self.files(pr_number):
+            lines = content.splitlines()
+            parts.append(f"diff --git a/{filename} b/{filename}\nnew file mode 100644\n"
+                         f"--- /dev/null\n+++ b/{filename}\n@@ -0,0 +1,{len(lines)} @@\n"
+                         + "\n".join("+" + line for line in lines))
+        return "\n".join(parts) + "\n"
+
+    async def pull(self, request):
+        await self._respond(request)
+        owner, repo = request.match_info["owner"], request.match_info["repo"]
+        pr_number = int(request.match_info["number"])
+        sha = head_sha(owner, repo, pr_number)
+        if "diff" in request.headers.get("Accept", ""):
+            return web.Response(text=self._diff(pr_number), headers=self._headers(f"diff-{sha}"))
+        files = self.files(pr_number)
+        additions = sum(len(content.splitlines()) for _, content in files)
+        return web.json_response({
+            "number": pr_number,
+            "title": f"Synthetic PR {pr_number}",
+            "state": "open",
+            "user": {"login": "bench"},
+            "html_url": f"https://github.com/{owner}/{repo}/pull/{pr_number}",
+            "body": "Generated by benchmarks.fake_github",
+            "head": {"sha": sha, "ref": f"bench-{pr_number}", "label": f"{owner}:bench-{pr_number}"},
+            "base": {"sha": "0" * 40, "ref": "main", "label": f"{owner}:main"},
+            "commits": 1,
+            "changed_files": len(files),
+            "additions": additions,
+            "deletions": 0,
+        }, headers=self._headers(sha))
+
+    async def pull_files(self, request):
+        await self._respond(request)
+        pr_number = int(request.match_info["number"])
+        per_page = min(int(request.query.get("per_page", "30")), PER_PAGE_MAX)
+        page = int(request.query.get("page", "1"))
+        files = self.files(pr_number)
+        last = max(1, -(-len(files) // per_page))
+        listed = [
+            {
+                "filename": filename,
+                "status": "added",
+                "sha": blob_sha(content),
+                "additions": len(content.splitlines()),
+                "deletions": 0,
+                "changes": len(content.splitlines()),
+                "patch": "@@ -0,0 +1,%d @@\n" % len(content.splitlines())
+                         + "\n".join("+" + line for line in content.splitlines()),
+            }
+            for filename, content in files[(page - 1) * per_page:page * per_page]
+        ]
+        headers = self._headers()
+        if last > 1:
+            headers["Link"] = f'<{request.url.with_query(per_page=per_page, page=last)}>; rel="last"'
+        return web.json_response(listed, headers=headers)
+
+    def _pr_of_ref(self, owner, repo, ref):
+        for pr_number in self._files:
+            if head_sha(owner, repo, pr_number) == ref:
+                return pr_number
+        return None
+
+    async def contents(self, request):
+        await self._respond(request)
+        owner, repo = request.match_info["owner"], request.match_info["repo"]
+        pr_number = self._pr_of_ref(owner, repo, request.query.get("ref"))
+        files = dict(self.files(pr_number)) if pr_number is not None else {}
+        content = files.get(request.match_info["path"])
+        if content is None:
+            return web.json_response({"message": "Not Found"}, status=404, headers=self._headers())
+        return web.json_response({
+            "type": "file",
+            "encoding": "base64",
+            "size": len(content),
+            "content": base64.b64encode(content.encode()).decode(),
+        }, headers=self._headers())
+
+    async def tarball(self, request):
+        await self._respond(request)
+        owner, repo, ref = request.match_info["owner"], request.match_info["repo"], request.match_info["ref"]
+        pr_number = self._pr_of_ref(owner, repo, ref)
+        if pr_number is None:
+            return web.json_response({"message": "Not Found"}, status=404, headers=self._headers())
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+            for filename, content in self.files(pr_number):
+                data = content.encode()
+                member = tarfile.TarInfo(f"{owner}-{repo}-{ref[:7]}/{filename}")
+                member.size = len(data)
+                tar.addfile(member, io.BytesIO(data))
+        return web.Response(body=buffer.getvalue(), content_type="application/x-gzip", headers=self._headers())
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/repos/{owner}/{repo}/pulls/{number}", self.pull)
+        app.router.add_get("/repos/{owner}/{repo}/pulls/{number}/files", self.pull_files)
+        app.router.add_get("/repos/{owner}/{repo}/contents/{path:.+}", self.contents)
+        app.router.add_get("/repos/{owner}/{repo}/tarball/{ref}", self.tarball)
+        return app
+
+    def start(self):
+        """Serves on a free local port from a daemon thread; returns the base URL."""
+        ready = threading.Event()
+        holder = {}
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            runner = web.AppRunner(self.app(), access_log=None)
+            loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            loop.run_until_complete(site.start())
+            holder["port"] = site._server.sockets[0].getsockname()[1]
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, name="fake-github", daemon=True).start()
+        ready.wait()
+        return f"http://127.0.0.1:{holder['port']}"
@@ -0,0 +1,100 @@
+"""
+Stand-in for the Gemini chat model: answers review prompts with well-formed JSON after a
+configurable latency, and enforces a provider-side request rate by failing calls over it with a
+429 RESOURCE_EXHAUSTED error, the way the real API does.
+
+    install_fake_llm(latency=0.5, requests_per_second=10)
+"""
+import json
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Any, List, Optional
+from pydantic import PrivateAttr
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from app import llm_garden
+from app.fetch_pr_github import FORMATTED_HEADER_REGEX
+
+
+class FakeReviewLLM(BaseChatModel):
+    """Returns one review per file header found in the prompt (a batch if the prompt asks for one)."""
+
+    latency: float = 0.5
+    jitter: float = 0.2
+    # Provider-side limit; 0 means unlimited
+    requests_per_second: float = 0
+    # Reset by llm_garden when the event loop changes, like the real client's transport
+    async_client_running: Any = None
+    calls: int = 0
+    throttled: int = 0
+    _recent: Any = PrivateAttr(default_factory=deque)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self):
+        return "fake-review"
+
+    def _admit(self):
+        with self._lock:
+            self.calls += 1
+            if not self.requests_per_second:
+                return
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.requests_per_second:
+                self.throttled += 1
+                raise RuntimeError("429 RESOURCE_EXHAUSTED: fake quota exceeded")
+            self._recent.append(now)
+
+    def _delay(self):
+        return max(0.0, self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _answer(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        filenames = [m.group(1) for m in FORMATTED_HEADER_REGEX.finditer(prompt)]
+        reviews = [
+            {
+                "file_name": filename,
+                "issues": [{
+                    "type": "best_practice",
+                    "line": 1,
+                    "description": "Synthetic finding",
+                    "suggestion": "None, this is a benchmark",
+                }],
+                "summary": {"issues": 1},
+            }
+            for filename in dict.fromkeys(filenames)
+        ] or [{"file_name": "unknown", "issues": [], "summary": {}}]
+        if "one review per file" in prompt:
+            payload = {"reviews": reviews}
+        else:
+            payload = reviews[0]
+        message = AIMessage(content="```json\n" + json.dumps(payload) + "\n```")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        self._admit()
+        time.sleep(self._delay())
+        return self._answer(messages)
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        self._admit()
+        await asyncio.sleep(self._delay())
+        return self._answer(messages)
+
+
+def install_fake_llm(latency=0.5, requests_per_second=0, jitter=0.2, model=llm_garden.LLM_MODEL):
+    """
+    Makes every chain of this process use a FakeReviewLLM. It keeps the app's shared rate
+    limiter, so client-side throttling is measured as in production.
+    """
+    llm = FakeReviewLLM(latency=latency, jitter=jitter, requests_per_second=requests_per_second,
+                        rate_limiter=llm_garden.rate_limiter)
+    llm_garden._llms[model] = llm
+    llm_garden._chains.clear()
+    return llm
@@ -0,0 +1,68 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import app.analysis_pool as analysis_pool
+from app.analysis_cache import analysis_cache_key
+from app.cache import TieredCache
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def test_daemonic_processes_analyze_in_threads(monkeypatch):
+    # Celery prefork children are daemonic: starting the process pool there always fails
+    monkeypatch.setattr(multiprocessing.current_process(), "daemon", True)
+    pool = analysis_pool._build_pool()
+    try:
+        assert isinstance(pool, ThreadPoolExecutor)
+    finally:
+        pool.shutdown()
+
+
+@pytest.fixture
+def shared_cache(monkeypatch):
+    """The analysis cache on a fake Redis, and an analyzer counting its runs."""
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(analysis_pool, "analysis_cache", TieredCache("analysis", 16, 1 << 20, client=client))
+    monkeypatch.setattr(analysis_pool, "ANALYSIS_CLAIM_POLL_SECONDS", 0.01)
+    runs = []
+
+    async def fake_run(code_hunk):
+        runs.append(code_hunk)
+        await asyncio.sleep(0.05)
+        return "report"
+
+    monkeypatch.setattr(analysis_pool, "_run_in_pool", fake_run)
+    return client, runs
+
+
+def test_cancelled_callers_still_cache_the_report(shared_cache):
+    client, runs = shared_cache
+
+    async def scenario():
+        caller = asyncio.create_task(analysis_pool.analyze_code("x = 1"))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0.1)
+        return await analysis_pool.analyze_code("x = 1")
+
+    assert asyncio.run(scenario()) == "report"
+    assert len(runs) == 1
+    assert analysis_pool._in_flight == {}
+
+
+def test_content_another_worker_is_analyzing_is_not_analyzed_again(shared_cache):
+    client, runs = shared_cache
+    other_worker = TieredCache("analysis", 16, 1 << 20, client=client)
+    key = analysis_cache_key("y = 2")
+    assert other_worker.remote.claim(key, "other", 60)
+
+    async def scenario():
+        waiting = asyncio.create_task(analysis_pool.analyze_code("y = 2"))
+        await asyncio.sleep(0.05)
+        await other_worker.set(key, "their report")
+        await other_worker.release(key, "other")
+        return await waiting
+
+    assert asyncio.run(scenario()) == "their report"
+    assert runs == []
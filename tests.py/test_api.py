@@ -18,7 +18,7 @@ def fake_pr_data():
 def test_post_analyze_pr(fake_pr_data):
     # Patch Celery task to return fake UUID immediately
     fake_task_id = str(uuid.uuid4())
-    with patch("app.main.analyze_pr.delay") as mock_task:
+    with patch("app.main.analyze_pr.apply_async") as mock_task:
         mock_task.return_value.id = fake_task_id
         response = client.post("/analyze-pr", json=fake_pr_data)
         assert response.status_code == 200
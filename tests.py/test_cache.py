@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.cache import RedisLRUCache, TieredCache
+from app.analysis_cache import analysis_cache_key
+
+
+@pytest.fixture
+def cache():
+    return RedisLRUCache("test", max_bytes=10, ttl=60, client=fakeredis.FakeRedis())
+
+
+def test_get_set_and_counters(cache):
+    assert cache.get("a") is None
+    cache.set("a", "1234")
+    assert cache.get("a") == b"1234"
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["bytes"] == 4
+
+
+def test_evicts_least_recently_used(cache):
+    cache.set("a", "1234")
+    cache.set("b", "1234")
+    cache.get("a")  # "b" is now the oldest entry
+    cache.set("c", "1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234"
+    assert cache.get("c") == b"1234"
+    assert cache.stats()["bytes"] == 8
+
+
+def test_get_many(cache):
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get_many(["a", "b", "c"]) == {"a": b"1", "b": b"2"}
+    assert cache.stats()["misses"] == 1
+
+
+def test_redis_errors_behave_as_miss():
+    class BrokenRedis:
+        def __getattr__(self, name):
+            def fail(*args, **kwargs):
+                raise ConnectionError("redis down")
+            return fail
+
+    cache = RedisLRUCache("test", max_bytes=10, client=BrokenRedis())
+    cache.set("a", "1")
+    assert cache.get("a") is None
+
+
+def test_tiered_cache_promotes_remote_hits():
+    client = fakeredis.FakeRedis()
+    writer = TieredCache("tiered", max_entries=1, max_bytes=100, client=client)
+    reader = TieredCache("tiered", max_entries=1, max_bytes=100, client=client)
+    asyncio.run(writer.set("a", "report"))
+    assert asyncio.run(reader.get("a")) == b"report"
+    assert asyncio.run(reader.get("a")) == b"report"
+    assert asyncio.run(reader.get("b")) is None
+    stats = reader.stats()
+    assert (stats["remote_hits"], stats["local_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_analysis_cache_key_ignores_formatting():
+    raw = "def foo():\r\n    return 1   \r\n\r\n"
+    formatted = "--- Content for: vendored/foo.py ---\n1: def foo():\n2:     return 1"
+    assert analysis_cache_key(raw) == analysis_cache_key(formatted)
+    assert analysis_cache_key(raw) != analysis_cache_key("def foo():\n    return 2")
+
+
+def test_expired_entries_leave_the_accounting(cache):
+    cache.set("a", "1234")
+    cache.set("b", "1234")
+    cache.client.delete(cache._key("entry", "a"))  # as when its TTL runs out
+    cache.set("c", "12")
+    stats = cache.stats()
+    assert stats["bytes"] == 6
+    assert stats["entries"] == 2
+    assert stats["expirations"] == 1
+    assert "evictions" not in stats
+    assert cache.get("b") == b"1234"
+
+
+def test_file_contents_are_shared_by_blob_sha(monkeypatch):
+    from app import github_cache, fetch_pr_github
+    monkeypatch.setattr(github_cache, "github_cache", RedisLRUCache("github", 1 << 20, client=fakeredis.FakeRedis()))
+    downloads = []
+
+    async def fake_download(owner, repo, filenames, ref, token):
+        downloads.append(list(filenames))
+        return [{"filename": name, "content": f"{name}@{ref}", "error": None} for name in filenames]
+
+    monkeypatch.setattr(fetch_pr_github, "download_files", fake_download)
+    blob = "b" * 40
+    first = asyncio.run(fetch_pr_github.fetch_files("o", "r", ["a.py"], "1" * 40, "t", {"a.py": blob}))
+    # A later push (another commit) whose a.py is unchanged, and .gitattributes without a blob SHA
+    second = asyncio.run(fetch_pr_github.fetch_files("o", "r", ["a.py", ".gitattributes"], "2" * 40, "t",
+                                                     {"a.py": blob}))
+    assert second[0]["content"] == first[0]["content"]
+    assert downloads == [["a.py"], [".gitattributes"]]
@@ -0,0 +1,42 @@
+from app.chunker import chunk_file, merge_chunk_reviews
+from app.fetch_pr_github import format_file_content
+
+SOURCE = "import os\n\n\n" + "\n\n".join(
+    f"def func_{i}():\n" + "".join(f"    value_{j} = os.sep * {j}\n" for j in range(20)) + "    return value_0\n"
+    for i in range(6)
+)
+
+
+def test_small_file_is_one_chunk():
+    pr_file = format_file_content(SOURCE, "a.py")
+    outline, chunks = chunk_file(pr_file, budget=10**6)
+    assert outline == ""
+    assert [text for _, _, text in chunks] == [pr_file]
+
+
+def test_large_file_splits_at_function_boundaries():
+    pr_file = format_file_content(SOURCE, "a.py")
+    outline, chunks = chunk_file(pr_file, budget=500)
+    assert len(chunks) > 1
+    assert "import os" in outline and "def func_5():" in outline
+    lines = SOURCE.splitlines()
+    for first, last, text in chunks:
+        assert text.splitlines()[0] == "--- Content for: a.py ---"
+        # every chunk but the first starts with a def, so no function is cut in half
+        code = [line for line in lines[first - 1:last] if line.strip()]
+        assert first == 1 or code[0].startswith("def ")
+    # chunks cover the file exactly once, in order
+    covered = [n for first, last, _ in chunks for n in range(first, last + 1)]
+    assert covered == list(range(1, len(lines) + 1))
+
+
+def test_merge_shifts_relative_lines_and_sums_summary():
+    reviews = [
+        {"issues": [{"type": "bug", "line": 5, "description": "a"}], "summary": {"bug": 1}},
+        {"issues": [{"type": "bug", "line": 2, "description": "b"},
+                    {"type": "style", "line": 42, "description": "c"}], "summary": {"bug": 1, "note": "x"}},
+    ]
+    merged = merge_chunk_reviews("a.py", [(1, 30), (31, 60)], reviews)
+    assert merged["file_name"] == "a.py"
+    assert [i["line"] for i in merged["issues"]] == [5, 32, 42]
+    assert merged["summary"] == {"bug": 2, "note": ["x"]}
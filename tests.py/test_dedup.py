@@ -0,0 +1,74 @@
+import pytest
+from unittest.mock import patch
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import app.dedup as dedup
+import app.lanes as lanes
+import app.redis_store as redis_store
+from fastapi.testclient import TestClient
+from app.main import app
+
+client = TestClient(app)
+
+PR = {"repo_url": "https://github.com/o/r", "pr_number": 1, "github_token": "t"}
+# Head SHA GitHub reports for the PR, per token; a token missing here can't read the PR
+heads = {}
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis_store, "r", fake)
+    monkeypatch.setattr(dedup, "r", fake)
+    monkeypatch.setattr(lanes, "r", fake)
+    monkeypatch.setattr(lanes, "LANE_ESTIMATE_COST", False)
+    heads.clear()
+    heads["t"] = "abc"
+
+    def fake_head_sha(owner, repo, pr_number, token):
+        if token not in heads:
+            raise Exception("GitHub API Error: 404 Not Found")
+        return heads[token]
+
+    monkeypatch.setattr(dedup, "get_pr_head_sha", fake_head_sha)
+
+
+@pytest.fixture
+def queued():
+    with patch("app.main.analyze_pr.apply_async") as apply_async:
+        apply_async.side_effect = lambda args, task_id, **options: type("Task", (), {"id": task_id})()
+        yield apply_async
+
+
+def test_duplicates_join_the_running_task_and_get_its_result(queued):
+    first = client.post("/analyze-pr", json=PR).json()
+    second = client.post("/analyze-pr", json=PR).json()
+    assert second == {"task_id": first["task_id"], "status": "pending", "deduplicated": True}
+
+    redis_store.set_final_result(first["task_id"], [{"file_name": "a.py"}])
+    third = client.post("/analyze-pr", json=PR).json()
+    assert third["results"] == [{"file_name": "a.py"}]
+    assert queued.call_count == 1
+
+
+def test_force_new_head_and_failed_runs_queue_again(queued):
+    first = client.post("/analyze-pr", json=PR).json()
+    assert client.post("/analyze-pr", json=dict(PR, force=True)).json()["task_id"] != first["task_id"]
+    heads["t"] = "def"
+    assert client.post("/analyze-pr", json=PR).json()["status"] == "queued"
+
+    redis_store.set_task_status(client.post("/analyze-pr", json=PR).json()["task_id"], "failed")
+    assert client.post("/analyze-pr", json=PR).json()["status"] == "queued"
+    assert queued.call_count == 4
+
+
+def test_callers_who_cannot_read_the_pr_never_join_its_task(queued):
+    first = client.post("/analyze-pr", json=PR).json()
+    redis_store.set_final_result(first["task_id"], [{"file_name": "a.py"}])
+
+    # Knowing the repository, PR and head isn't enough: GitHub must show the PR to the caller's token
+    stranger = client.post("/analyze-pr", json=dict(PR, github_token="other")).json()
+    assert stranger["task_id"] != first["task_id"]
+    assert "results" not in stranger and stranger["status"] == "queued"
+    assert queued.call_count == 2
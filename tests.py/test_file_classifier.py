@@ -0,0 +1,57 @@
+import asyncio
+from app.file_classifier import classify_files, parse_gitattributes, glob_match, detect_language
+from app.analysis_pool import analyze_code
+from app.process_pr_review import carried_reviews
+
+
+def meta(filename, changes=10, patch="@@ -1 +1 @@\n+x = 1", status="modified"):
+    f = {"filename": filename, "status": status, "sha": filename, "additions": changes,
+         "deletions": 0, "changes": changes}
+    if patch is not None:
+        f["patch"] = patch
+    return f
+
+
+def test_classification_from_metadata_only():
+    files = [
+        meta("app/main.py"),
+        meta("web/package-lock.json", 4000),
+        meta("static/logo.png", 0, patch=None),
+        meta("web/node_modules/x/index.js"),
+        meta("api/service_pb2.py"),
+        meta("web/bundle.js", patch="@@ -0,0 +1 @@\n+" + "a" * 5000),
+        meta("tests/fixtures/users.json", 900),
+        meta("big.py", 20000, patch=None),
+        meta("src/client.ts"),
+        meta("gen/api.ts"),
+    ]
+    attributes = parse_gitattributes("# generated\ngen/** linguist-generated\n*.ts -linguist-generated\n"
+                                     "gen/*.ts linguist-generated=true\n")
+    kept, skipped = classify_files(files, attributes)
+
+    assert [name for name, _ in skipped] == ["web/package-lock.json", "static/logo.png", "web/node_modules/x/index.js"]
+    reasons = {f["filename"]: f["summary"]["summary"]["not_reviewed"] for f in kept if "summary" in f}
+    assert reasons == {
+        "api/service_pb2.py": "generated",
+        "web/bundle.js": "minified or generated",
+        "tests/fixtures/users.json": "data file",
+        "big.py": "too large to review",
+        "gen/api.ts": "generated",
+    }
+    assert [f["language"] for f in kept if "summary" not in f] == ["python", "typescript"]
+
+    # Summarized files are carried into the results without being fetched or reviewed
+    carried = carried_reviews(kept, {})
+    assert set(carried) == set(reasons) and carried["big.py"]["review"]["file_name"] == "big.py"
+
+
+def test_globs_and_languages():
+    assert glob_match("*.min.js", "a/b/c.min.js")
+    assert glob_match("**/vendor/**", "vendor/lib.go") and glob_match("**/vendor/**", "x/vendor/y/lib.go")
+    assert glob_match("dist/**", "dist/a/b.js") and not glob_match("dist/**", "src/dist/a.js")
+    assert detect_language("Dockerfile") == "dockerfile" and detect_language("notes.unknown") == "text"
+
+
+def test_only_languages_with_an_analyzer_are_analyzed():
+    report = asyncio.run(analyze_code("--- Content for: web/app.js ---\n1: let x = 1"))
+    assert report.startswith("No static analyzer for javascript")
@@ -0,0 +1,106 @@
+import io
+import asyncio
+import tarfile
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import app.github_archive as github_archive
+import app.fetch_pr_github as fetch_pr_github
+
+
+def tarball(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for path, content in files.items():
+            data = content.encode()
+            member = tarfile.TarInfo(f"o-r-abc1234/{path}")
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def serve_archive(monkeypatch, files):
+    """Answers archive downloads with a tarball of `files`; returns the list of requested URLs."""
+    body = tarball(files)
+    requested = []
+
+    class FakeContent:
+        async def iter_chunked(self, size):
+            for start in range(0, len(body), 512):
+                await asyncio.sleep(0)
+                yield body[start:start + 512]
+
+    class FakeResponse:
+        status = 200
+        content = FakeContent()
+
+    @asynccontextmanager
+    async def fake_get(url, headers, priority):
+        requested.append(url)
+        yield FakeResponse()
+
+    monkeypatch.setattr(github_archive, "github_get", fake_get)
+    return requested
+
+
+def test_concurrent_archives_dont_exhaust_the_default_executor(monkeypatch):
+    files = {f"pkg/m{i}.py": f"x = {i}\n" * 2000 for i in range(5)}
+    serve_archive(monkeypatch, files)
+
+    async def scenario():
+        # Far more archives in flight than default executor threads
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(2))
+        return await asyncio.wait_for(asyncio.gather(*(
+            github_archive.fetch_archive_members("https://api/tarball", {}, ["pkg/m3.py"]) for _ in range(8)
+        )), timeout=30)
+
+    results = asyncio.run(scenario())
+    assert results == [{"pkg/m3.py": files["pkg/m3.py"]}] * 8
+
+
+def test_archive_members_stream_in_windows(monkeypatch):
+    files = {f"pkg/m{i}.py": f"x = {i}\n" for i in range(10)}
+    serve_archive(monkeypatch, files)
+    wanted = [f"pkg/m{i}.py" for i in range(9)]
+
+    async def scenario():
+        return [batch async for batch in github_archive.iter_archive_members("https://api/tarball", {}, wanted, 4)]
+
+    batches = asyncio.run(asyncio.wait_for(scenario(), timeout=30))
+    assert [len(batch) for batch in batches] == [4, 4, 1]
+    assert {path: text for batch in batches for path, text in batch.items()} == {path: files[path] for path in wanted}
+
+
+def test_big_prs_are_fetched_from_one_streamed_archive(monkeypatch):
+    # f0.py is cached, f7.py isn't in the archive
+    files = {f"f{i}.py": f"x = {i}\n" for i in range(7)}
+    requested = serve_archive(monkeypatch, files)
+    downloaded = []
+    stored = {}
+
+    async def fake_cached(owner, repo, filenames, ref, blob_shas=None):
+        return {"f0.py": files["f0.py"]} if "f0.py" in filenames else {}
+
+    async def fake_store(owner, repo, contents, ref, blob_shas=None):
+        stored.update(contents)
+
+    async def fake_download(owner, repo, filenames, ref, token, concurrency=None):
+        downloaded.extend(filenames)
+        return [{"filename": name, "content": "x = 7\n", "error": None} for name in filenames]
+
+    monkeypatch.setattr(fetch_pr_github, "ARCHIVE_FETCH_THRESHOLD", 4)
+    monkeypatch.setattr(fetch_pr_github, "get_cached_blobs", fake_cached)
+    monkeypatch.setattr(fetch_pr_github, "store_blobs", fake_store)
+    monkeypatch.setattr(fetch_pr_github, "fetch_files_concurrently", fake_download)
+    pr_files = [{"filename": f"f{i}.py", "sha": f"s{i}"} for i in range(8)]
+
+    async def scenario():
+        return [window async for window in fetch_pr_github.iter_formatted_files(
+            "o", "r", 1, pr_files, "head", "token", 3, "full"
+        )]
+
+    windows = asyncio.run(asyncio.wait_for(scenario(), timeout=30))
+    assert requested == [f"{fetch_pr_github.API_URL}/repos/o/r/tarball/head"]
+    assert downloaded == ["f7.py"]
+    assert all(len(window) <= 3 for window in windows)
+    assert sorted(name for window in windows for name, _ in window) == sorted(f["filename"] for f in pr_files)
+    assert set(stored) == {f"f{i}.py" for i in range(1, 8)}
@@ -0,0 +1,54 @@
+import time
+import asyncio
+import app.github_scheduler as github_scheduler
+from app.github_scheduler import GitHubScheduler
+
+HEADERS = {"Authorization": "token t"}
+
+
+class FakeResponse:
+    status = 200
+    headers = {}
+
+    def release(self):
+        pass
+
+
+class FakeSession:
+    async def get(self, url, headers=None):
+        return FakeResponse()
+
+
+def test_slot_is_held_until_the_response_is_released(monkeypatch):
+    monkeypatch.setattr(github_scheduler, "get_github_session", lambda: FakeSession())
+    scheduler = GitHubScheduler(max_concurrent=1)
+    monkeypatch.setattr(github_scheduler, "scheduler", scheduler)
+    budget = scheduler.budget_for(HEADERS)
+
+    async def scenario():
+        async with github_scheduler.github_get("https://api/x", HEADERS):
+            # Reading the body: a second request has to wait for the slot
+            second = asyncio.create_task(scheduler.send("https://api/y", HEADERS))
+            await asyncio.sleep(0.01)
+            assert not second.done() and budget.in_flight == 1
+        await second
+        scheduler.release(budget)
+
+    asyncio.run(scenario())
+    assert budget.in_flight == 0
+
+
+def test_cancelled_while_paced_gives_the_slot_back(monkeypatch):
+    monkeypatch.setattr(github_scheduler, "get_github_session", lambda: FakeSession())
+    scheduler = GitHubScheduler(max_concurrent=1)
+    budget = scheduler.budget_for(HEADERS)
+    budget.paused_until = time.time() + 60
+
+    async def scenario():
+        paced = asyncio.create_task(scheduler.send("https://api/x", HEADERS))
+        await asyncio.sleep(0.01)
+        paced.cancel()
+        await asyncio.gather(paced, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert budget.in_flight == 0
@@ -0,0 +1,41 @@
+import asyncio
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import app.redis_store as redis_store
+import app.process_pr_review as process_pr_review
+
+
+def test_only_files_with_new_blobs_are_reviewed_again(monkeypatch):
+    monkeypatch.setattr(redis_store, "r", fakeredis.FakeRedis())
+    blobs = {"a.py": "1", "b.py": "2", "c.py": "3"}
+    fetched = []
+
+    async def fake_snapshot(owner, repo, pr_number, token):
+        return "info", {"head": {"sha": "head-" + "".join(blobs.values())}}, [
+            {"filename": name, "sha": sha} for name, sha in blobs.items()
+        ]
+
+    async def fake_fetch(owner, repo, pr_number, files, ref, token, window, mode, ranges=None):
+        fetched.append([f["filename"] for f in files])
+        yield [(f["filename"], f"--- Content for: {f['filename']} ---\n1: x = {f['sha']}") for f in files]
+
+    async def fake_review(pr_info, pr_files, batch):
+        return [{"file_name": pr_files[i].split()[3], "blob": pr_files[i][-1]} for i in batch]
+
+    async def fake_analyze(code):
+        return "no findings"
+
+    monkeypatch.setattr(process_pr_review, "fetch_pr_snapshot", fake_snapshot)
+    monkeypatch.setattr(process_pr_review, "iter_formatted_files", fake_fetch)
+    monkeypatch.setattr(process_pr_review, "review_files", fake_review)
+    monkeypatch.setattr(process_pr_review, "analyze_code", fake_analyze)
+
+    asyncio.run(process_pr_review.review_pr_agents("https://github.com/o/r", 1, "token"))
+    blobs["b.py"] = "9"
+    reviews = asyncio.run(process_pr_review.review_pr_agents("https://github.com/o/r", 1, "token"))
+
+    assert fetched == [["a.py", "b.py", "c.py"], ["b.py"]]
+    assert [(r["file_name"], r["blob"]) for r in reviews] == [("a.py", "1"), ("b.py", "9"), ("c.py", "3")]
+    assert redis_store.get_pr_review_state("o", "r", 1)["head_sha"] == "head-193"
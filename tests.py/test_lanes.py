@@ -0,0 +1,81 @@
+import pytest
+from unittest.mock import patch
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import app.lanes as lanes
+import app.dedup as dedup
+import app.redis_store as redis_store
+from fastapi.testclient import TestClient
+from app.main import app
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    for module in (redis_store, dedup, lanes):
+        monkeypatch.setattr(module, "r", fake)
+
+
+@pytest.fixture
+def queued():
+    with patch("app.main.analyze_pr.apply_async") as apply_async:
+        apply_async.side_effect = lambda args, task_id, **options: type("Task", (), {"id": task_id})()
+        yield apply_async
+
+
+def sized(files, lines):
+    summary = {"changed_files": files, "additions": lines, "deletions": 0, "head": {"sha": f"sha{files}"}}
+    return patch("app.lanes.get_pr_summary", return_value=summary)
+
+
+def test_choose_lane_by_cost():
+    assert lanes.choose_lane(3, 100) == lanes.LANE_FAST
+    assert lanes.choose_lane(3, 5000) == lanes.LANE_STANDARD
+    assert lanes.choose_lane(1000, 100) == lanes.LANE_BULK
+    assert lanes.choose_lane(None, None) == lanes.LANE_STANDARD
+
+
+def test_submissions_are_routed_by_size_and_share_lanes_fairly(queued, monkeypatch):
+    monkeypatch.setitem(lanes.LLM_TENANT_QUOTAS, "vip", 1.0)
+    with sized(1000, 50000):
+        bulk = client.post("/analyze-pr", json={"repo_url": "https://github.com/big/mono", "pr_number": 1,
+                                                "github_token": "t"}).json()
+    assert bulk["lane"] == lanes.LANE_BULK
+    assert queued.call_args.kwargs["queue"] == lanes.LANE_BULK
+    assert queued.call_args.kwargs["kwargs"] == {"priority": "normal", "tenant": "big", "lane": lanes.LANE_BULK}
+
+    priorities = []
+    with sized(2, 40):
+        for n in range(4):
+            client.post("/analyze-pr", json={"repo_url": "https://github.com/team/app", "pr_number": 10 + n,
+                                             "github_token": "t"})
+            priorities.append(queued.call_args.kwargs["priority"])
+        client.post("/analyze-pr", json={"repo_url": "https://github.com/other/app", "pr_number": 1,
+                                         "github_token": "t", "priority": "high", "tenant": "vip"})
+    assert queued.call_args.kwargs["queue"] == lanes.LANE_FAST
+    # A tenant with tasks already in the lane is pushed back; a fresh high-priority tenant goes first
+    assert priorities == [3, 3, 4, 4] and queued.call_args.kwargs["priority"] == 0
+
+    stats = client.get("/queues").json()
+    assert stats[lanes.LANE_FAST]["queued"] == 5 and stats[lanes.LANE_FAST]["tenants"] == {"team": 4, "vip": 1}
+    assert stats[lanes.LANE_BULK]["queued"] == 1
+
+    lanes.lane_task_started(bulk["task_id"], lanes.LANE_BULK)
+    stats = client.get("/queues").json()[lanes.LANE_BULK]
+    assert stats["queued"] == 0 and stats["running"] == 1 and stats["wait_p50_seconds"] is not None
+    lanes.lane_task_finished(bulk["task_id"], lanes.LANE_BULK, "big")
+    stats = client.get("/queues").json()[lanes.LANE_BULK]
+    assert stats["running"] == 0 and stats["tenants"] == {}
+
+
+def test_unconfigured_tenants_count_as_the_repo_owner(queued):
+    with sized(2, 40):
+        for n in range(3):
+            # A new made-up tenant per request must not reset the owner's share
+            client.post("/analyze-pr", json={"repo_url": "https://github.com/team/app", "pr_number": 20 + n,
+                                             "github_token": "t", "tenant": f"fresh-{n}"})
+    assert queued.call_args.kwargs["kwargs"]["tenant"] == "team"
+    assert client.get("/queues").json()[lanes.LANE_FAST]["tenants"] == {"team": 3}
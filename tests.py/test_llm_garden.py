@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from pydantic import BaseModel
+from langchain_core.messages import AIMessage
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.runnables import RunnableLambda
+import app.llm_garden as llm_garden
+from app.cache import TieredCache
+from app.redis_rate_limiter import RedisTokenBucketRateLimiter
+
+
+class Review(BaseModel):
+    issues: list
+
+
+class Summary(BaseModel):
+    summary: str
+
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    """Answers every LLM call with a fixed JSON message and records the prompts sent."""
+    calls = []
+
+    def answer(prompt):
+        calls.append(prompt.to_string())
+        return AIMessage(content='{"issues": []}')
+
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(llm_garden, "llm_cache", TieredCache("llm-test", 16, 10 ** 6, client=client))
+    monkeypatch.setattr(llm_garden, "rate_limiter", RedisTokenBucketRateLimiter(client=client))
+    monkeypatch.setattr(llm_garden, "get_llm", lambda model=llm_garden.LLM_MODEL: RunnableLambda(answer))
+    monkeypatch.setattr(llm_garden, "_chains", {})
+    return calls
+
+
+def run(template, input_vars, parser=None):
+    return asyncio.run(llm_garden.aexecute_chain(template, input_vars, parser))
+
+
+def test_cache_key_ignores_input_order_but_not_the_template():
+    key = llm_garden.llm_cache_key("m", "Review {code}", {"code": "x = 1", "lang": "py"})
+    assert key == llm_garden.llm_cache_key("m", "Review {code}", {"lang": "py", "code": "x = 1"})
+    assert key != llm_garden.llm_cache_key("m", "Review {code} again", {"code": "x = 1", "lang": "py"})
+    assert key != llm_garden.llm_cache_key("m", "Review {code}", {"code": "x = 2", "lang": "py"})
+    assert key != llm_garden.llm_cache_key("other", "Review {code}", {"code": "x = 1", "lang": "py"})
+
+
+def test_identical_calls_are_answered_from_the_cache(model_calls):
+    parser = JsonOutputParser(pydantic_object=Review)
+    assert run("Review {code}", {"code": "x = 1"}, parser) == {"issues": []}
+    assert run("Review {code}", {"code": "x = 1"}, parser) == {"issues": []}
+    assert len(model_calls) == 1
+
+
+def test_template_or_format_instructions_change_the_key(model_calls):
+    review = JsonOutputParser(pydantic_object=Review)
+    run("Review {code}", {"code": "x = 1"}, review)
+    run("Review this {code}", {"code": "x = 1"}, review)
+    # Same template, but the parser asks for another schema
+    run("Review {code}", {"code": "x = 1"}, JsonOutputParser(pydantic_object=Summary))
+    assert len(model_calls) == 3
+
+
+def test_calls_without_parser_are_not_cached(model_calls):
+    run("Say {word}", {"word": "hi"})
+    run("Say {word}", {"word": "hi"})
+    assert len(model_calls) == 2
+    stats = llm_garden.llm_cache.stats()
+    assert stats["misses"] == 0 and stats["local_entries"] == 0 and stats["remote"]["entries"] == 0
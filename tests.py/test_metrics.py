@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import pytest
+
+from app import metrics
+from app.logging_wrapper import log_exceptions, logger
+
+
+def test_stage_records_histogram_and_spans():
+    async def traced():
+        spans = metrics.start_trace()
+        async with metrics.stage("fetch"):
+            await asyncio.sleep(0)
+        with pytest.raises(ValueError):
+            with metrics.stage("llm_call"):
+                raise ValueError("boom")
+        return spans
+
+    spans = asyncio.run(traced())
+    assert [(s["name"], s["error"]) for s in spans] == [("fetch", False), ("llm_call", True)]
+    assert all(s["duration"] >= 0 for s in spans)
+
+    text = metrics.render_metrics()
+    assert "# TYPE pr_review_stage_seconds histogram" in text
+    assert f'pr_review_stage_seconds_bucket{{stage="fetch",process="{metrics.process_label()}",le="+Inf"}}' in text
+    assert f'pr_review_stage_errors_total{{stage="llm_call",process="{metrics.process_label()}"}}' in text
+
+
+@pytest.fixture
+def worker():
+    counter = metrics.Counter("test_worker_events", "Events counted in a worker", ["kind"])
+    yield counter
+    metrics._registry.remove(counter)
+
+
+def test_render_includes_worker_snapshots(worker):
+    worker.inc(kind="a")
+    worker.inc(2, kind="a")
+    text = metrics.render_metrics([("worker-1:42", metrics.snapshot())])
+    assert 'test_worker_events_total{kind="a",process="worker-1:42"} 3' in text
+
+
+def test_decorator_times_calls_without_logging_by_default(caplog):
+    @log_exceptions
+    def quiet():
+        return 1
+
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        assert quiet() == 1
+    assert not caplog.records
+    assert 'pr_review_function_seconds_count{function="quiet"' in metrics.render_metrics()
+
+
+def test_forked_children_report_under_their_own_label(monkeypatch):
+    parent = metrics.process_label()
+    monkeypatch.setattr(metrics.os, "getpid", lambda: 4242)
+    assert metrics.process_label() != parent
+    assert metrics.process_label().endswith(":4242")
@@ -0,0 +1,57 @@
+from app.parser import split_diff_by_file, split_hunks, changed_line_ranges
+
+DIFF = """diff --git a/app/a.py b/app/a.py
+index 111..222 100644
+--- a/app/a.py
++++ b/app/a.py
+@@ -10,6 +10,7 @@ def foo():
+     a = 1
+     b = 2
+     c = 3
++    d = 4
+     e = 5
+     f = 6
+     g = 7
+@@ -40,4 +41,3 @@ def bar():
+     x = 1
+-    y = 2
+     z = 3
+     w = 4
+diff --git a/app/b.py b/app/b.py
+new file mode 100644
+--- /dev/null
++++ b/app/b.py
+@@ -0,0 +1,2 @@
++import os
++print(os.getcwd())
+"""
+
+
+def test_split_diff_by_file():
+    parts = split_diff_by_file(DIFF)
+    assert [p["filename"] for p in parts] == ["app/a.py", "app/b.py"]
+    assert "d = 4" in parts[0]["hunk"]
+    assert "d = 4" not in parts[1]["hunk"]
+
+
+def test_split_hunks():
+    hunks = split_hunks(split_diff_by_file(DIFF)[0]["hunk"])
+    assert [(h["new_start"], h["new_count"]) for h in hunks] == [(10, 7), (41, 3)]
+    assert hunks[0]["lines"][3] == "+    d = 4"
+
+
+def test_changed_line_ranges_maps_to_head_lines():
+    file_diff = split_diff_by_file(DIFF)[0]["hunk"]
+    # Added line lands on head line 13, deletion is anchored before head line 42
+    assert changed_line_ranges(file_diff, context_lines=0) == [(13, 13), (42, 42)]
+    assert changed_line_ranges(file_diff, context_lines=2) == [(11, 15), (40, 43)]
+
+
+def test_changed_line_ranges_merges_overlaps():
+    file_diff = split_diff_by_file(DIFF)[0]["hunk"]
+    assert changed_line_ranges(file_diff, context_lines=20) == [(1, 61)]
+
+
+def test_changed_line_ranges_new_file():
+    file_diff = split_diff_by_file(DIFF)[1]["hunk"]
+    assert changed_line_ranges(file_diff, context_lines=3) == [(1, 5)]
@@ -0,0 +1,80 @@
+import asyncio
+import app.process_pr_review as process_pr_review
+
+
+def test_huge_pr_streams_through_bounded_stages(monkeypatch):
+    monkeypatch.setattr(process_pr_review, "PIPELINE_FETCH_WINDOW", 4)
+    monkeypatch.setattr(process_pr_review, "PIPELINE_QUEUE_SIZE", 1)
+    monkeypatch.setattr(process_pr_review, "PIPELINE_ANALYZE_WORKERS", 1)
+    monkeypatch.setattr(process_pr_review, "PIPELINE_REVIEW_WORKERS", 2)
+    changed = [{"filename": f"f{i}.py"} for i in range(200)]
+    in_flight = {"now": 0, "max": 0}
+    done = []
+
+    async def fake_fetch(owner, repo, pr_number, files, ref, token, window, mode, ranges=None):
+        for start in range(0, len(files), window):
+            in_flight["now"] += len(files[start:start + window])
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            # f13.py can't be fetched
+            yield [(f["filename"], f"--- Content for: {f['filename']} ---\n1: x = 1")
+                   for f in files[start:start + window] if f["filename"] != "f13.py"]
+
+    async def fake_analyze(code):
+        return "no findings"
+
+    async def fake_review(pr_info, pr_files, batch):
+        await asyncio.sleep(0.001)
+        return [{"file_name": pr_files[i].split()[3]} for i in batch]
+
+    def on_result(index, result):
+        in_flight["now"] -= 1
+        done.append(index)
+
+    monkeypatch.setattr(process_pr_review, "iter_formatted_files", fake_fetch)
+    monkeypatch.setattr(process_pr_review, "analyze_code", fake_analyze)
+    monkeypatch.setattr(process_pr_review, "review_files", fake_review)
+
+    position = {f["filename"]: i for i, f in enumerate(changed)}
+    by_file = asyncio.run(process_pr_review.review_changed_files(
+        "info", "o", "r", 1, changed, "sha", "token", "full", position, on_result
+    ))
+
+    assert sorted(done) == list(range(200))
+    assert isinstance(by_file["f13.py"], RuntimeError)
+    assert by_file["f199.py"] == {"file_name": "f199.py"}
+    # Fetching waits for reviews: the files held at once don't grow with the PR
+    assert in_flight["max"] <= 40
+
+
+def test_planned_files_keep_no_patches(monkeypatch):
+    monkeypatch.setattr(process_pr_review, "INCREMENTAL_REVIEW", False)
+    seen_patches = []
+    plans = []
+
+    async def fake_snapshot(owner, repo, pr_number, token):
+        return "info", {"head": {"sha": "head"}}, [
+            {"filename": f"f{i}.py", "sha": f"s{i}", "status": "modified", "language": "python",
+             "additions": 1, "deletions": 0, "patch": "@@ -1 +1 @@\n-x = 0\n+x = 1\n" * 1000}
+            for i in range(3)
+        ]
+
+    async def fake_ranges(owner, repo, pr_number, files, token):
+        seen_patches.extend(f.get("patch") for f in files)
+        return {f["filename"]: [(1, 6)] for f in files}
+
+    def fan_out(plan):
+        plans.append(plan)
+        return True
+
+    monkeypatch.setattr(process_pr_review, "fetch_pr_snapshot", fake_snapshot)
+    monkeypatch.setattr(process_pr_review, "fetch_changed_ranges", fake_ranges)
+
+    asyncio.run(process_pr_review.review_pr_agents("https://github.com/o/r", 1, "token", "diff", fan_out=fan_out))
+
+    # The ranges were computed from the patches, which aren't kept afterwards
+    assert len(seen_patches) == 3 and all(seen_patches)
+    plan = plans[0]
+    assert plan["ranges"] == {f"f{i}.py": [(1, 6)] for i in range(3)}
+    assert plan["changed"] == [{"filename": f"f{i}.py", "sha": f"s{i}", "status": "modified", "language": "python"}
+                               for i in range(3)]
+    assert all("patch" not in f for f in plan["files"])
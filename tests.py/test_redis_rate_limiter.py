@@ -0,0 +1,75 @@
+import time
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from redis.exceptions import ConnectionError
+import app.redis_rate_limiter as redis_rate_limiter
+from app.redis_rate_limiter import RedisTokenBucketRateLimiter, llm_request_context
+
+
+def limiter(client=None, **kwargs):
+    # A rate low enough that the bucket doesn't noticeably refill during a test
+    options = dict(requests_per_second=0.001, max_bucket_size=3, min_requests_per_second=0.0001)
+    options.update(kwargs)
+    return RedisTokenBucketRateLimiter(key="ratelimit:test", client=client or fakeredis.FakeRedis(), **options)
+
+
+def take(bucket, priority="normal", tenant=None):
+    with llm_request_context(priority, tenant):
+        return bucket.acquire(blocking=False)
+
+
+def test_lower_priorities_leave_a_reserve_for_higher_ones():
+    bucket = limiter()
+    assert take(bucket, "low")
+    # Low priority must leave two tokens, normal one, high none
+    assert not take(bucket, "low")
+    assert take(bucket, "normal")
+    assert not take(bucket, "normal")
+    assert take(bucket, "high")
+    assert not take(bucket, "high")
+
+
+def test_tenant_buckets_limit_each_tenant_on_its_own(monkeypatch):
+    monkeypatch.setattr(redis_rate_limiter, "LLM_TENANT_QUOTAS", {"acme": 0.001, "globex": 0.001})
+    bucket = limiter(max_bucket_size=10)
+    assert take(bucket, "high", "acme")
+    assert not take(bucket, "high", "acme")
+    # Another tenant, or a tenant without a quota, only draws from the shared bucket
+    assert take(bucket, "high", "globex")
+    assert take(bucket, "high", "initech")
+    assert take(bucket, "high", "initech")
+
+
+def test_rate_halves_on_throttling_and_grows_back_within_bounds():
+    bucket = limiter(requests_per_second=1.0, min_requests_per_second=0.2)
+    bucket.report_throttled()
+    assert bucket.current_rate() == pytest.approx(0.5)
+    bucket.report_throttled()
+    bucket.report_throttled()
+    assert bucket.current_rate() == pytest.approx(0.2)
+
+    bucket.report_success()
+    assert bucket.current_rate() == pytest.approx(0.25)
+    for _ in range(30):
+        bucket.report_success()
+    assert bucket.current_rate() == pytest.approx(1.0)
+
+
+def test_falls_back_to_a_per_process_bucket_while_redis_is_down():
+    calls = []
+
+    class DownRedis(fakeredis.FakeRedis):
+        def evalsha(self, *args, **kwargs):
+            calls.append(args)
+            raise ConnectionError("redis down")
+
+    bucket = limiter(DownRedis(), requests_per_second=100, max_bucket_size=1)
+    assert bucket.acquire()
+    assert bucket.acquire()
+    bucket.report_throttled()
+    # Redis is left alone for a while instead of being retried on every call
+    assert len(calls) == 1
+    assert bucket._redis_down_until > time.monotonic()
@@ -0,0 +1,38 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import app.redis_store as redis_store
+from fastapi.testclient import TestClient
+from app.main import app
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_store, "r", fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(redis_store, "_build_async_client",
+                        lambda max_connections=None: fakeredis.FakeAsyncRedis(server=server))
+    monkeypatch.setattr(redis_store, "_aredis", None)
+
+
+def test_blobs_are_compressed_above_threshold_and_legacy_json_still_reads():
+    small, big = {"a": 1}, [{"file_name": f"f{i}.py", "issues": []} for i in range(200)]
+    assert redis_store.encode_blob(small)[:1] == b"J"
+    encoded = redis_store.encode_blob(big)
+    assert encoded[:1] in (b"Z", b"G") and len(encoded) < len(redis_store.dumps(big))
+    assert redis_store.decode_blob(encoded) == big
+    assert redis_store.decode_blob(b'[{"legacy": true}]') == [{"legacy": True}]
+
+
+def test_status_and_results_endpoints_and_ttls():
+    client = TestClient(app)
+    redis_store.init_task("t1", "https://github.com/a/b", 1)
+    assert client.get("/status/t1").json() == {"task_id": "t1", "status": "pending"}
+    assert client.get("/results/t1").status_code == 404
+
+    redis_store.set_final_result("t1", [{"file_name": "a.py"}])
+    assert client.get("/results/t1").json()["results"] == [{"file_name": "a.py"}]
+    assert 0 < redis_store.r.ttl("task:t1:result") <= redis_store.TASK_TTL
+    assert 0 < redis_store.r.ttl("task:t1:meta") <= redis_store.TASK_TTL
+    assert client.get("/status/missing").status_code == 404
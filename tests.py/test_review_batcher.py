@@ -0,0 +1,25 @@
+from app.review_batcher import pack_files, match_reviews, batch_filenames, LLM_BATCH_SMALL_FILE_TOKENS
+
+
+def formatted(name, size):
+    return f"--- Content for: {name} ---\n" + "x" * size
+
+
+def test_small_files_share_a_batch_and_large_ones_stay_alone():
+    big = formatted("big.py", LLM_BATCH_SMALL_FILE_TOKENS * 4)
+    files = [formatted("a.py", 100), big, formatted("b.py", 200)]
+    assert pack_files(files) == [[0, 2], [1]]
+
+
+def test_match_reviews_by_name_then_position():
+    files = [formatted("a.py", 10), formatted("b.py", 10)]
+    names = batch_filenames(files, [0, 1])
+    assert names == ["a.py", "b.py"]
+
+    by_name = match_reviews(names, [{"file_name": "b.py"}, {"file_name": "a.py"}])
+    assert [r["file_name"] for r in by_name] == ["a.py", "b.py"]
+
+    by_position = match_reviews(names, [{"issues": []}, {"issues": [1]}])
+    assert by_position == [{"issues": []}, {"issues": [1]}]
+
+    assert match_reviews(names, [{"file_name": "a.py"}]) == [{"file_name": "a.py"}, None]
@@ -0,0 +1,70 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import app.lanes as lanes
+import app.redis_store as redis_store
+import app.process_pr_review as process_pr_review
+import app.tasks as tasks
+
+FILES = [{"filename": f"f{i}.py", "sha": str(i)} for i in range(7)]
+
+
+@pytest.fixture
+def eager(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr(redis_store, "r", fake)
+    monkeypatch.setattr(lanes, "r", fake)
+    monkeypatch.setattr(tasks, "SHARD_FILE_THRESHOLD", 3)
+    monkeypatch.setattr(tasks, "SHARD_SIZE", 2)
+    tasks.cel.conf.task_always_eager = True
+    yield
+    tasks.cel.conf.task_always_eager = False
+
+
+def test_large_pr_is_sharded_and_only_the_failed_shard_is_retried(eager, monkeypatch):
+    shards = []
+
+    async def fake_snapshot(owner, repo, pr_number, token):
+        return "info", {"head": {"sha": "head"}}, FILES
+
+    async def fake_review(pr_info, owner, repo, pr_number, changed, head_sha, token, mode, position, on_result=None,
+                          ranges=None):
+        names = [f["filename"] for f in changed]
+        shards.append(names)
+        # The shard with f4/f5 fails completely the first time
+        fail = names == ["f4.py", "f5.py"] and shards.count(names) == 1
+        return {name: RuntimeError("LLM down") if fail else {"file_name": name} for name in names}
+
+    monkeypatch.setattr(process_pr_review, "fetch_pr_snapshot", fake_snapshot)
+    monkeypatch.setattr(tasks, "review_changed_files", fake_review)
+
+    tasks.analyze_pr.apply(args=["https://github.com/o/r", 1, "token"], task_id="t1")
+
+    assert shards == [["f0.py", "f1.py"], ["f2.py", "f3.py"], ["f4.py", "f5.py"], ["f4.py", "f5.py"], ["f6.py"]]
+    assert redis_store.get_task_status("t1")["status"] == "completed"
+    assert [r["file_name"] for r in redis_store.get_final_result("t1")] == [f["filename"] for f in FILES]
+
+
+def test_shards_count_against_the_tenant_share_until_they_finish(eager, monkeypatch):
+    sent = []
+
+    async def fake_snapshot(owner, repo, pr_number, token):
+        return "info", {"head": {"sha": "head"}}, FILES
+
+    def fake_chord(header):
+        sent.extend(sig.options["priority"] for sig in header)
+        return lambda merge: sent.append(merge.options["priority"])
+
+    monkeypatch.setattr(process_pr_review, "fetch_pr_snapshot", fake_snapshot)
+    monkeypatch.setattr(tasks, "chord", fake_chord)
+    monkeypatch.setattr(lanes, "LANE_TENANT_SHARE", 1)
+
+    lanes.lane_task_queued("t2", lanes.LANE_BULK, "acme")  # as /analyze-pr does
+    tasks.analyze_pr.apply(args=["https://github.com/o/r", 1, "token"], task_id="t2",
+                           kwargs={"priority": "high", "tenant": "acme", "lane": lanes.LANE_BULK})
+
+    # Each queued shard pushes the next one back a step; the merge keeps the request's priority
+    assert sent == [1, 2, 3, 4, 0]
+    # The PR's own task is done, its four shards still hold the tenant's share
+    assert int(lanes.r.hget(f"lane:{lanes.LANE_BULK}:tenants", "acme")) == 4
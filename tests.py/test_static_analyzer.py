@@ -115,3 +115,22 @@ def test_pylint_issues(monkeypatch):
     result = run_static_analyzer(code)
     assert "Pylint issues" in result
     assert "C0103" in result
+
+
+def test_line_too_long():
+    code = "x = '" + "a" * 120 + "'\n"
+    result = run_static_analyzer(code)
+    assert "C0301" in result
+    assert "Line too long (126/100)" in result
+
+
+def test_formatted_content_keeps_file_line_numbers():
+    # Output of format_file_regions: only lines 10-11 of the file are present
+    formatted = "\n".join([
+        "--- Changed regions for: app/x.py ---",
+        "10: def BadName():",
+        "11:     return 1",
+    ])
+    result = run_static_analyzer(formatted)
+    assert "10:0: C0103" in result
+    assert "AST analysis error" not in result
@@ -0,0 +1,65 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import app.redis_store as redis_store
+from fastapi.testclient import TestClient
+from app.main import app
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_store, "r", fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(redis_store, "_build_async_client",
+                        lambda max_connections=None: fakeredis.FakeAsyncRedis(server=server))
+    monkeypatch.setattr(redis_store, "_aredis", None)
+
+
+def test_stream_replays_file_results_and_ends_when_completed():
+    redis_store.init_task("t1", "https://github.com/a/b", 1)
+    redis_store.set_task_status("t1", "processing")
+    redis_store.set_task_total("t1", 2)
+    redis_store.add_file_result("t1", 1, {"file_name": "b.py", "issues": []})
+    redis_store.add_file_result("t1", 0, None, error="boom")
+    redis_store.set_final_result("t1", [])
+
+    with TestClient(app).stream("GET", "/stream/t1") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [line[len("event: "):] for line in response.iter_lines() if line.startswith("event: ")]
+
+    assert events == ["status", "progress", "file", "progress", "file", "progress", "status"]
+    assert [entry["index"] for entry in redis_store.get_file_results("t1")] == [1, 0]
+    assert redis_store.get_task_status("t1")["failed"] == "1"
+
+
+def test_redelivered_task_doesnt_replay_the_first_run():
+    redis_store.init_task("t2", "https://github.com/a/b", 1)
+    redis_store.add_file_result("t2", 0, {"file_name": "a.py", "issues": []})
+    redis_store.add_task_spans("t2", [{"name": "fetch", "start": 0.0, "duration": 1.0, "error": False}])
+
+    redis_store.init_task("t2", "https://github.com/a/b", 1)  # Celery redelivers the task
+    redis_store.add_file_result("t2", 0, {"file_name": "a.py", "issues": []})
+    redis_store.set_final_result("t2", [])
+
+    with TestClient(app).stream("GET", "/stream/t2") as response:
+        events = [line[len("event: "):] for line in response.iter_lines() if line.startswith("event: ")]
+    assert events == ["reset", "file", "progress", "status"]
+    assert redis_store.r.llen("task:t2:trace") == 0
+
+
+def test_connected_clients_are_told_to_discard_the_first_run():
+    redis_store.init_task("t3", "https://github.com/a/b", 1)
+    redis_store.add_file_result("t3", 0, {"file_name": "a.py", "issues": []})
+    first_run = redis_store.read_task_events("t3", "0", block_ms=None)
+    last_seen = first_run[-1][0]
+
+    redis_store.init_task("t3", "https://github.com/a/b", 1)
+    redis_store.add_file_result("t3", 0, {"file_name": "a.py", "issues": []})
+    # What a client still connected from the first run receives next
+    after = [event for _, event, _ in redis_store.read_task_events("t3", last_seen, block_ms=None)]
+    assert after == ["reset", "file", "progress"]
+
+
+def test_stream_unknown_task():
+    assert TestClient(app).get("/stream/missing").status_code == 404
@@ -0,0 +1,28 @@
+import asyncio
+import pytest
+from app.worker_runtime import run_coroutine, start_worker_runtime, stop_worker_runtime
+
+
+async def current_loop():
+    return asyncio.get_running_loop()
+
+
+def test_tasks_share_one_long_lived_loop():
+    try:
+        first = run_coroutine(current_loop())
+        assert run_coroutine(current_loop()) is first
+        assert start_worker_runtime() is first
+    finally:
+        stop_worker_runtime()
+    assert first.is_closed()
+
+
+def test_errors_propagate_to_the_task():
+    async def fail():
+        raise ValueError("boom")
+
+    try:
+        with pytest.raises(ValueError):
+            run_coroutine(fail())
+    finally:
+        stop_worker_runtime()